@@ -10,6 +10,8 @@ Kitten Cloud API - AI 桥接管理工具
   python3 ai_bridge_manager.py add          # 添加作品
   python3 ai_bridge_manager.py logs         # 查看日志
   python3 ai_bridge_manager.py clear-logs   # 清除日志
+  python3 ai_bridge_manager.py query        # 查询调用记录
+  python3 ai_bridge_manager.py latency      # 延迟分布统计
 """
 
 import os
@@ -18,7 +20,9 @@ import json
 import subprocess
 import time
 import shutil
-from datetime import datetime
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
 from pathlib import Path
 
 
@@ -59,6 +63,7 @@ PM2_AVAILABLE = setup_pm2_path()
 SCRIPT_DIR = Path(__file__).parent.resolve()
 CONFIG_DIR = SCRIPT_DIR / "ai-bridge"
 LOGS_DIR = CONFIG_DIR / "logs"
+CALL_INDEX_FILE = LOGS_DIR / "calls_index.db"
 
 RED = '\033[0;31m'
 GREEN = '\033[0;32m'
@@ -145,9 +150,53 @@ def run_command(cmd: str, capture: bool = True) -> tuple:
         return -1, str(e)
 
 
+def get_supervisor_work_ids(args) -> list:
+    """
+    从多作品进程的启动参数中解析其服务的作品ID
+    支持 --works 1,2,3 和 --works-dir <目录>
+    
+    Args:
+        args: PM2 记录的启动参数
+        
+    Returns:
+        作品ID列表
+    """
+    if isinstance(args, str):
+        args = args.split()
+    if not isinstance(args, list):
+        return []
+    
+    works_arg = None
+    works_dir = None
+    for i, arg in enumerate(args):
+        if arg.startswith('--works='):
+            works_arg = arg.split('=', 1)[1]
+        elif arg == '--works' and i + 1 < len(args):
+            works_arg = args[i + 1]
+        elif arg.startswith('--works-dir='):
+            works_dir = arg.split('=', 1)[1]
+        elif arg == '--works-dir' and i + 1 < len(args):
+            works_dir = args[i + 1]
+    
+    if works_arg:
+        return [int(w) for w in works_arg.replace(' ', ',').split(',') if w.isdigit()]
+    
+    if works_dir:
+        work_ids = []
+        for config_file in sorted(Path(works_dir).glob("config_*.py")):
+            work_id = config_file.stem.replace('config_', '')
+            if work_id.isdigit():
+                work_ids.append(int(work_id))
+        return work_ids
+    
+    return []
+
+
 def get_all_ai_bridges() -> list:
     """
     获取所有 AI 桥接实例
+    多作品进程（--works / --works-dir）中的每个作品作为一个逻辑实例返回，
+    其 name 为所在的 PM2 进程名，logical 为 True
     
     Returns:
         实例列表
@@ -179,6 +228,20 @@ def get_all_ai_bridges() -> list:
                         'memory': proc.get('monit', {}).get('memory'),
                         'online': proc.get('pm2_env', {}).get('status') == 'online'
                     })
+                    continue
+                for logical_work_id in get_supervisor_work_ids(proc.get('pm2_env', {}).get('args')):
+                    bridges.append({
+                        'name': name,
+                        'work_id': logical_work_id,
+                        'status': proc.get('pm2_env', {}).get('status'),
+                        'pid': proc.get('pid'),
+                        'uptime': proc.get('pm2_env', {}).get('pm_uptime'),
+                        'restarts': proc.get('pm2_env', {}).get('restart_time'),
+                        'cpu': proc.get('monit', {}).get('cpu'),
+                        'memory': proc.get('monit', {}).get('memory'),
+                        'online': proc.get('pm2_env', {}).get('status') == 'online',
+                        'logical': True
+                    })
         return sorted(bridges, key=lambda x: x['work_id'])
     except Exception:
         return []
@@ -200,6 +263,13 @@ def get_prompt_path(work_id) -> Path:
     return CONFIG_DIR / f"system_prompt_{work_id}.txt"
 
 
+BASE_CONFIG_KEYS = [
+    "api_base_url", "ai_api_url", "ai_api_key", "ai_model",
+    "question_prefix", "answer_prefix", "variable_name",
+    "system_prompt_file", "request_timeout", "max_retries", "log_dir"
+]
+
+
 def load_config(work_id = 'default') -> dict:
     work_id = str(work_id)
     config_file = get_config_path(work_id)
@@ -250,6 +320,12 @@ def save_config(config: dict, work_id = 'default'):
     
     prompt_file = get_prompt_path(work_id)
     
+    # 基础配置项之外的高级配置项原样保留
+    extra_lines = ""
+    for key, value in config.items():
+        if key not in BASE_CONFIG_KEYS:
+            extra_lines += f',\n    "{key}": {value!r}'
+    
     content = f'''#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
@@ -269,7 +345,7 @@ CONFIG = {{
     "system_prompt_file": "{escape_string(str(prompt_file))}",
     "request_timeout": {config.get('request_timeout', 60)},
     "max_retries": {config.get('max_retries', 5)},
-    "log_dir": "{escape_string(str(LOGS_DIR))}"
+    "log_dir": "{escape_string(str(LOGS_DIR))}"{extra_lines}
 }}
 '''
     
@@ -323,6 +399,7 @@ def show_all_status():
     print(f"{'实例名称':<25} {'作品ID':<12} {'状态':<10} {'PID':<8} {'CPU':<8} {'内存':<10}")
     print("-" * 80)
     
+    has_logical = False
     for bridge in bridges:
         status_color = GREEN if bridge['online'] else RED
         status = bridge.get('status', '未知')
@@ -331,7 +408,15 @@ def show_all_status():
         memory = bridge.get('memory', 0)
         mem_str = f"{memory / 1024 / 1024:.1f}MB" if memory else "-"
         
-        print(f"{bridge['name']:<25} {bridge['work_id']:<12} {status_color}{status:<10}{NC} {str(pid):<8} {cpu:<8} {mem_str:<10}")
+        name = bridge['name']
+        if bridge.get('logical'):
+            name = f"{name}*"
+            has_logical = True
+        
+        print(f"{name:<25} {bridge['work_id']:<12} {status_color}{status:<10}{NC} {str(pid):<8} {cpu:<8} {mem_str:<10}")
+    
+    if has_logical:
+        print("\n  * 多作品进程中的逻辑实例，CPU/内存为整个进程的占用，重启/停止将作用于整个进程")
     
     print()
 
@@ -575,10 +660,257 @@ def clear_logs():
             log_file.unlink()
         for log_file in LOGS_DIR.glob("*.json"):
             log_file.unlink()
+        for log_file in LOGS_DIR.glob("*.jsonl"):
+            log_file.unlink()
+        if CALL_INDEX_FILE.exists():
+            CALL_INDEX_FILE.unlink()
     
     log("SUCCESS", "日志已清除")
 
 
+def open_call_index() -> sqlite3.Connection:
+    """打开调用记录索引（不存在时创建）"""
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(CALL_INDEX_FILE))
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            offset INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS calls (
+            file TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            work_id TEXT,
+            status TEXT,
+            source TEXT,
+            model TEXT,
+            total_ms INTEGER,
+            question TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_calls_ts ON calls (ts);
+        CREATE INDEX IF NOT EXISTS idx_calls_work_ts ON calls (work_id, ts);
+        CREATE INDEX IF NOT EXISTS idx_calls_total ON calls (total_ms);
+    """)
+    return conn
+
+
+def update_call_index(conn: sqlite3.Connection) -> int:
+    """
+    增量更新调用记录索引：只读取每个文件上次索引位置之后新增的完整行
+    
+    Returns:
+        新索引的记录数
+    """
+    indexed = dict(conn.execute("SELECT path, offset FROM files"))
+    files = {str(p): p for p in LOGS_DIR.glob("calls_*.jsonl")} if LOGS_DIR.exists() else {}
+    added = 0
+    
+    with conn:
+        # 已删除的文件
+        for path in set(indexed) - set(files):
+            conn.execute("DELETE FROM calls WHERE file = ?", (path,))
+            conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        
+        for path, file_path in sorted(files.items()):
+            offset = indexed.get(path, 0)
+            size = file_path.stat().st_size
+            if size < offset:
+                # 文件被截断或重建，重新索引
+                conn.execute("DELETE FROM calls WHERE file = ?", (path,))
+                offset = 0
+            if size == offset:
+                continue
+            
+            rows = []
+            with open(file_path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    line_offset = offset
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    durations = record.get("durations") or {}
+                    total = durations.get("total", durations.get("ai"))
+                    rows.append((
+                        path, line_offset, record.get("ts") or 0,
+                        str(record.get("work_id")) if record.get("work_id") is not None else None,
+                        record.get("status"), record.get("source"), record.get("model"),
+                        int(total * 1000) if total is not None else None,
+                        record.get("question")
+                    ))
+            
+            conn.executemany("INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT OR REPLACE INTO files (path, offset) VALUES (?, ?)", (path, offset))
+            added += len(rows)
+    
+    return added
+
+
+def parse_time_arg(value: str) -> float:
+    """解析时间参数: 2026-01-31、2026-01-31 12:00 或相对时间 30m / 12h / 7d"""
+    units = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+    if value[-1:].lower() in units and value[:-1].isdigit():
+        delta = timedelta(**{units[value[-1].lower()]: int(value[:-1])})
+        return (datetime.now() - delta).timestamp()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"无法识别的时间: {value}")
+
+
+def query_calls(argv: list = None):
+    """查询调用记录（按作品、时间范围、状态、耗时过滤）"""
+    parser = argparse.ArgumentParser(
+        prog='ai_bridge_manager.py query',
+        description='查询 AI 调用记录'
+    )
+    parser.add_argument('-w', '--work', type=str, help='作品ID')
+    parser.add_argument('--since', type=parse_time_arg, help='起始时间，如 2026-01-31、"2026-01-31 12:00"、7d、12h')
+    parser.add_argument('--until', type=parse_time_arg, help='结束时间，格式同 --since')
+    parser.add_argument('--status', choices=['success', 'failed'], help='调用状态')
+    parser.add_argument('--source', choices=['ai', 'cache', 'faq', 'busy'], help='答复来源（faq 为 FAQ 命中，busy 为限流时的繁忙提示）')
+    parser.add_argument('--min-ms', type=int, help='最小总耗时（毫秒）')
+    parser.add_argument('--max-ms', type=int, help='最大总耗时（毫秒）')
+    parser.add_argument('-n', '--limit', type=int, default=20, help='最多显示条数（默认 20）')
+    parser.add_argument('--full', action='store_true', help='输出完整的 JSON 记录')
+    parser.add_argument('--rebuild', action='store_true', help='删除并重建索引')
+    args = parser.parse_args(argv)
+    
+    if args.rebuild and CALL_INDEX_FILE.exists():
+        CALL_INDEX_FILE.unlink()
+    
+    started = time.time()
+    conn = open_call_index()
+    added = update_call_index(conn)
+    
+    conditions = []
+    params = []
+    if args.work:
+        conditions.append("work_id = ?")
+        params.append(args.work)
+    if args.since:
+        conditions.append("ts >= ?")
+        params.append(args.since)
+    if args.until:
+        conditions.append("ts < ?")
+        params.append(args.until)
+    if args.status:
+        conditions.append("status = ?")
+        params.append(args.status)
+    if args.source:
+        conditions.append("source = ?")
+        params.append(args.source)
+    if args.min_ms is not None:
+        conditions.append("total_ms >= ?")
+        params.append(args.min_ms)
+    if args.max_ms is not None:
+        conditions.append("total_ms <= ?")
+        params.append(args.max_ms)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    count, avg_ms, max_ms = conn.execute(f"SELECT COUNT(*), AVG(total_ms), MAX(total_ms) FROM calls {where}", params).fetchone()
+    rows = conn.execute(
+        f"SELECT file, offset, ts, work_id, status, source, total_ms, question FROM calls {where} ORDER BY ts DESC LIMIT ?",
+        params + [args.limit]
+    ).fetchall()
+    conn.close()
+    
+    if args.full:
+        for file, offset, *_ in rows:
+            with open(file, "rb") as f:
+                f.seek(offset)
+                print(f.readline().decode("utf-8").rstrip())
+    else:
+        print(f"\n{CYAN}{'时间':<20} {'作品':<10} {'状态':<8} {'来源':<6} {'耗时(ms)':>9}  问题{NC}")
+        for _, _, ts, work, status, source, total_ms, question in rows:
+            color = GREEN if status == 'success' else RED
+            question = (question or "").replace("\n", " ")
+            if len(question) > 30:
+                question = question[:30] + "..."
+            print(f"{datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'):<20} {str(work or '-'):<10} "
+                  f"{color}{status:<8}{NC} {str(source or '-'):<6} {str(total_ms if total_ms is not None else '-'):>9}  {question}")
+        print()
+    
+    summary = f"共 {count} 条匹配，显示 {len(rows)} 条"
+    if count and avg_ms is not None:
+        summary += f"，平均耗时 {avg_ms:.0f}ms，最长 {max_ms}ms"
+    log("INFO", summary)
+    log("INFO", f"新索引 {added} 条记录，查询用时 {time.time() - started:.2f}秒")
+
+
+LATENCY_STAGE_NAMES = {
+    "poll": "轮询读取",
+    "ai": "AI调用",
+    "ttft": "首字延迟",
+    "faq": "FAQ 检索",
+    "write": "写回变量",
+    "total": "问题到答复"
+}
+
+
+def bucket_percentile(buckets: dict, count: int, max_ms: float, percent: float):
+    """按稀疏直方图 {桶上界: 数量} 估算分位数（毫秒）"""
+    rank = max(1, -(-count * percent // 100))
+    seen = 0
+    for bound, n in sorted(((float(k), v) for k, v in buckets.items()), key=lambda x: x[0]):
+        seen += n
+        if seen >= rank:
+            return min(bound, max_ms)
+    return max_ms
+
+
+def show_latency(argv: list = None):
+    """合并多个统计文件（跨日期、跨作品）的延迟直方图并显示分位数"""
+    parser = argparse.ArgumentParser(
+        prog='ai_bridge_manager.py latency',
+        description='合并统计文件中的延迟直方图，显示 p50/p90/p99/最大值'
+    )
+    parser.add_argument('-w', '--work', type=str, help='作品ID（默认所有作品）')
+    parser.add_argument('--since', type=str, help='起始日期，如 2026-01-01')
+    parser.add_argument('--until', type=str, help='结束日期（含），如 2026-01-31')
+    args = parser.parse_args(argv)
+    
+    merged = {}
+    files = 0
+    for stats_file in sorted(LOGS_DIR.glob("stats_*.json")) if LOGS_DIR.exists() else []:
+        parts = stats_file.stem.split("_")
+        date_str = parts[-1]
+        work = parts[1] if len(parts) == 3 else None
+        if args.work and work != args.work:
+            continue
+        if (args.since and date_str < args.since) or (args.until and date_str > args.until):
+            continue
+        try:
+            with open(stats_file, "r", encoding="utf-8") as f:
+                latency = json.load(f).get("latency") or {}
+        except (OSError, ValueError):
+            continue
+        files += 1
+        for stage, saved in latency.items():
+            total = merged.setdefault(stage, {"buckets": {}, "count": 0, "max": 0.0})
+            for bound, n in (saved.get("buckets") or {}).items():
+                total["buckets"][bound] = total["buckets"].get(bound, 0) + n
+            total["count"] += saved.get("count", 0)
+            total["max"] = max(total["max"], saved.get("max_ms", 0.0))
+    
+    print(f"\n{CYAN}{'阶段':<12} {'次数':>8} {'p50(ms)':>9} {'p90(ms)':>9} {'p99(ms)':>9} {'最大(ms)':>9}{NC}")
+    for stage, name in LATENCY_STAGE_NAMES.items():
+        total = merged.get(stage)
+        if not total or not total["count"]:
+            continue
+        p50, p90, p99 = (bucket_percentile(total["buckets"], total["count"], total["max"], p) for p in (50, 90, 99))
+        print(f"{name:<12} {total['count']:>8} {p50:>9.0f} {p90:>9.0f} {p99:>9.0f} {total['max']:>9.0f}")
+    print()
+    log("INFO", f"合并了 {files} 个统计文件")
+
+
 def restart_instance(work_id: str = None):
     """重启实例"""
     bridges = get_all_ai_bridges()
@@ -792,10 +1124,7 @@ def edit_prompt(work_id: str = None):
             
             if new_prompt.strip() and new_prompt != current_prompt:
                 save_prompt(new_prompt, work_id)
-                
-                restart = input("\n是否立即重启实例? (y/n): ").strip().lower()
-                if restart == 'y':
-                    restart_instance(work_id)
+                log("INFO", "运行中的实例会在几秒内自动加载新提示词，无需重启")
             else:
                 log("INFO", "提示词未更改")
             
@@ -806,10 +1135,7 @@ def edit_prompt(work_id: str = None):
         if confirm == 'y':
             save_prompt(DEFAULT_PROMPT, work_id)
             log("SUCCESS", "已重置为默认提示词")
-            
-            restart = input("\n是否立即重启实例? (y/n): ").strip().lower()
-            if restart == 'y':
-                restart_instance(work_id)
+            log("INFO", "运行中的实例会在几秒内自动加载新提示词，无需重启")
 
 
 def set_codemao_cookie():
@@ -900,6 +1226,14 @@ def show_help():
   python3 ai_bridge_manager.py clear-logs   # 清除日志
   python3 ai_bridge_manager.py config       # 编辑配置
   python3 ai_bridge_manager.py prompt       # 编辑提示词
+  python3 ai_bridge_manager.py query        # 查询调用记录
+  python3 ai_bridge_manager.py latency      # 延迟分布（可合并多天、多作品）
+
+{CYAN}调用记录查询:{NC}
+  python3 ai_bridge_manager.py query -w 123456 --since 7d --status failed
+  python3 ai_bridge_manager.py query --min-ms 5000 -n 50
+  python3 ai_bridge_manager.py query --since 2026-01-01 --until 2026-02-01 --full
+  调用记录: ai-bridge/logs/calls_<作品ID>_<日期>.jsonl，首次查询时自动建立索引
 
 {CYAN}多作品管理:{NC}
   每个作品独立运行一个 PM2 实例
@@ -907,6 +1241,11 @@ def show_help():
   配置文件: ai-bridge/config_<作品ID>.py
   提示词: ai-bridge/system_prompt_<作品ID>.txt
 
+{CYAN}单进程多作品模式:{NC}
+  pm2 start kitten_ai_bridge.py --name ai-bridge-multi --interpreter python3 -- --works 123456,654321
+  pm2 start kitten_ai_bridge.py --name ai-bridge-multi --interpreter python3 -- --works-dir ai-bridge
+  所有作品共用一个进程和事件循环，状态列表中以逻辑实例显示
+
 {CYAN}配置文件目录:{NC}
   {CONFIG_DIR}
 """)
@@ -971,6 +1310,14 @@ def main():
             show_help()
             return
         
+        if command == 'query':
+            query_calls(sys.argv[2:])
+            return
+        
+        if command == 'latency':
+            show_latency(sys.argv[2:])
+            return
+        
         if not PM2_AVAILABLE:
             log("ERROR", "PM2 未找到，请确保已安装 PM2")
             log("INFO", "运行: npm install -g pm2")
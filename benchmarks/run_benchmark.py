@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 桥接程序压测脚本
+功能：启动本地 Kitten Cloud API 替身和 OpenAI 兼容接口替身，以子进程方式运行 kitten_ai_bridge.py，
+     模拟玩家提问，统计 问题→答复 延迟分位数、每个问题的请求数以及每个作品的 CPU/内存占用
+
+使用方法：
+  python3 benchmarks/run_benchmark.py                        # 运行 baseline 场景
+  python3 benchmarks/run_benchmark.py -s multi -s watch      # 运行指定场景
+  python3 benchmarks/run_benchmark.py -s all -q 30 --json result.json
+  python3 benchmarks/run_benchmark.py --list                 # 列出所有场景
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_kitten_api import StubKittenApi
+from stub_openai import StubOpenAI, make_answer
+
+BRIDGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kitten_ai_bridge.py")
+
+QUESTION_PREFIX = "QWQ~~~"
+ANSWER_PREFIX = "OKOKOK~~~"
+VARIABLE_NAME = "API"
+QUEUE_LIST = "提问"
+ANSWER_LIST = "提问答复"
+FIRST_WORK_ID = 100001
+
+# 场景定义：works 作品数，config 写入每个作品配置文件的额外配置，
+# ai 传给 OpenAI 替身的参数，repeat 表示玩家只在少量问题中重复提问，
+# players 为每个作品的玩家数，queue 表示玩家把问题追加到提问列表（队列模式）
+SCENARIOS = {
+    "baseline": {
+        "description": "单作品，自适应轮询",
+        "works": 1,
+        "config": {}
+    },
+    "multi": {
+        "description": "10 个作品共用一个进程",
+        "works": 10,
+        "config": {}
+    },
+    "watch": {
+        "description": "单作品，订阅变化推送",
+        "works": 1,
+        "config": {"watch_mode": True}
+    },
+    "stream": {
+        "description": "单作品，流式调用 AI 并写回部分答复",
+        "works": 1,
+        "config": {"stream_mode": True, "stream_flush_interval": 0.5}
+    },
+    "errors": {
+        "description": "单作品，20% 的 AI 请求返回 500",
+        "works": 1,
+        "config": {},
+        "ai": {"error_rate": 0.2}
+    },
+    "stalls": {
+        "description": "单作品，10% 的 AI 请求卡住 20 秒",
+        "works": 1,
+        "config": {},
+        "ai": {"stall_rate": 0.1, "stall_time": 20}
+    },
+    "hedge": {
+        "description": "单作品，10% 的 AI 请求卡住 20 秒，开启对冲请求",
+        "works": 1,
+        "config": {"hedge_mode": True, "hedge_delay": 1.5},
+        "ai": {"stall_rate": 0.1, "stall_time": 20}
+    },
+    "slots": {
+        "description": "单作品，多路复用协议 4 个槽位，4 名玩家同时提问",
+        "works": 1,
+        "players": 4,
+        "config": {"slot_count": 4}
+    },
+    "queue": {
+        "description": "单作品，队列模式，8 名玩家同时向提问列表追加问题",
+        "works": 1,
+        "players": 8,
+        "queue": True,
+        "config": {"queue_list": QUEUE_LIST}
+    },
+    "batch": {
+        "description": "同 queue，开启批量请求，最多 8 个问题合并为一次 AI 请求",
+        "works": 1,
+        "players": 8,
+        "queue": True,
+        "config": {"queue_list": QUEUE_LIST, "ai_batch_size": 8}
+    },
+    "cache": {
+        "description": "单作品，开启答复缓存，玩家重复提问",
+        "works": 1,
+        "config": {"answer_cache": True},
+        "repeat": 3
+    }
+}
+
+
+def percentile(values: list, percent: float):
+    """计算分位数（最近秩法），列表为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def read_process_usage(pid: int) -> dict:
+    """
+    读取进程的 CPU 时间和内存占用（仅 Linux，其他平台返回 None）
+
+    Returns:
+        {"cpu_seconds": 用户态+内核态 CPU 秒数, "rss_mb": 当前常驻内存, "peak_rss_mb": 峰值常驻内存}
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        usage = {"cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks}
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    usage["peak_rss_mb"] = int(line.split()[1]) / 1024
+        return usage
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def write_work_configs(config_dir: str, work_ids: list, kitten: StubKittenApi, ai: StubOpenAI, extra: dict):
+    """为每个作品生成配置文件 config_<作品ID>.py"""
+    for work_id in work_ids:
+        config = {
+            "api_base_url": kitten.base_url,
+            "ai_api_url": ai.url,
+            "ai_api_key": "benchmark",
+            "ai_model": "stub",
+            "question_prefix": QUESTION_PREFIX,
+            "answer_prefix": ANSWER_PREFIX,
+            "variable_name": VARIABLE_NAME,
+            "log_dir": os.path.join(config_dir, "logs")
+        }
+        config.update(extra)
+        with open(os.path.join(config_dir, f"config_{work_id}.py"), "w", encoding="utf-8") as f:
+            f.write(f"CONFIG = {config!r}\n")
+
+
+def simulate_player(kitten: StubKittenApi, work_id: int, questions: int, think: float,
+                    timeout: float, repeat: int, results: list, slot: int = 0):
+    """
+    模拟一个作品里的玩家：写入问题，等待完整答复后再提下一个问题
+
+    每个问题记录 first（首次看到答复前缀，流式部分写回时早于完整答复）和 final（完整答复）延迟
+    slot 大于 0 时使用多路复用协议：写入槽位变量 {变量名}{slot}，问题和答复都带请求ID
+    """
+    var_name = f"{VARIABLE_NAME}{slot}" if slot else VARIABLE_NAME
+    for i in range(questions):
+        question = f"问题{i % repeat if repeat else i}-{work_id}" + (f"-{slot}" if slot else "")
+        request = f"p{slot}q{i}|" if slot else ""
+        answer_prefix = f"{ANSWER_PREFIX}{request}"
+        expected = f"{answer_prefix}{make_answer(question)}"
+        failed_prefix = f"{answer_prefix}[AI调用失败"
+        started = time.monotonic()
+        kitten.set_variable(work_id, var_name, f"{QUESTION_PREFIX}{request}{question}")
+
+        first = kitten.wait_for_variable(work_id, var_name, lambda v: str(v).startswith(answer_prefix), timeout)
+        first_latency = time.monotonic() - started if first is not None else None
+        final = kitten.wait_for_variable(
+            work_id, var_name,
+            lambda v: v == expected or str(v).startswith(failed_prefix),
+            max(timeout - (time.monotonic() - started), 0)
+        )
+        final_latency = time.monotonic() - started
+
+        if final is None:
+            status = "timeout"
+        elif final == expected:
+            status = "success"
+        else:
+            status = "failed"
+        results.append({"work_id": work_id, "status": status, "first": first_latency, "final": final_latency})
+
+        if think:
+            time.sleep(think)
+
+
+def simulate_queue_player(kitten: StubKittenApi, work_id: int, questions: int, think: float,
+                          timeout: float, repeat: int, results: list, player: int = 0):
+    """
+    模拟队列模式下的玩家：向提问列表追加带请求ID的问题，等待答复列表中出现对应答复后再提下一个问题
+    """
+    for i in range(questions):
+        question = f"问题{i % repeat if repeat else i}-{work_id}-{player}"
+        request = f"p{player}q{i}"
+        answer_prefix = f"{ANSWER_PREFIX}{request}|"
+        expected = f"{answer_prefix}{make_answer(question)}"
+        started = time.monotonic()
+        kitten.push_list_item(work_id, QUEUE_LIST, f"{QUESTION_PREFIX}{request}|{question}")
+
+        items = kitten.wait_for_list(
+            work_id, ANSWER_LIST, lambda items: any(str(item).startswith(answer_prefix) for item in items), timeout
+        )
+        latency = time.monotonic() - started
+
+        if items is None:
+            status = "timeout"
+        elif expected in items:
+            status = "success"
+        else:
+            status = "failed"
+        results.append({"work_id": work_id, "status": status, "first": latency, "final": latency})
+
+        if think:
+            time.sleep(think)
+
+
+def run_scenario(name: str, args) -> dict:
+    """
+    运行一个压测场景
+
+    Returns:
+        场景结果
+    """
+    scenario = SCENARIOS[name]
+    works = args.works or scenario["works"]
+    work_ids = [FIRST_WORK_ID + i for i in range(works)]
+
+    ai_options = {"latency": args.ai_latency, "ttft": args.ai_ttft, "token_interval": args.token_interval, "seed": 1}
+    ai_options.update(scenario.get("ai", {}))
+    kitten = StubKittenApi(latency=args.kitten_latency, heartbeat=5).start()
+    ai = StubOpenAI(**ai_options).start()
+
+    config_dir = tempfile.mkdtemp(prefix=f"ai_bridge_bench_{name}_")
+    write_work_configs(config_dir, work_ids, kitten, ai, scenario["config"])
+    output = open(os.path.join(config_dir, "bridge.out"), "w", encoding="utf-8")
+    bridge = subprocess.Popen(
+        [sys.executable, BRIDGE_PATH, "--works-dir", config_dir],
+        stdout=output, stderr=subprocess.STDOUT, cwd=config_dir
+    )
+
+    per = "名玩家" if scenario.get("players") else "个"
+    print(f"\n▶ {name}: {scenario['description']}（{works} 个作品，每{per} {args.questions} 个问题）")
+    try:
+        deadline = time.monotonic() + 30
+        while kitten.counters["connect"] < works:
+            if bridge.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"桥接程序启动失败，详见 {output.name}")
+            time.sleep(0.1)
+        # 等待首轮轮询和推送订阅建立
+        time.sleep(1.5)
+
+        kitten_before = dict(kitten.counters)
+        ai_before = dict(ai.counters)
+        usage_before = read_process_usage(bridge.pid)
+        started = time.monotonic()
+
+        results = []
+        slots = range(1, scenario["players"] + 1) if scenario.get("players") else [0]
+        player_func = simulate_queue_player if scenario.get("queue") else simulate_player
+        players = [
+            threading.Thread(target=player_func, args=(
+                kitten, work_id, args.questions, args.think, args.timeout, scenario.get("repeat", 0), results, slot
+            ))
+            for work_id in work_ids
+            for slot in slots
+        ]
+        for player in players:
+            player.start()
+        for player in players:
+            player.join()
+
+        duration = time.monotonic() - started
+        usage_after = read_process_usage(bridge.pid)
+        kitten_after = dict(kitten.counters)
+        ai_after = dict(ai.counters)
+    finally:
+        if bridge.poll() is None:
+            bridge.send_signal(signal.SIGINT)
+            try:
+                bridge.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                bridge.kill()
+        output.close()
+        kitten.stop()
+        ai.stop()
+        if not args.keep:
+            shutil.rmtree(config_dir, ignore_errors=True)
+
+    answered = [r for r in results if r["status"] != "timeout"]
+    final = [r["final"] * 1000 for r in answered]
+    first = [r["first"] * 1000 for r in answered if r["first"] is not None]
+    questions = max(len(results), 1)
+
+    requests_per_question = {
+        key: round((kitten_after.get(key, 0) - kitten_before.get(key, 0)) / questions, 2)
+        for key in ("var_get", "var_all", "var_set", "online", "connect")
+                   + (("list_drain", "list_get", "list_set") if scenario.get("queue") else ())
+    }
+    requests_per_question["ai"] = round((ai_after["requests"] - ai_before["requests"]) / questions, 2)
+
+    result = {
+        "scenario": name,
+        "description": scenario["description"],
+        "works": works,
+        "questions": len(results),
+        "success": sum(1 for r in results if r["status"] == "success"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "timeout": sum(1 for r in results if r["status"] == "timeout"),
+        "duration_seconds": round(duration, 2),
+        "answers_per_second": round(len(answered) / duration, 2) if duration else None,
+        "latency_ms": {
+            "final": {f"p{p}": round(percentile(final, p), 1) if final else None for p in (50, 90, 99)},
+            "first": {f"p{p}": round(percentile(first, p), 1) if first else None for p in (50, 90, 99)}
+        },
+        "requests_per_question": requests_per_question
+    }
+    result["latency_ms"]["final"]["max"] = round(max(final), 1) if final else None
+
+    if usage_before and usage_after:
+        cpu_seconds = usage_after["cpu_seconds"] - usage_before["cpu_seconds"]
+        result["cpu_percent_per_work"] = round(cpu_seconds / duration * 100 / works, 2) if duration else None
+        result["rss_mb"] = round(usage_after.get("rss_mb", 0), 1)
+        result["rss_mb_per_work"] = round(usage_after.get("rss_mb", 0) / works, 1)
+        result["peak_rss_mb"] = round(usage_after.get("peak_rss_mb", 0), 1)
+
+    print_result(result)
+    return result
+
+
+def print_result(result: dict):
+    """打印单个场景的结果"""
+    final = result["latency_ms"]["final"]
+    first = result["latency_ms"]["first"]
+
+    def fmt(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    print(f"  问题: {result['questions']}  成功: {result['success']}  失败: {result['failed']}  超时: {result['timeout']}"
+          f"  用时: {result['duration_seconds']}秒  吞吐: {result['answers_per_second']} 答复/秒")
+    print(f"  完整答复延迟(ms): p50 {fmt(final['p50'])} / p90 {fmt(final['p90'])} / p99 {fmt(final['p99'])} / 最大 {fmt(final['max'])}")
+    if first["p50"] is not None and first["p50"] < (final["p50"] or 0):
+        print(f"  首次可见延迟(ms): p50 {fmt(first['p50'])} / p90 {fmt(first['p90'])} / p99 {fmt(first['p99'])}")
+    rpq = result["requests_per_question"]
+    var_all = f"  var/all {rpq['var_all']}" if rpq.get("var_all") else ""
+    lists = "".join(f"  {key.replace('_', '/')} {rpq[key]}" for key in ("list_drain", "list_get", "list_set") if key in rpq)
+    print(f"  每个问题的请求数: var/get {rpq['var_get']}{var_all}  var/set {rpq['var_set']}{lists}  online {rpq['online']}  AI {rpq['ai']}")
+    if "cpu_percent_per_work" in result:
+        print(f"  每个作品: CPU {result['cpu_percent_per_work']}%  内存 {result['rss_mb_per_work']}MB"
+              f"（进程 {result['rss_mb']}MB，峰值 {result['peak_rss_mb']}MB）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI 桥接程序压测')
+    parser.add_argument('-s', '--scenario', action='append', help='场景名，可重复指定；all 表示全部（默认 baseline）')
+    parser.add_argument('-q', '--questions', type=int, default=20, help='每个作品的问题数（默认 20）')
+    parser.add_argument('-n', '--works', type=int, help='覆盖场景的作品数')
+    parser.add_argument('--think', type=float, default=0.5, help='玩家收到答复后到下一次提问的间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=30, help='单个问题的最长等待时间（秒）')
+    parser.add_argument('--ai-latency', type=float, default=0.5, help='AI 替身非流式响应延迟（秒）')
+    parser.add_argument('--ai-ttft', type=float, default=0.2, help='AI 替身流式首字延迟（秒）')
+    parser.add_argument('--token-interval', type=float, default=0.05, help='AI 替身流式片段间隔（秒）')
+    parser.add_argument('--kitten-latency', type=float, default=0.0, help='Kitten API 替身每个请求的延迟（秒）')
+    parser.add_argument('--json', type=str, help='把结果写入 JSON 文件')
+    parser.add_argument('--keep', action='store_true', help='保留临时配置和日志目录')
+    parser.add_argument('--list', action='store_true', help='列出所有场景')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(f"  {name:<10} {scenario['description']}")
+        return
+
+    names = args.scenario or ["baseline"]
+    if "all" in names:
+        names = list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}（可用: {', '.join(SCENARIOS)}）")
+
+    results = [run_scenario(name, args) for name in names]
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kitten Cloud API 本地替身服务
+功能：在本机模拟 Kitten Cloud API 的连接、云变量读写、在线人数和变化推送接口，
+     用于在没有真实编程猫作品的情况下测试 AI 桥接程序
+
+支持的接口：
+  POST /api/connection/connect
+  POST /api/var/get
+  POST /api/var/set
+  GET  /api/var/:workId
+  GET  /api/var/watch/:workId/:name   (SSE)
+  GET  /api/online/:workId
+  POST /api/list/get
+  POST /api/list/push
+  POST /api/list/remove
+  POST /api/list/setAll
+  POST /api/list/drain
+
+使用方法：
+  python3 benchmarks/stub_kitten_api.py                 # 监听 127.0.0.1:9178
+  python3 benchmarks/stub_kitten_api.py --port 19178
+"""
+
+import json
+import time
+import queue
+import threading
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+
+class StubKittenApi:
+    """
+    可在进程内启动的 Kitten Cloud API 替身
+
+    Attributes:
+        variables: {(作品ID, 变量名): 值}
+        lists: {(作品ID, 列表名): [列表项]}
+        online_users: {作品ID: 在线人数}，未设置的作品默认 1 人
+        counters: 各接口的调用次数
+        latency: 每个请求的模拟网络延迟（秒）
+        drain_supported: 是否提供 /api/list/drain（关闭时模拟旧版服务端）
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, heartbeat: float = 15, latency: float = 0.0,
+                 drain_supported: bool = True):
+        self.variables = {}
+        self.lists = {}
+        self.online_users = {}
+        self.counters = {"connect": 0, "var_get": 0, "var_all": 0, "var_set": 0, "online": 0, "watch": 0,
+                         "list_get": 0, "list_push": 0, "list_remove": 0, "list_set": 0, "list_drain": 0}
+        self.heartbeat = heartbeat
+        self.latency = latency
+        self.drain_supported = drain_supported
+        self._watchers = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务并断开所有订阅"""
+        with self._lock:
+            for watchers in self._watchers.values():
+                for q in watchers:
+                    q.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_variable(self, work_id: int, name: str, value):
+        """修改云变量（模拟玩家写入），并推送给订阅者"""
+        with self._lock:
+            self.variables[(work_id, name)] = value
+            watchers = list(self._watchers.get((work_id, name), []))
+            self._changed.notify_all()
+        for q in watchers:
+            q.put(value)
+
+    def get_variable(self, work_id: int, name: str):
+        with self._lock:
+            return self.variables.get((work_id, name), "")
+
+    def get_all_variables(self, work_id: int) -> list:
+        with self._lock:
+            return [{"name": name, "value": value, "cvid": f"{work_id}-{name}"}
+                    for (wid, name), value in self.variables.items() if wid == work_id]
+
+    def wait_for_variable(self, work_id: int, name: str, predicate, timeout: float):
+        """
+        等待云变量满足条件
+
+        Returns:
+            满足条件时的值，超时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                value = self.variables.get((work_id, name), "")
+                if predicate(value):
+                    return value
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def push_list_item(self, work_id: int, name: str, value):
+        """向云列表尾部追加一项（模拟玩家提问）"""
+        with self._lock:
+            self.lists.setdefault((work_id, name), []).append(value)
+            self._changed.notify_all()
+
+    def get_list(self, work_id: int, name: str) -> list:
+        with self._lock:
+            return list(self.lists.get((work_id, name), []))
+
+    def set_list(self, work_id: int, name: str, items: list):
+        with self._lock:
+            self.lists[(work_id, name)] = list(items)
+            self._changed.notify_all()
+
+    def drain_list(self, work_id: int, name: str, limit=None) -> list:
+        """取出并移除云列表头部最多 limit 项"""
+        with self._lock:
+            items = self.lists.setdefault((work_id, name), [])
+            count = len(items) if limit is None else min(int(limit), len(items))
+            drained = items[:count]
+            del items[:count]
+            self._changed.notify_all()
+            return drained
+
+    def remove_list_item(self, work_id: int, name: str, index: int):
+        """移除云列表指定位置的项，越界时返回 None"""
+        with self._lock:
+            items = self.lists.setdefault((work_id, name), [])
+            if not 0 <= index < len(items):
+                return None
+            self._changed.notify_all()
+            return items.pop(index)
+
+    def wait_for_list(self, work_id: int, name: str, predicate, timeout: float):
+        """
+        等待云列表满足条件
+
+        Returns:
+            满足条件的列表项，超时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                items = list(self.lists.get((work_id, name), []))
+                if predicate(items):
+                    return items
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+
+    def _subscribe(self, key) -> queue.Queue:
+        q = queue.Queue()
+        with self._lock:
+            self._watchers.setdefault(key, []).append(q)
+        return q
+
+    def _unsubscribe(self, key, q: queue.Queue):
+        with self._lock:
+            if q in self._watchers.get(key, []):
+                self._watchers[key].remove(q)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, data: dict, status: int = 200):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_json(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                if not length:
+                    return {}
+                try:
+                    return json.loads(self.rfile.read(length).decode("utf-8"))
+                except ValueError:
+                    return {}
+
+            def do_HEAD(self):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                parts = [unquote(p) for p in self.path.split("?")[0].strip("/").split("/")]
+                if len(parts) == 3 and parts[:2] == ["api", "online"] and parts[2].isdigit():
+                    stub._count("online")
+                    work_id = int(parts[2])
+                    self.send_json({
+                        "success": True,
+                        "data": {"workId": work_id, "onlineUsers": stub.online_users.get(work_id, 1)}
+                    })
+                elif len(parts) == 3 and parts[:2] == ["api", "var"] and parts[2].isdigit():
+                    stub._count("var_all")
+                    self.send_json({
+                        "success": True,
+                        "data": {"publicVariables": stub.get_all_variables(int(parts[2])), "privateVariables": []}
+                    })
+                elif len(parts) == 5 and parts[:3] == ["api", "var", "watch"] and parts[3].isdigit():
+                    self.handle_watch(int(parts[3]), parts[4])
+                else:
+                    self.send_json({"success": False, "error": "NOT_FOUND", "message": "接口不存在"}, 404)
+
+            def do_POST(self):
+                body = self.read_json()
+                path = self.path.split("?")[0]
+                if path == "/api/connection/connect":
+                    stub._count("connect")
+                    work_id = body.get("workId")
+                    self.send_json({
+                        "success": True,
+                        "message": "连接成功",
+                        "data": {"workId": work_id, "status": "connected", "onlineUsers": stub.online_users.get(work_id, 1)}
+                    })
+                elif path == "/api/var/get":
+                    stub._count("var_get")
+                    name = body.get("name")
+                    self.send_json({
+                        "success": True,
+                        "data": {"name": name, "value": stub.get_variable(body.get("workId"), name), "type": "public"}
+                    })
+                elif path == "/api/var/set":
+                    stub._count("var_set")
+                    stub.set_variable(body.get("workId"), body.get("name"), body.get("value"))
+                    self.send_json({"success": True, "message": "设置成功"})
+                elif path == "/api/list/get":
+                    stub._count("list_get")
+                    items = stub.get_list(body.get("workId"), body.get("name"))
+                    self.send_json({"success": True, "data": {"name": body.get("name"), "length": len(items), "items": items}})
+                elif path == "/api/list/push":
+                    stub._count("list_push")
+                    stub.push_list_item(body.get("workId"), body.get("name"), body.get("value"))
+                    length = len(stub.get_list(body.get("workId"), body.get("name")))
+                    self.send_json({"success": True, "data": {"newLength": length}, "message": "添加成功"})
+                elif path == "/api/list/remove":
+                    stub._count("list_remove")
+                    item = stub.remove_list_item(body.get("workId"), body.get("name"), body.get("index", 0))
+                    if item is None:
+                        self.send_json({"success": False, "error": "INDEX_OUT_OF_RANGE", "message": "索引超出范围"}, 400)
+                    else:
+                        length = len(stub.get_list(body.get("workId"), body.get("name")))
+                        self.send_json({"success": True, "data": {"removedItem": item, "newLength": length}, "message": "移除成功"})
+                elif path == "/api/list/setAll":
+                    stub._count("list_set")
+                    stub.set_list(body.get("workId"), body.get("name"), body.get("items") or [])
+                    items = stub.get_list(body.get("workId"), body.get("name"))
+                    self.send_json({"success": True, "data": {"newLength": len(items), "items": items}, "message": "批量替换成功"})
+                elif path == "/api/list/drain" and stub.drain_supported:
+                    stub._count("list_drain")
+                    items = stub.drain_list(body.get("workId"), body.get("name"), body.get("limit"))
+                    length = len(stub.get_list(body.get("workId"), body.get("name")))
+                    self.send_json({"success": True, "data": {"items": items, "newLength": length}, "message": "取出成功"})
+                else:
+                    self.send_json({"success": False, "error": "NOT_FOUND", "message": "接口不存在"}, 404)
+
+            def handle_watch(self, work_id: int, name: str):
+                stub._count("watch")
+                key = (work_id, name)
+                q = stub._subscribe(key)
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                    self.send_header("Cache-Control", "no-cache")
+                    self.end_headers()
+                    self.write_event("snapshot", name, stub.get_variable(work_id, name))
+                    while True:
+                        try:
+                            value = q.get(timeout=stub.heartbeat)
+                        except queue.Empty:
+                            self.wfile.write(b": ping\n\n")
+                            self.wfile.flush()
+                            continue
+                        if value is None:
+                            break
+                        self.write_event("change", name, value)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    stub._unsubscribe(key, q)
+                    self.close_connection = True
+
+            def write_event(self, event: str, name: str, value):
+                data = json.dumps({"name": name, "value": value, "type": "public"}, ensure_ascii=False)
+                self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kitten Cloud API 本地替身服务')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=9178, help='监听端口')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的模拟延迟（秒）')
+    args = parser.parse_args()
+
+    stub = StubKittenApi(args.host, args.port, latency=args.latency)
+    print(f"Kitten Cloud API 替身服务已启动: {stub.base_url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
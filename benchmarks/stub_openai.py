@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenAI 兼容接口本地替身服务
+功能：模拟 /v1/chat/completions，可配置响应延迟、流式输出和错误注入，
+     用于在没有付费 AI Key 的情况下测试和压测 AI 桥接程序
+
+答复内容固定为 "回答:" + 用户问题，便于压测脚本判断答复是否完整；
+用户消息最后一行是 [{"id": 编号, "question": 问题}, ...] 时视为批量请求，
+按 {"answers": [{"id": 编号, "answer": 答复}]} 格式逐个答复；
+usage 按字数计算 token，系统提示词与之前的请求相同时计为命中提示词缓存 (cached_tokens)
+
+使用方法：
+  python3 benchmarks/stub_openai.py --port 18090 --latency 0.8
+  python3 benchmarks/stub_openai.py --port 18090 --ttft 0.3 --token-interval 0.05 --error-rate 0.1
+  python3 benchmarks/stub_openai.py --port 18090 --stall-rate 0.1 --stall-time 20
+"""
+
+import json
+import time
+import random
+import threading
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def make_answer(question: str) -> str:
+    """替身服务对问题的固定答复"""
+    return f"回答:{question}"
+
+
+def make_batch_answer(content: str):
+    """批量请求的答复，不是批量请求时返回 None"""
+    lines = content.strip().splitlines()
+    try:
+        items = json.loads(lines[-1]) if lines else None
+    except ValueError:
+        return None
+    if not isinstance(items, list) or not all(isinstance(item, dict) and "id" in item and "question" in item for item in items):
+        return None
+    answers = [{"id": item["id"], "answer": make_answer(item["question"])} for item in items]
+    return json.dumps({"answers": answers}, ensure_ascii=False)
+
+
+class StubOpenAI:
+    """
+    可在进程内启动的 OpenAI 兼容接口替身
+
+    Attributes:
+        latency: 非流式响应的总延迟（秒）
+        ttft: 流式响应的首字延迟（秒）
+        token_interval: 流式响应每个片段之间的间隔（秒）
+        chunk_size: 流式响应每个片段的字数
+        error_rate: 返回错误的概率 (0~1)
+        error_status: 注入错误时的 HTTP 状态码
+        stall_rate: 响应卡住的概率 (0~1)
+        stall_time: 卡住时额外等待的时间（秒）
+        counters: 请求计数（batches 为批量请求数）
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.5,
+                 ttft: float = 0.2, token_interval: float = 0.05, chunk_size: int = 2,
+                 error_rate: float = 0.0, error_status: int = 500, stall_rate: float = 0.0,
+                 stall_time: float = 20.0, seed: int = None):
+        self.latency = latency
+        self.ttft = ttft
+        self.token_interval = token_interval
+        self.chunk_size = max(chunk_size, 1)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.counters = {"requests": 0, "stream_requests": 0, "errors": 0, "stalls": 0, "batches": 0}
+        self._random = random.Random(seed)
+        self._seen_prompts = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止服务"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _stall_delay(self) -> float:
+        """按 stall_rate 决定本次响应是否卡住，返回额外等待的秒数"""
+        with self._lock:
+            stalled = self._random.random() < self.stall_rate
+        if not stalled:
+            return 0.0
+        self._count("stalls")
+        return self.stall_time
+
+    def _usage(self, messages: list, answer: str) -> dict:
+        """模拟 usage：每个字计 1 个 token，系统提示词见过时计为缓存命中"""
+        system = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        with self._lock:
+            cached = len(system) if system in self._seen_prompts else 0
+            self._seen_prompts.add(system)
+        return {
+            "prompt_tokens": sum(len(m.get("content", "")) for m in messages),
+            "completion_tokens": len(answer),
+            "prompt_tokens_details": {"cached_tokens": cached}
+        }
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, data: dict, status: int = 200):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def write_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_HEAD(self):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length).decode("utf-8")) if length else {}
+                except ValueError:
+                    body = {}
+
+                if self.path.split("?")[0] != "/v1/chat/completions":
+                    self.send_json({"error": {"message": "not found"}}, 404)
+                    return
+
+                stub._count("requests")
+                messages = body.get("messages") or [{}]
+                question = messages[-1].get("content", "")
+                model = body.get("model", "stub")
+
+                if stub._should_fail():
+                    stub._count("errors")
+                    time.sleep(stub.ttft)
+                    self.send_json({"error": {"message": f"注入的错误 ({stub.error_status})"}}, stub.error_status)
+                    return
+
+                answer = make_batch_answer(question)
+                if answer is not None:
+                    stub._count("batches")
+                else:
+                    answer = make_answer(question)
+                stall = stub._stall_delay()
+                usage = stub._usage(messages, answer)
+                if body.get("stream"):
+                    stub._count("stream_requests")
+                    include_usage = (body.get("stream_options") or {}).get("include_usage")
+                    self.stream_answer(answer, model, stall, usage if include_usage else None)
+                    return
+
+                time.sleep(stub.latency + stall)
+                self.send_json({
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                    "usage": usage
+                })
+
+            def stream_answer(self, answer: str, model: str, stall: float = 0.0, usage: dict = None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(stub.ttft + stall)
+                try:
+                    for i in range(0, len(answer), stub.chunk_size):
+                        if i:
+                            time.sleep(stub.token_interval)
+                        chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": answer[i:i + stub.chunk_size]}}]}
+                        self.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    if usage is not None:
+                        chunk = {"model": model, "choices": [], "usage": usage}
+                        self.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.write_chunk(b"data: [DONE]\n\n")
+                    self.write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI 兼容接口本地替身服务')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=18090, help='监听端口')
+    parser.add_argument('--latency', type=float, default=0.5, help='非流式响应延迟（秒）')
+    parser.add_argument('--ttft', type=float, default=0.2, help='流式响应首字延迟（秒）')
+    parser.add_argument('--token-interval', type=float, default=0.05, help='流式片段间隔（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='错误注入概率 (0~1)')
+    parser.add_argument('--error-status', type=int, default=500, help='注入错误的 HTTP 状态码')
+    parser.add_argument('--stall-rate', type=float, default=0.0, help='响应卡住的概率 (0~1)')
+    parser.add_argument('--stall-time', type=float, default=20.0, help='卡住时额外等待的时间（秒）')
+    args = parser.parse_args()
+
+    stub = StubOpenAI(args.host, args.port, latency=args.latency, ttft=args.ttft,
+                      token_interval=args.token_interval, error_rate=args.error_rate,
+                      error_status=args.error_status, stall_rate=args.stall_rate,
+                      stall_time=args.stall_time)
+    print(f"OpenAI 兼容接口替身服务已启动: {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
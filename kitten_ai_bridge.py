@@ -10,15 +10,45 @@ Kitten Cloud API - AI 桥接程序
   python3 kitten_ai_bridge.py -w 123456                    # 指定作品ID
   python3 kitten_ai_bridge.py -w 123456 -u http://xxx/api  # 指定API地址
   python3 kitten_ai_bridge.py -w 123456 -c ./ai-bridge/config_123456.py  # 使用配置文件
+  python3 kitten_ai_bridge.py --works 123456,654321       # 单进程同时服务多个作品
+  python3 kitten_ai_bridge.py --works-dir ./ai-bridge      # 服务目录下所有 config_<作品ID>.py
 """
 
 import requests
 import time
 import sys
 import json
+import math
+import random
+import bisect
 import os
+import re
 import argparse
+import asyncio
+import atexit
+import contextvars
+import queue
+import socket
+import statistics
+import threading
+import sqlite3
+import hashlib
+import unicodedata
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit, quote
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    # 可选依赖：FAQ 检索在安装了 NumPy 时用向量运算打分，否则用纯 Python 计算
+    import numpy as np
+except ImportError:
+    np = None
 
 # ==================== 默认配置 ====================
 # 注意：这些是默认值，实际配置应通过配置文件或命令行参数传入
@@ -27,32 +57,263 @@ DEFAULT_CONFIG = {
     "ai_api_url": "",
     "ai_api_key": "",
     "ai_model": "gpt-3.5-turbo",
+    # 生成参数：max_tokens 默认与之前固定的 2000 一致，答复一般很短，可按需调小
+    "ai_temperature": 0.7,
+    "ai_max_tokens": 2000,
+    # 答复超过该字数时提前截断（流式模式下立即停止接收），0 表示不截断
+    "answer_max_chars": 0,
     "question_prefix": "QWQ~~~",
     "answer_prefix": "OKOKOK~~~",
     "variable_name": "API",
     "system_prompt_file": "",
     "request_timeout": 60,
     "max_retries": 5,
-    "log_dir": "."
+    "log_dir": ".",
+    "http_pool_size": 10,
+    "keepalive_interval": 0,
+    "question_workers": 1,
+    "question_queue_size": 20,
+    "prompt_check_interval": 5,
+    "answer_cache": False,
+    "answer_cache_ttl": 86400,
+    "answer_cache_size": 1000,
+    "poll_interval_min": 1,
+    "poll_interval_max": 10,
+    "poll_backoff": 1.5,
+    "online_check_interval": 30,
+    "sleep_poll_interval": 15,
+    "watch_mode": False,
+    "watch_poll_interval": 30,
+    "stream_mode": False,
+    "stream_flush_interval": 0,
+    "log_level": "DEBUG",
+    "poll_log_interval": 60,
+    "stats_save_interval": 60,
+    "stats_save_every": 10,
+    "metrics_port": 0,
+    "metrics_host": "127.0.0.1",
+    "health_max_poll_age": 120,
+    "retry_base_delay": 0.5,
+    "retry_max_delay": 8,
+    "retry_budget_ratio": 0.2,
+    "breaker_failure_threshold": 5,
+    "breaker_reset_timeout": 30,
+    # 多个 AI 服务商（为空时只使用上面的 ai_api_url / ai_api_key / ai_model）
+    # 每项: {"name": 名称, "url": 地址, "key": Key, "model": 模型, "weight": 权重, "timeout": 超时秒数}
+    "ai_providers": [],
+    "hedge_mode": False,
+    "hedge_delay": 0,
+    "work_rate_limit": 0,
+    "work_rate_burst": 3,
+    "ai_key_rate_limit": 0,
+    "ai_key_rate_burst": 5,
+    "kitten_rate_limit": 0,
+    "kitten_rate_burst": 20,
+    "rate_limit_wait": 10,
+    "busy_message": "",
+    # 多路复用协议：大于 0 时使用 {variable_name}1 ~ {variable_name}N 共 N 个槽位变量，
+    # 问题格式为 问题前缀 + 请求ID|问题，答复写回同一个槽位，格式为 答案前缀 + 请求ID|答复
+    "slot_count": 0,
+    # 队列模式：非空时玩家把问题追加到该云列表，程序每次取出一批并行答复，
+    # 答复合并为一次 setAll 写回答复列表（默认 {queue_list}答复）
+    "queue_list": "",
+    "answer_list": "",
+    "answer_list_size": 50,
+    "queue_batch_size": 10,
+    "queue_flush_delay": 0.5,
+    # 批量请求：大于 1 时把 ai_batch_window 秒内最多 ai_batch_size 个不同的问题合并为一次 AI 请求
+    "ai_batch_size": 0,
+    "ai_batch_window": 0.2,
+    # FAQ 检索：为空时使用 ai-bridge/faq_{作品ID}.txt（存在时），与问题的相似度达到 faq_threshold 时直接答复
+    "faq_file": "",
+    "faq_threshold": 0.75
+}
+
+# 当前作品上下文（多作品模式下每个 asyncio 任务持有各自的作品）
+_current_work = contextvars.ContextVar("current_work", default=None)
+
+
+class WorkScopedDict(MutableMapping):
+    """
+    按当前作品上下文分派的字典
+    未进入作品上下文时读写模块级默认字典，进入后读写该作品独立的一份
+    """
+
+    def __init__(self, key: str, default: dict):
+        self._key = key
+        self._default = default
+
+    def _target(self) -> dict:
+        work = _current_work.get()
+        return work[self._key] if work is not None else self._default
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def copy(self) -> dict:
+        return dict(self._target())
+
+
+# 延迟直方图的桶上界（毫秒），按 1.2 倍等比增长，覆盖 1ms ~ 5分钟，
+# 分位数误差不超过 20%；最后一个桶收纳超过上界的值
+LATENCY_BUCKETS_MS = [round(1.2 ** i, 1) for i in range(70)]
+
+# 需要统计延迟分布的阶段
+LATENCY_STAGES = {
+    "poll": "轮询读取",
+    "ai": "AI调用",
+    "ttft": "首字延迟",
+    "faq": "FAQ 检索",
+    "write": "写回变量",
+    "total": "问题到答复"
+}
+
+# 限流级别及显示名称（见“限流”一节）
+RATE_LIMIT_LEVELS = {
+    "work": "作品",
+    "ai_key": "AI Key",
+    "kitten": "Kitten API"
 }
 
+
+def create_histogram() -> dict:
+    """创建一个空的延迟直方图"""
+    return {"counts": [0] * (len(LATENCY_BUCKETS_MS) + 1), "count": 0, "sum": 0.0, "max": 0.0}
+
+
+def histogram_add(histogram: dict, value_ms: float):
+    """向直方图加入一个值（毫秒）"""
+    index = bisect.bisect_left(LATENCY_BUCKETS_MS, value_ms)
+    histogram["counts"][index] += 1
+    histogram["count"] += 1
+    histogram["sum"] += value_ms
+    histogram["max"] = max(histogram["max"], value_ms)
+
+
+def histogram_to_buckets(histogram: dict) -> dict:
+    """直方图转为稀疏的 {桶上界: 数量}，超过最大上界的桶记为 "inf"，便于保存和跨文件合并"""
+    labels = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["inf"]
+    return {labels[i]: count for i, count in enumerate(histogram["counts"]) if count}
+
+
+def histogram_from_buckets(buckets: dict) -> list:
+    """把 {桶上界: 数量} 还原为计数列表，无法识别的桶上界归入最接近的桶"""
+    counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for label, count in buckets.items():
+        try:
+            bound = float(label)
+        except ValueError:
+            continue
+        counts[bisect.bisect_left(LATENCY_BUCKETS_MS, bound)] += count
+    return counts
+
+
+def histogram_merge(target: dict, source: dict):
+    """把另一个直方图（同一组桶）合并到 target"""
+    for i, count in enumerate(source.get("counts", [])[:len(target["counts"])]):
+        target["counts"][i] += count
+    target["count"] += source.get("count", 0)
+    target["sum"] += source.get("sum", 0.0)
+    target["max"] = max(target["max"], source.get("max", 0.0))
+
+
+def histogram_percentile(histogram: dict, percent: float):
+    """
+    估算分位数（毫秒）：返回第 percent% 个值所在桶的上界，不超过最大值
+    
+    Returns:
+        分位数，直方图为空时返回 None
+    """
+    if not histogram["count"]:
+        return None
+    rank = max(1, math.ceil(histogram["count"] * percent / 100))
+    seen = 0
+    for i, count in enumerate(histogram["counts"]):
+        seen += count
+        if seen >= rank:
+            upper = LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else histogram["max"]
+            return round(min(upper, histogram["max"]), 1)
+    return round(histogram["max"], 1)
+
+
+def record_latency(stage: str, seconds: float):
+    """记录某个阶段的耗时（秒）"""
+    if seconds is None:
+        return
+    histogram = stats["latency"].get(stage)
+    if histogram is not None:
+        histogram_add(histogram, seconds * 1000)
+
+
+def create_stats() -> dict:
+    """创建一份空的统计数据"""
+    return {
+        "start_time": None,
+        "end_time": None,
+        "total_polls": 0,
+        "total_questions": 0,
+        "successful_answers": 0,
+        "failed_answers": 0,
+        "total_errors": 0,
+        "cache_hits": 0,
+        "poll_interval": {"current": 0, "min": None, "max": None, "total": 0.0, "count": 0},
+        "online_checks": 0,
+        "sleep_ticks": 0,
+        "watch_events": 0,
+        "watch_reconnects": 0,
+        "reconnects": 0,
+        "retries": 0,
+        "circuit_rejections": 0,
+        "failovers": 0,
+        "hedges_sent": 0,
+        "hedges_won": 0,
+        "coalesced": 0,
+        "busy_answers": 0,
+        "list_drains": 0,
+        "list_questions": 0,
+        "list_writes": 0,
+        "ai_batches": 0,
+        "batched_questions": 0,
+        "batch_fallbacks": 0,
+        "prompt_tokens_saved": 0,
+        "tokens": {"prompt": 0, "completion": 0, "cached": 0, "calls": 0},
+        "truncated_answers": 0,
+        "faq": {"lookups": 0, "hits": 0, "score_total": 0.0, "hit_score_total": 0.0},
+        "rate_limit": {level: {"waits": 0, "wait_time": 0.0} for level in RATE_LIMIT_LEVELS},
+        "providers": {},
+        "ttft": {"last": None, "min": None, "max": None, "total": 0.0, "count": 0},
+        "partial_flushes": 0,
+        "latency": {stage: create_histogram() for stage in LATENCY_STAGES},
+        "online_periods": []
+    }
+
+
 # 运行时配置（从配置文件或命令行参数加载）
-CONFIG = DEFAULT_CONFIG.copy()
+CONFIG = WorkScopedDict("config", DEFAULT_CONFIG.copy())
 
-# 当前作品ID
+# 当前作品ID（单作品模式）
 WORK_ID = None
 
+# 是否为多作品模式（日志前缀显示作品ID）
+MULTI_WORK = False
+
+# 多作品模式下作品异常停止后的重启等待时间（秒）
+WORK_RESTART_DELAY = 30
+
 # 统计数据
-stats = {
-    "start_time": None,
-    "end_time": None,
-    "total_polls": 0,
-    "total_questions": 0,
-    "successful_answers": 0,
-    "failed_answers": 0,
-    "total_errors": 0,
-    "online_periods": []
-}
+stats = WorkScopedDict("stats", create_stats())
 
 # 默认系统提示词（当文件不存在时使用）
 DEFAULT_SYSTEM_PROMPT = """# AI助手提示词
@@ -89,51 +350,129 @@ DEFAULT_SYSTEM_PROMPT = """# AI助手提示词
 请作为AI助手，为玩家提供友好、准确的帮助！"""
 
 
-def load_system_prompt() -> str:
+def get_work_id():
+    """获取当前上下文的作品ID"""
+    work = _current_work.get()
+    return work["work_id"] if work is not None else WORK_ID
+
+
+def create_work(work_id: int, config: dict) -> dict:
     """
-    加载系统提示词
-    优先从配置文件指定的路径读取，如果不存在则使用默认提示词
+    创建作品运行上下文
     
+    Args:
+        work_id: 作品ID
+        config: 该作品独立的配置
+        
     Returns:
-        系统提示词内容
+        作品上下文字典
     """
+    return {
+        "work_id": work_id,
+        "config": config,
+        "stats": create_stats(),
+        "scheduler": create_scheduler()
+    }
+
+
+# 提示词缓存 {(提示词文件配置, 作品ID): {"content", "signature", "checked"}}
+_prompt_cache = {}
+_prompt_lock = threading.Lock()
+
+
+def get_prompt_candidates() -> list:
+    """获取提示词文件的候选路径（按优先级）"""
+    candidates = []
     prompt_file = CONFIG.get("system_prompt_file", "")
+    if prompt_file:
+        candidates.append(prompt_file)
+    
+    work_id = get_work_id()
+    if work_id:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        candidates.append(os.path.join(script_dir, "ai-bridge", f"system_prompt_{work_id}.txt"))
     
-    if prompt_file and os.path.exists(prompt_file):
+    return candidates
+
+
+def get_file_signature(path: str):
+    """获取文件的 (mtime, inode, size) 签名，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+    except OSError:
+        return None
+
+
+def read_system_prompt(candidates: list) -> str:
+    """
+    从磁盘读取系统提示词
+    优先从配置文件指定的路径读取，其次是作品提示词文件，都不存在则使用默认提示词
+    """
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
         try:
-            with open(prompt_file, 'r', encoding='utf-8') as f:
+            with open(path, 'r', encoding='utf-8') as f:
                 content = f.read().strip()
                 if content:
                     return content
         except Exception as e:
             print(f"读取提示词文件失败: {e}")
     
-    if WORK_ID:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        work_prompt_path = os.path.join(script_dir, "ai-bridge", f"system_prompt_{WORK_ID}.txt")
-        if os.path.exists(work_prompt_path):
-            try:
-                with open(work_prompt_path, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content:
-                        return content
-            except Exception as e:
-                print(f"读取作品提示词文件失败: {e}")
-    
     return DEFAULT_SYSTEM_PROMPT
 
 
-def load_config_from_file(config_path: str) -> bool:
+def load_system_prompt() -> str:
+    """
+    加载系统提示词（带缓存）
+    内容缓存在内存中，每隔 prompt_check_interval 秒检查一次文件的修改时间/inode/大小，
+    文件变化后自动重新加载，修改提示词无需重启
+    
+    Returns:
+        系统提示词内容
+    """
+    key = (CONFIG.get("system_prompt_file", ""), get_work_id())
+    now = time.monotonic()
+    check_interval = CONFIG.get("prompt_check_interval") or 5
+    
+    entry = _prompt_cache.get(key)
+    if entry and now - entry["checked"] < check_interval:
+        return entry["content"]
+    
+    with _prompt_lock:
+        entry = _prompt_cache.get(key)
+        if entry and now - entry["checked"] < check_interval:
+            return entry["content"]
+        
+        candidates = get_prompt_candidates()
+        signature = tuple(get_file_signature(path) for path in candidates)
+        
+        if entry and entry["signature"] == signature:
+            entry["checked"] = now
+            return entry["content"]
+        
+        content = read_system_prompt(candidates)
+        if entry and entry["content"] != content:
+            log("INFO", f"提示词已更新，重新加载 ({len(content)} 字符)")
+        
+        _prompt_cache[key] = {"content": content, "signature": signature, "checked": now}
+        return content
+
+
+def load_config_from_file(config_path: str, target: dict = None) -> bool:
     """
     从配置文件加载配置
     
     Args:
         config_path: 配置文件路径
+        target: 写入的配置字典，默认为当前配置 CONFIG
         
     Returns:
         是否加载成功
     """
-    global CONFIG
+    if target is None:
+        target = CONFIG
     
     if not os.path.exists(config_path):
         return False
@@ -155,8 +494,10 @@ def load_config_from_file(config_path: str) -> bool:
         if 'CONFIG' in safe_locals:
             file_config = safe_locals['CONFIG']
             for key in DEFAULT_CONFIG:
-                if key in file_config and file_config[key]:
-                    CONFIG[key] = file_config[key]
+                # 显式设置的 0 / False 也生效（如 online_check_interval: 0、ai_temperature: 0），
+                # None 和空字符串视为未设置，不覆盖公共配置文件中的值
+                if key in file_config and file_config[key] is not None and file_config[key] != "":
+                    target[key] = file_config[key]
             return True
         
         return False
@@ -165,20 +506,149 @@ def load_config_from_file(config_path: str) -> bool:
         return False
 
 
-def get_poll_interval() -> int:
+def create_scheduler() -> dict:
+    """
+    创建轮询调度状态
+    idle_polls: 上次收到问题后的空闲轮询次数
+    history: 按"星期几 x 小时"统计的问题数（168 个时段），用于判断繁忙时段
+    online_users / asleep / last_online_check: 在线人数及无人在线时的休眠状态
+    """
+    return {
+        "idle_polls": 0,
+        "history": [0] * 168,
+        "online_users": None,
+        "asleep": False,
+        "last_online_check": 0.0
+    }
+
+
+_default_scheduler = create_scheduler()
+
+
+def get_scheduler() -> dict:
+    """获取当前作品的轮询调度状态"""
+    work = _current_work.get()
+    return work["scheduler"] if work is not None else _default_scheduler
+
+
+def get_hour_of_week() -> int:
+    """当前时间在一周中的小时序号 (0-167)"""
+    now = datetime.now()
+    return now.weekday() * 24 + now.hour
+
+
+def record_question_arrival():
+    """收到问题：下一次轮询回到最短间隔，并计入当前时段的历史"""
+    scheduler = get_scheduler()
+    scheduler["idle_polls"] = 0
+    scheduler["history"][get_hour_of_week()] += 1
+
+
+def get_poll_interval() -> float:
     """
-    根据当前时间获取轮询间隔
-    白天(6:00-18:00): 3秒
-    晚上(18:00-23:00): 5秒
-    凌晨(23:00-6:00): 10秒
+    自适应计算下一次轮询间隔
+    收到问题后使用最短间隔，空闲时按 poll_backoff 指数增长直到上限；
+    历史上问题越多的时段（星期几 x 小时），上限越接近最短间隔
     """
-    hour = datetime.now().hour
-    if 6 <= hour < 18:
-        return 3
-    elif 18 <= hour < 23:
-        return 5
+    scheduler = get_scheduler()
+    min_interval = CONFIG.get("poll_interval_min") or 1
+    max_interval = max(CONFIG.get("poll_interval_max") or 10, min_interval)
+    backoff = max(CONFIG.get("poll_backoff") or 1.5, 1.0)
+    
+    # 历史样本足够时，按当前时段的相对繁忙程度收紧上限
+    history = scheduler["history"]
+    if sum(history) >= 20:
+        busy_ratio = history[get_hour_of_week()] / max(history)
+        max_interval = max_interval - (max_interval - min_interval) * busy_ratio
+    
+    # 在对数空间比较后再取指数，长时间空闲（idle_polls 很大）时不会溢出；到达上限后不再累加空闲计数
+    if backoff > 1 and scheduler["idle_polls"] * math.log(backoff) < math.log(max_interval / min_interval):
+        interval = min(min_interval * backoff ** scheduler["idle_polls"], max_interval)
+        scheduler["idle_polls"] += 1
     else:
-        return 10
+        interval = max_interval if backoff > 1 else min_interval
+    
+    interval_stats = stats["poll_interval"]
+    interval_stats["current"] = round(interval, 2)
+    interval_stats["min"] = interval_stats["current"] if interval_stats["min"] is None else min(interval_stats["min"], interval_stats["current"])
+    interval_stats["max"] = interval_stats["current"] if interval_stats["max"] is None else max(interval_stats["max"], interval_stats["current"])
+    interval_stats["total"] += interval
+    interval_stats["count"] += 1
+    
+    return interval
+
+
+def record_online_users(online_users) -> bool:
+    """
+    记录在线人数并切换休眠状态
+    无人在线时进入休眠，有人加入时立即恢复最短轮询间隔
+    
+    Args:
+        online_users: 在线人数（无法获取时为 None）
+        
+    Returns:
+        当前是否处于休眠状态
+    """
+    scheduler = get_scheduler()
+    if not isinstance(online_users, int):
+        return scheduler["asleep"]
+    
+    scheduler["online_users"] = online_users
+    if online_users == 0 and not scheduler["asleep"]:
+        scheduler["asleep"] = True
+        log("INFO", f"作品无人在线，进入休眠（每 {CONFIG.get('sleep_poll_interval') or 15} 秒检查一次在线人数）")
+    elif online_users > 0 and scheduler["asleep"]:
+        scheduler["asleep"] = False
+        scheduler["idle_polls"] = 0
+        log("INFO", f"有玩家加入 (在线 {online_users} 人)，恢复轮询")
+    return scheduler["asleep"]
+
+
+def get_poll_history_path():
+    """获取轮询时段历史文件路径"""
+    work_id = get_work_id()
+    if work_id:
+        return os.path.join(CONFIG["log_dir"], f"poll_history_{work_id}.json")
+    return os.path.join(CONFIG["log_dir"], "poll_history.json")
+
+
+def load_poll_history():
+    """加载问题时段历史（跨重启累计）"""
+    path = get_poll_history_path()
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            history = json.load(f).get("hour_of_week", [])
+        if len(history) == 168:
+            get_scheduler()["history"] = [int(n) for n in history]
+    except Exception as e:
+        print(f"加载轮询历史失败: {e}")
+
+
+def save_poll_history():
+    """保存问题时段历史"""
+    try:
+        write_json_atomic(get_poll_history_path(), {"hour_of_week": get_scheduler()["history"]})
+    except Exception as e:
+        print(f"保存轮询历史失败: {e}")
+
+
+def write_json_atomic(path: str, data, indent: int = None):
+    """
+    原子写入 JSON 文件：先写临时文件并落盘，再重命名覆盖
+    进程在写入过程中崩溃或断电时，原文件保持完整
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def ensure_log_dir():
@@ -191,70 +661,218 @@ def ensure_log_dir():
 def get_log_file_path():
     """获取当日日志文件路径"""
     date_str = datetime.now().strftime("%Y-%m-%d")
-    if WORK_ID:
-        return os.path.join(CONFIG["log_dir"], f"ai_bridge_{WORK_ID}_{date_str}.log")
+    work_id = get_work_id()
+    if work_id:
+        return os.path.join(CONFIG["log_dir"], f"ai_bridge_{work_id}_{date_str}.log")
     return os.path.join(CONFIG["log_dir"], f"ai_bridge_{date_str}.log")
 
 
+def get_call_record_path():
+    """获取当日调用记录文件路径（JSONL，每行一条调用记录）"""
+    date_str = datetime.now().strftime("%Y-%m-%d")
+    work_id = get_work_id()
+    if work_id:
+        return os.path.join(CONFIG["log_dir"], f"calls_{work_id}_{date_str}.jsonl")
+    return os.path.join(CONFIG["log_dir"], f"calls_{date_str}.jsonl")
+
+
 def get_stats_file_path():
     """获取统计文件路径"""
     date_str = datetime.now().strftime("%Y-%m-%d")
-    if WORK_ID:
-        return os.path.join(CONFIG["log_dir"], f"stats_{WORK_ID}_{date_str}.json")
+    work_id = get_work_id()
+    if work_id:
+        return os.path.join(CONFIG["log_dir"], f"stats_{work_id}_{date_str}.json")
     return os.path.join(CONFIG["log_dir"], f"stats_{date_str}.json")
 
 
+# ==================== 日志写入 ====================
+# 日志先进入有界队列，由后台线程批量写入，调用方不做任何文件 I/O
+# 每个日志文件保持一个打开的句柄，按日期换文件后旧句柄空闲一段时间自动关闭
+LOG_QUEUE_SIZE = 10000
+LOG_HANDLE_IDLE = 600
+
+# 日志级别，低于 log_level 的日志不打印也不写入文件
+LOG_LEVELS = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "SUCCESS": 20,
+    "STATS": 20,
+    "WARNING": 30,
+    "ERROR": 40,
+    "SYSTEM": 50
+}
+
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_thread = None
+_log_thread_lock = threading.Lock()
+_log_dropped = 0
+
+
+def log_writer_loop():
+    """后台写日志线程：取出队列中已有的全部日志，按文件分组写入后统一 flush"""
+    handles = {}
+    running = True
+    while running:
+        batch = [_log_queue.get()]
+        while True:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        now = time.monotonic()
+        for item in batch:
+            if item is None:
+                running = False
+                continue
+            path, text = item
+            entry = handles.get(path)
+            try:
+                if entry is None:
+                    log_dir = os.path.dirname(path)
+                    if log_dir:
+                        os.makedirs(log_dir, exist_ok=True)
+                    entry = handles[path] = [open(path, "a", encoding="utf-8"), now]
+                entry[0].write(text)
+                entry[1] = now
+            except Exception as e:
+                print(f"写入日志失败: {e}")
+        
+        for path, entry in list(handles.items()):
+            try:
+                entry[0].flush()
+                if not running or now - entry[1] > LOG_HANDLE_IDLE:
+                    entry[0].close()
+                    del handles[path]
+            except Exception as e:
+                print(f"写入日志失败: {e}")
+                handles.pop(path, None)
+        
+        for _ in batch:
+            _log_queue.task_done()
+
+
+def start_log_writer():
+    """启动后台写日志线程（首次写日志时自动调用）"""
+    global _log_thread
+    with _log_thread_lock:
+        if _log_thread is None:
+            _log_thread = threading.Thread(target=log_writer_loop, name="ai-bridge-log", daemon=True)
+            _log_thread.start()
+            atexit.register(stop_log_writer)
+
+
+def stop_log_writer(timeout: float = 5):
+    """写完队列中剩余的日志并停止后台线程（程序退出时自动调用）"""
+    global _log_thread
+    with _log_thread_lock:
+        thread = _log_thread
+        _log_thread = None
+    if thread is None:
+        return
+    try:
+        _log_queue.put(None, timeout=timeout)
+    except queue.Full:
+        return
+    thread.join(timeout)
+
+
+def enqueue_log_text(path: str, text: str):
+    """将文本放入写日志队列，队列满时丢弃并计数，不阻塞调用方"""
+    global _log_dropped
+    if _log_thread is None:
+        start_log_writer()
+    try:
+        _log_queue.put_nowait((path, text))
+    except queue.Full:
+        _log_dropped += 1
+
+
 def write_log(message: str, log_type: str = "INFO"):
     """
-    写入日志文件
+    写入日志文件（异步，由后台线程完成实际写入）
     
     Args:
         message: 日志消息
         log_type: 日志类型
     """
-    ensure_log_dir()
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_line = f"[{timestamp}] [{log_type}] {message}\n"
-    
-    try:
-        with open(get_log_file_path(), "a", encoding="utf-8") as f:
-            f.write(log_line)
-    except Exception as e:
-        print(f"写入日志失败: {e}")
+    enqueue_log_text(get_log_file_path(), f"[{timestamp}] [{log_type}] {message}\n")
 
 
-def write_call_record(question: str, answer: str, success: bool, duration: float):
+def write_call_record(record: dict):
     """
-    写入调用记录
+    写入调用记录（JSONL，独立于运行日志）
     
     Args:
-        question: 问题
-        answer: 答复
-        success: 是否成功
-        duration: 耗时（秒）
+        record: 调用记录，包含 question、answer、success、source、model、error、
+                durations（各阶段耗时，秒）等字段
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    status = "成功" if success else "失败"
-    
-    record = f"""
-{'='*60}
-时间: {timestamp}
-状态: {status}
-耗时: {duration:.2f}秒
-问题: {question}
-答复: {answer}
-{'='*60}
-"""
-    
-    try:
-        with open(get_log_file_path(), "a", encoding="utf-8") as f:
-            f.write(record)
-    except Exception as e:
-        print(f"写入调用记录失败: {e}")
+    now = time.time()
+    answer = record.get("answer") or ""
+    durations = {k: round(v, 3) for k, v in record.get("durations", {}).items() if v is not None}
+    line = {
+        "time": datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+        "ts": round(now, 3),
+        "work_id": get_work_id(),
+        "status": "success" if record.get("success") else "failed",
+        "source": record.get("source", "ai"),
+        "cache_hit": record.get("source") == "cache",
+        "coalesced": bool(record.get("coalesced")),
+        "model": record.get("model") or CONFIG["ai_model"],
+        "provider": record.get("provider"),
+        "question": record.get("question"),
+        "answer": answer,
+        "answer_length": len(answer),
+        "error": record.get("error"),
+        "written": record.get("written"),
+        "hedge": record.get("hedge"),
+        "slot": record.get("slot"),
+        "list": record.get("list"),
+        "batch": record.get("batch"),
+        "tokens": record.get("tokens"),
+        "faq_score": record.get("faq_score"),
+        "truncated": record.get("truncated"),
+        "request_id": record.get("request_id"),
+        "durations": durations
+    }
+    enqueue_log_text(get_call_record_path(), json.dumps(line, ensure_ascii=False) + "\n")
+
+
+# 各作品上次保存统计时的时间和已答复数 {作品ID: {"time": time.monotonic(), "answers": 答复数}}
+_stats_checkpoints = {}
+
+
+def stats_checkpoint_due() -> bool:
+    """
+    是否需要写入统计检查点：距上次保存超过 stats_save_interval 秒或新增答复达到 stats_save_every 条
+    只比较内存中的计数，可以直接在事件循环中调用，需要写入时再交给线程
+    """
+    checkpoint = _stats_checkpoints.get(get_work_id())
+    if checkpoint is None:
+        return True
+    answers = stats["successful_answers"] + stats["failed_answers"]
+    elapsed = time.monotonic() - checkpoint["time"]
+    return (elapsed >= (CONFIG.get("stats_save_interval") or 0)
+            or answers - checkpoint["answers"] >= (CONFIG.get("stats_save_every") or 1))
 
 
-def save_stats():
-    """保存统计数据到文件"""
+def save_stats(force: bool = False) -> bool:
+    """
+    保存统计数据到文件（检查点）
+    未到保存时机（见 stats_checkpoint_due）时不写入
+    
+    Args:
+        force: 忽略保存间隔立即写入（退出时使用）
+        
+    Returns:
+        是否写入了文件
+    """
+    if not force and not stats_checkpoint_due():
+        return False
+    answers = stats["successful_answers"] + stats["failed_answers"]
+    _stats_checkpoints[get_work_id()] = {"time": time.monotonic(), "answers": answers}
+    
     ensure_log_dir()
     
     stats_data = {
@@ -266,7 +884,64 @@ def save_stats():
         "successful_answers": stats["successful_answers"],
         "failed_answers": stats["failed_answers"],
         "total_errors": stats["total_errors"],
+        "cache_hits": stats["cache_hits"],
+        "poll_interval": {
+            "current": stats["poll_interval"]["current"],
+            "min": stats["poll_interval"]["min"],
+            "max": stats["poll_interval"]["max"],
+            "avg": round(stats["poll_interval"]["total"] / stats["poll_interval"]["count"], 2) if stats["poll_interval"]["count"] else None,
+            "count": stats["poll_interval"]["count"]
+        },
+        "online_checks": stats["online_checks"],
+        "sleep_ticks": stats["sleep_ticks"],
+        "watch_events": stats["watch_events"],
+        "watch_reconnects": stats["watch_reconnects"],
+        "reconnects": stats["reconnects"],
+        "retries": stats["retries"],
+        "circuit_rejections": stats["circuit_rejections"],
+        "circuit_breakers": get_breaker_states(),
+        "failovers": stats["failovers"],
+        "hedges_sent": stats["hedges_sent"],
+        "hedges_won": stats["hedges_won"],
+        "coalesced": stats["coalesced"],
+        "busy_answers": stats["busy_answers"],
+        "list_drains": stats["list_drains"],
+        "list_questions": stats["list_questions"],
+        "list_writes": stats["list_writes"],
+        "ai_batches": stats["ai_batches"],
+        "batched_questions": stats["batched_questions"],
+        "batch_fallbacks": stats["batch_fallbacks"],
+        "prompt_tokens_saved": stats["prompt_tokens_saved"],
+        "tokens": stats["tokens"],
+        "truncated_answers": stats["truncated_answers"],
+        "faq": stats["faq"],
+        "rate_limit": {
+            level: {"waits": item["waits"], "wait_time": round(item["wait_time"], 3)}
+            for level, item in stats["rate_limit"].items()
+        },
+        "providers": get_provider_summary(),
+        "ttft": {
+            "last": stats["ttft"]["last"],
+            "min": stats["ttft"]["min"],
+            "max": stats["ttft"]["max"],
+            "avg": round(stats["ttft"]["total"] / stats["ttft"]["count"], 3) if stats["ttft"]["count"] else None,
+            "count": stats["ttft"]["count"]
+        },
+        "partial_flushes": stats["partial_flushes"],
+        "latency": {
+            stage: {
+                "count": histogram["count"],
+                "sum_ms": round(histogram["sum"], 1),
+                "max_ms": round(histogram["max"], 1),
+                "p50_ms": histogram_percentile(histogram, 50),
+                "p90_ms": histogram_percentile(histogram, 90),
+                "p99_ms": histogram_percentile(histogram, 99),
+                "buckets": histogram_to_buckets(histogram)
+            }
+            for stage, histogram in stats["latency"].items()
+        },
         "uptime_seconds": calculate_uptime(),
+        "checkpoint_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "online_periods": [
             {
                 "start": p[0].strftime("%Y-%m-%d %H:%M:%S") if isinstance(p[0], datetime) else p[0],
@@ -277,14 +952,111 @@ def save_stats():
     }
     
     try:
-        with open(get_stats_file_path(), "w", encoding="utf-8") as f:
-            json.dump(stats_data, f, ensure_ascii=False, indent=2)
+        write_json_atomic(get_stats_file_path(), stats_data, indent=2)
     except Exception as e:
         print(f"保存统计失败: {e}")
+    
+    save_poll_history()
+    return True
+
+
+def parse_stats_time(value):
+    """解析统计文件中的时间字符串，无法解析时返回 None"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def load_stats() -> bool:
+    """
+    从当日统计文件恢复统计数据，进程重启后计数和在线时段继续累计
+    上次未正常退出时，最后一个在线时段以最后一次检查点时间结束
+    
+    Returns:
+        是否恢复了统计数据
+    """
+    path = get_stats_file_path()
+    if not os.path.exists(path):
+        return False
+    
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        log("WARNING", f"读取统计文件失败，从零开始统计: {e}")
+        return False
+    
+    if data.get("date") != datetime.now().strftime("%Y-%m-%d"):
+        return False
+    
+    for key in ("total_polls", "total_questions", "successful_answers", "failed_answers", "total_errors",
+                "cache_hits", "online_checks", "sleep_ticks", "watch_events", "watch_reconnects", "reconnects",
+                "retries", "circuit_rejections", "failovers", "hedges_sent", "hedges_won",
+                "coalesced", "busy_answers", "list_drains", "list_questions", "list_writes",
+                "ai_batches", "batched_questions", "batch_fallbacks", "prompt_tokens_saved", "truncated_answers",
+                "partial_flushes"):
+        if isinstance(data.get(key), int):
+            stats[key] = data[key]
+    
+    for key in ("poll_interval", "ttft"):
+        saved = data.get(key) or {}
+        if saved.get("count"):
+            stats[key]["min"] = saved.get("min")
+            stats[key]["max"] = saved.get("max")
+            stats[key]["count"] = saved["count"]
+            stats[key]["total"] = (saved.get("avg") or 0) * saved["count"]
+    
+    for key, value in (data.get("tokens") or {}).items():
+        if key in stats["tokens"] and isinstance(value, int):
+            stats["tokens"][key] = value
+    
+    for key, value in (data.get("faq") or {}).items():
+        if key in stats["faq"] and isinstance(value, (int, float)):
+            stats["faq"][key] = value
+    
+    for level, saved in (data.get("rate_limit") or {}).items():
+        if level in stats["rate_limit"]:
+            stats["rate_limit"][level]["waits"] = saved.get("waits", 0)
+            stats["rate_limit"][level]["wait_time"] = saved.get("wait_time", 0.0)
+    
+    for name, saved in (data.get("providers") or {}).items():
+        provider_stats = get_provider_stats(name)
+        provider_stats["requests"] = saved.get("requests", 0)
+        provider_stats["failures"] = saved.get("failures", 0)
+        provider_stats["latency_count"] = saved.get("requests", 0) - saved.get("failures", 0)
+        provider_stats["latency_total"] = (saved.get("avg_latency_ms") or 0) / 1000 * provider_stats["latency_count"]
+    
+    for stage, saved in (data.get("latency") or {}).items():
+        if stage in stats["latency"]:
+            stats["latency"][stage] = create_histogram()
+            histogram_merge(stats["latency"][stage], {
+                "counts": histogram_from_buckets(saved.get("buckets") or {}),
+                "count": saved.get("count", 0),
+                "sum": saved.get("sum_ms", 0.0),
+                "max": saved.get("max_ms", 0.0)
+            })
+    
+    checkpoint_time = parse_stats_time(data.get("checkpoint_time") or data.get("end_time"))
+    periods = []
+    for period in data.get("online_periods", []):
+        start = parse_stats_time(period.get("start"))
+        if start is None:
+            continue
+        end = parse_stats_time(period.get("end")) or checkpoint_time or start
+        periods.append([start, end])
+    stats["online_periods"] = periods
+    stats["start_time"] = parse_stats_time(data.get("start_time"))
+    
+    log("INFO", f"已恢复今日统计: 收到问题 {stats['total_questions']} / 成功答复 {stats['successful_answers']} / 在线时段 {len(periods)} 个")
+    return True
 
 
 def calculate_uptime() -> int:
-    """计算运行时长（秒）"""
+    """计算运行时长（秒），有在线时段记录时为各时段之和，不含进程重启前的停机时间"""
+    if stats["online_periods"]:
+        now = datetime.now()
+        return int(sum(((end or now) - start).total_seconds() for start, end in stats["online_periods"]))
     if stats["start_time"] and stats["end_time"]:
         return int((stats["end_time"] - stats["start_time"]).total_seconds())
     elif stats["start_time"]:
@@ -314,9 +1086,13 @@ def log(level: str, message: str):
     打印带时间戳的日志并写入文件
     
     Args:
-        level: 日志级别 (INFO, SUCCESS, ERROR, WARNING)
+        level: 日志级别 (DEBUG, INFO, SUCCESS, STATS, WARNING, ERROR)
         message: 日志消息
     """
+    min_level = str(CONFIG.get("log_level") or "DEBUG").upper()
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS.get(min_level, 10):
+        return
+    
     timestamp = datetime.now().strftime("%H:%M:%S")
     level_colors = {
         "INFO": "\033[94m",
@@ -328,7 +1104,9 @@ def log(level: str, message: str):
     }
     reset_color = "\033[0m"
     color = level_colors.get(level, "")
-    print(f"[{timestamp}] {color}[{level}]{reset_color} {message}")
+    work_id = get_work_id()
+    work_tag = f"[作品{work_id}] " if MULTI_WORK and work_id else ""
+    print(f"[{timestamp}] {color}[{level}]{reset_color} {work_tag}{message}")
     
     write_log(message, level)
 
@@ -348,6 +1126,75 @@ def print_stats():
     log("STATS", f"  失败答复: {stats['failed_answers']}")
     log("STATS", f"  成功率: {success_rate:.1f}%")
     log("STATS", f"  错误次数: {stats['total_errors']}")
+    if stats["reconnects"]:
+        log("STATS", f"  重连次数: {stats['reconnects']}")
+    if stats["retries"] or stats["circuit_rejections"]:
+        log("STATS", f"  请求重试: {stats['retries']} 次 / 熔断拒绝: {stats['circuit_rejections']} 次")
+    if stats["failovers"]:
+        log("STATS", f"  服务商切换: {stats['failovers']} 次")
+    if stats["coalesced"]:
+        log("STATS", f"  合并相同问题: {stats['coalesced']} 次")
+    for level, item in stats["rate_limit"].items():
+        if item["waits"]:
+            log("STATS", f"  {RATE_LIMIT_LEVELS[level]}限流等待: {item['waits']} 次 / 共 {item['wait_time']:.1f}秒")
+    if stats["busy_answers"]:
+        log("STATS", f"  繁忙答复: {stats['busy_answers']} 次（已计入失败答复）")
+    if stats["list_drains"]:
+        log("STATS", f"  提问列表: 取出 {stats['list_drains']} 批 / 共 {stats['list_questions']} 个问题 / "
+                     f"写回答复列表 {stats['list_writes']} 次")
+    if stats["tokens"]["calls"]:
+        tokens = stats["tokens"]
+        hit_rate = tokens["cached"] / tokens["prompt"] * 100 if tokens["prompt"] else 0
+        log("STATS", f"  Token: 提示词 {tokens['prompt']} (缓存命中 {tokens['cached']}, {hit_rate:.0f}%) / "
+                     f"答复 {tokens['completion']} / 共 {tokens['calls']} 次请求")
+    if stats["truncated_answers"]:
+        log("STATS", f"  截断过长答复: {stats['truncated_answers']} 次")
+    if stats["faq"]["lookups"]:
+        faq = stats["faq"]
+        log("STATS", f"  FAQ: 查询 {faq['lookups']} 次 / 命中 {faq['hits']} 次 ({faq['hits'] / faq['lookups'] * 100:.1f}%) / "
+                     f"平均最高相似度 {faq['score_total'] / faq['lookups']:.2f}"
+                     + (f" / 命中平均相似度 {faq['hit_score_total'] / faq['hits']:.2f}" if faq["hits"] else ""))
+    if stats["ai_batches"]:
+        log("STATS", f"  批量请求: {stats['ai_batches']} 次 / 共 {stats['batched_questions']} 个问题 / "
+                     f"回退单独请求 {stats['batch_fallbacks']} 个 / 约节省提示词 {stats['prompt_tokens_saved']} tokens")
+    if stats["hedges_sent"]:
+        log("STATS", f"  对冲请求: 发出 {stats['hedges_sent']} 次 / 胜出 {stats['hedges_won']} 次")
+    if len(get_ai_providers()) > 1:
+        for name, summary in get_provider_summary().items():
+            log("STATS", f"  服务商 {name}: 请求 {summary['requests']} 次 / 失败 {summary['failures']} 次 / "
+                         f"平均耗时 {summary['avg_latency_ms'] / 1000:.2f}秒 / 近期错误率 {summary['error_rate'] * 100:.0f}%")
+    for url, breaker_state in get_breaker_states().items():
+        if breaker_state["state"] != "closed" or breaker_state["opens"]:
+            log("STATS", f"  熔断器 {url}: {BREAKER_STATE_NAMES[breaker_state['state']]} (累计熔断 {breaker_state['opens']} 次)")
+    if CONFIG.get("answer_cache"):
+        log("STATS", f"  缓存命中: {stats['cache_hits']}")
+    scheduler = get_scheduler()
+    if scheduler["online_users"] is not None:
+        log("STATS", f"  在线人数: {scheduler['online_users']}{' (休眠中)' if scheduler['asleep'] else ''}")
+        log("STATS", f"  在线检查: {stats['online_checks']} 次 / 休眠跳过轮询: {stats['sleep_ticks']} 次")
+    watch_states = (_current_work.get() or {}).get("watch_states")
+    if CONFIG.get("watch_mode") and watch_states:
+        connected = sum(1 for state in watch_states if state["connected"])
+        status = ("已连接" if connected else "已断开") if len(watch_states) == 1 else f"已连接 {connected}/{len(watch_states)}"
+        log("STATS", f"  变化推送: {status} / 事件 {stats['watch_events']} 条 / 重连 {stats['watch_reconnects']} 次")
+    ttft_stats = stats["ttft"]
+    if ttft_stats["count"]:
+        log("STATS", f"  首字延迟: 平均 {ttft_stats['total'] / ttft_stats['count']:.2f}秒 (最短 {ttft_stats['min']}秒, 最长 {ttft_stats['max']}秒) / 部分写回 {stats['partial_flushes']} 次")
+    for stage, name in LATENCY_STAGES.items():
+        histogram = stats["latency"][stage]
+        if histogram["count"]:
+            p50, p90, p99 = (histogram_percentile(histogram, p) for p in (50, 90, 99))
+            log("STATS", f"  {name}延迟: p50 {p50:.0f}ms / p90 {p90:.0f}ms / p99 {p99:.0f}ms / 最大 {histogram['max']:.0f}ms ({histogram['count']} 次)")
+    interval_stats = stats["poll_interval"]
+    if interval_stats["count"]:
+        log("STATS", f"  轮询间隔: 当前 {interval_stats['current']}秒 / 平均 {interval_stats['total'] / interval_stats['count']:.2f}秒 (最短 {interval_stats['min']}秒, 最长 {interval_stats['max']}秒)")
+    inbox = (_current_work.get() or {}).get("inbox")
+    if inbox is not None:
+        log("STATS", f"  待处理问题: {len(inbox['pending'])}")
+    pool_stats = get_pool_stats()
+    log("STATS", f"  连接复用: 命中 {pool_stats['hits']} / 新建 {pool_stats['misses']}")
+    if _log_dropped:
+        log("STATS", f"  日志队列已满丢弃: {_log_dropped} 条")
     log("STATS", "=" * 50)
     print()
 
@@ -357,9 +1204,21 @@ def print_config():
     log("INFO", "=" * 50)
     log("INFO", "当前配置:")
     log("INFO", f"  API服务地址: {CONFIG['api_base_url']}")
-    log("INFO", f"  AI API地址: {CONFIG['ai_api_url']}")
-    log("INFO", f"  AI模型: {CONFIG['ai_model']}")
-    log("INFO", f"  云变量名: {CONFIG['variable_name']}")
+    if CONFIG.get("ai_providers"):
+        for provider in get_ai_providers():
+            log("INFO", f"  AI服务商 {provider['name']}: {provider['url']} / {provider['model']} "
+                        f"(权重 {provider['weight']}, 超时 {provider['timeout']}秒)")
+    else:
+        log("INFO", f"  AI API地址: {CONFIG['ai_api_url']}")
+        log("INFO", f"  AI模型: {CONFIG['ai_model']}")
+    if CONFIG.get("queue_list"):
+        log("INFO", f"  提问列表: {CONFIG['queue_list']} / 答复列表: {get_answer_list_name()}（队列模式，"
+                    f"每批最多 {CONFIG['queue_batch_size']} 个问题）")
+    elif CONFIG.get("slot_count"):
+        slot_names = get_slot_names()
+        log("INFO", f"  云变量名: {slot_names[0]} ~ {slot_names[-1]}（多路复用协议，{len(slot_names)} 个槽位）")
+    else:
+        log("INFO", f"  云变量名: {CONFIG['variable_name']}")
     log("INFO", f"  问题前缀: {CONFIG['question_prefix']}")
     log("INFO", f"  答案前缀: {CONFIG['answer_prefix']}")
     log("INFO", f"  提示词文件: {CONFIG.get('system_prompt_file', '使用默认')}")
@@ -367,40 +1226,605 @@ def print_config():
     log("INFO", "=" * 50)
 
 
-def normalize_api_url(url: str) -> str:
+# ==================== 可中断的请求 ====================
+# 对冲请求落败、停止推送订阅时需要中断阻塞在读取上的请求：
+# 连接池中的连接每发出一个请求，就把所用的 socket 登记到当前上下文的中断句柄 (_abort_handle)，
+# 其他线程调用 abort_requests 关闭这些 socket，阻塞的读取立即出错返回
+# 请求结束、连接回到连接池后登记随即解除，不会误关其他请求正在使用的连接
+
+_abort_handle = contextvars.ContextVar("abort_handle", default=None)
+
+
+def create_abort_handle() -> dict:
+    """创建中断句柄：sockets 为进行中的请求所用的 socket，aborted 表示已被中断"""
+    return {"sockets": [], "aborted": False, "lock": threading.Lock()}
+
+
+def shutdown_socket(sock):
+    """关闭 socket 的读写，阻塞在读取上的线程立即返回"""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def register_socket(sock):
+    """把请求所用的 socket 登记到当前上下文的中断句柄，句柄已被中断时直接关闭"""
+    handle = _abort_handle.get()
+    if handle is None or sock is None:
+        return
+    with handle["lock"]:
+        aborted = handle["aborted"]
+        if not aborted:
+            handle["sockets"].append(sock)
+    if aborted:
+        shutdown_socket(sock)
+
+
+def release_sockets():
+    """当前上下文的请求已结束，连接回到连接池，解除登记"""
+    handle = _abort_handle.get()
+    if handle is not None:
+        with handle["lock"]:
+            handle["sockets"] = []
+
+
+def request_aborted() -> bool:
+    """当前上下文的请求是否已被中断"""
+    handle = _abort_handle.get()
+    return handle is not None and handle["aborted"]
+
+
+def abort_requests(handle: dict) -> int:
     """
-    规范化 API URL，确保以 /api 结尾
+    中断句柄上进行中的请求，之后用该句柄发出的请求也会立即失败
     
-    Args:
-        url: 原始 URL
-        
     Returns:
-        规范化后的 URL
+        关闭的 socket 数
     """
-    url = url.rstrip('/')
-    if not url.endswith('/api'):
-        url = url + '/api'
-    return url
+    with handle["lock"]:
+        handle["aborted"] = True
+        sockets, handle["sockets"] = handle["sockets"], []
+    for sock in sockets:
+        shutdown_socket(sock)
+    return len(sockets)
 
 
-def connect_to_work(api_base_url: str, work_id: int) -> dict:
-    """
-    连接到编程猫作品
+class AbortableHTTPConnection(HTTPConnection):
+    """发出请求时把 socket 登记到当前上下文的中断句柄"""
     
-    Args:
-        api_base_url: API基础地址
-        work_id: 作品ID
-        
-    Returns:
-        连接信息字典
-    """
-    api_base_url = normalize_api_url(api_base_url)
-    url = f"{api_base_url}/connection/connect"
-    payload = {"workId": work_id}
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        register_socket(self.sock)
+
+
+class AbortableHTTPSConnection(HTTPSConnection):
+    """发出请求时把 socket 登记到当前上下文的中断句柄"""
     
-    try:
-        response = requests.post(url, json=payload, timeout=CONFIG["request_timeout"])
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        register_socket(self.sock)
+
+
+class AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = AbortableHTTPConnection
+
+
+class AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = AbortableHTTPSConnection
+
+
+class AbortableHTTPAdapter(HTTPAdapter):
+    """连接池使用可中断连接的 HTTPAdapter"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": AbortableHTTPConnectionPool,
+            "https": AbortableHTTPSConnectionPool
+        }
+
+
+# ==================== HTTP 连接池 ====================
+# 按主机复用 requests.Session，所有作品共享同一进程内的连接池
+_http_sessions = {}
+_http_last_used = {}
+_http_keepalive = {}
+_http_lock = threading.Lock()
+
+
+def get_origin(url: str) -> str:
+    """获取 URL 的 scheme://host:port 部分"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_http_session(url: str) -> requests.Session:
+    """
+    获取目标主机的共享会话（长连接 + 连接池）
+    
+    Args:
+        url: 请求地址
+        
+    Returns:
+        该主机的 requests.Session
+    """
+    origin = get_origin(url)
+    session = _http_sessions.get(origin)
+    if session is not None:
+        return session
+    
+    with _http_lock:
+        session = _http_sessions.get(origin)
+        if session is None:
+            pool_size = int(CONFIG.get("http_pool_size") or 10)
+            adapter = AbortableHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_sessions[origin] = session
+        return session
+
+
+def http_post(url: str, **kwargs) -> requests.Response:
+    """
+    通过共享连接池发送 POST 请求，参数同 requests.post
+    非流式请求返回时已读完响应，解除中断登记；流式请求由调用方读完后调用 release_sockets
+    """
+    try:
+        response = get_http_session(url).post(url, **kwargs)
+    finally:
+        if not kwargs.get("stream"):
+            release_sockets()
+    _http_last_used[get_origin(url)] = time.monotonic()
+    return response
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """通过共享连接池发送 GET 请求，参数同 requests.get（中断登记的处理同 http_post）"""
+    try:
+        response = get_http_session(url).get(url, **kwargs)
+    finally:
+        if not kwargs.get("stream"):
+            release_sockets()
+    _http_last_used[get_origin(url)] = time.monotonic()
+    return response
+
+
+def ping_host(url: str, timeout: float = 5) -> bool:
+    """
+    向主机发送一个轻量的 HEAD 请求，建立或保持连接（包括 TLS 握手）
+    响应状态码不重要，只要连接成功即可
+    
+    Returns:
+        连接是否成功
+    """
+    origin = get_origin(url)
+    try:
+        get_http_session(url).head(origin + "/", timeout=timeout, allow_redirects=False).close()
+        _http_last_used[origin] = time.monotonic()
+        return True
+    except Exception:
+        return False
+
+
+def warm_up_connections(urls: list):
+    """
+    启动时预热连接，避免第一次轮询和第一次提问承担建连开销
+    同时登记空闲保活间隔（keepalive_interval，0 表示关闭）
+    """
+    interval = CONFIG.get("keepalive_interval") or 0
+    for url in urls:
+        if not url:
+            continue
+        origin = get_origin(url)
+        if interval > 0:
+            with _http_lock:
+                current = _http_keepalive.get(origin)
+                _http_keepalive[origin] = min(current, interval) if current else interval
+        if origin in _http_last_used:
+            continue
+        if ping_host(url):
+            log("INFO", f"连接预热完成: {origin}")
+        else:
+            log("WARNING", f"连接预热失败: {origin}")
+
+
+def send_keepalive_pings():
+    """对空闲超过保活间隔的主机发送 ping，保持连接温热"""
+    now = time.monotonic()
+    for origin, interval in list(_http_keepalive.items()):
+        if now - _http_last_used.get(origin, 0) >= interval:
+            ping_host(origin)
+
+
+async def keepalive_loop():
+    """后台空闲保活任务"""
+    while True:
+        await asyncio.sleep(5)
+        if _http_keepalive:
+            await asyncio.to_thread(send_keepalive_pings)
+
+
+def get_pool_stats() -> dict:
+    """
+    汇总所有连接池的复用情况
+    
+    Returns:
+        {"hits": 复用已有连接的请求数, "misses": 新建连接数}
+    """
+    requests_total = 0
+    connections_total = 0
+    for session in list(_http_sessions.values()):
+        adapter = session.get_adapter("http://")
+        for key in list(adapter.poolmanager.pools.keys()):
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            requests_total += pool.num_requests
+            connections_total += pool.num_connections
+    return {
+        "hits": max(requests_total - connections_total, 0),
+        "misses": connections_total
+    }
+
+
+# ==================== 重试策略 ====================
+# 所有对外请求共用一套重试策略：
+#   - 指数退避 + 全抖动：第 n 次重试前等待 random(0, min(retry_max_delay, retry_base_delay * 2^n)) 秒，
+#     避免服务重启后所有实例同时重试
+#   - 重试预算：每个接口每发出一个请求积累 retry_budget_ratio 个重试令牌，重试消耗一个，
+#     接口整体故障时重试量被限制在正常请求量的一定比例内
+#   - 熔断器：连续失败 breaker_failure_threshold 次后打开，期间请求直接失败；
+#     breaker_reset_timeout 秒后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开
+# 熔断器和重试预算按接口地址在进程内共享（多作品模式下所有作品共用）
+
+# 可重试的 HTTP 状态码（限流和服务端临时故障）
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 每个接口最多积累的重试令牌数
+RETRY_BUDGET_MAX = 10
+
+BREAKER_STATE_NAMES = {
+    "closed": "正常",
+    "open": "熔断中",
+    "half_open": "半开探测"
+}
+
+_breakers = {}
+_breaker_lock = threading.Lock()
+
+
+def get_breaker(url: str) -> dict:
+    """获取接口的熔断器（不存在时创建）"""
+    key = url.split("?")[0]
+    with _breaker_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = {
+                "url": key,
+                "state": "closed",
+                "failures": 0,
+                "opened_at": 0.0,
+                "probing": False,
+                "opens": 0,
+                "tokens": float(RETRY_BUDGET_MAX)
+            }
+        return breaker
+
+
+def breaker_allow(breaker: dict) -> bool:
+    """
+    判断熔断器是否放行本次请求
+    打开状态超过 breaker_reset_timeout 后转为半开，只放行一个探测请求
+    """
+    with _breaker_lock:
+        if breaker["state"] == "closed":
+            return True
+        if breaker["state"] == "open":
+            if time.monotonic() - breaker["opened_at"] < (CONFIG.get("breaker_reset_timeout") or 30):
+                return False
+            breaker["state"] = "half_open"
+            breaker["probing"] = False
+        if breaker["probing"]:
+            return False
+        breaker["probing"] = True
+        return True
+
+
+def breaker_record(breaker: dict, success: bool):
+    """记录请求结果，更新熔断器状态"""
+    with _breaker_lock:
+        previous = breaker["state"]
+        breaker["probing"] = False
+        if success:
+            breaker["state"] = "closed"
+            breaker["failures"] = 0
+        else:
+            breaker["failures"] += 1
+            if previous == "half_open" or breaker["failures"] >= (CONFIG.get("breaker_failure_threshold") or 5):
+                if previous != "open":
+                    breaker["opens"] += 1
+                breaker["state"] = "open"
+                breaker["opened_at"] = time.monotonic()
+        state = breaker["state"]
+    
+    if state != previous:
+        if state == "open":
+            log("WARNING", f"熔断器打开: {breaker['url']} 连续失败 {breaker['failures']} 次，"
+                           f"{CONFIG.get('breaker_reset_timeout') or 30}秒内请求直接失败")
+        elif state == "closed":
+            log("SUCCESS", f"熔断器恢复: {breaker['url']}")
+
+
+def take_retry_token(breaker: dict) -> bool:
+    """从接口的重试预算中取出一个令牌"""
+    with _breaker_lock:
+        if breaker["tokens"] < 1:
+            return False
+        breaker["tokens"] -= 1
+        return True
+
+
+def deposit_retry_budget(breaker: dict):
+    """每发出一个新请求，为接口积累重试预算"""
+    with _breaker_lock:
+        breaker["tokens"] = min(RETRY_BUDGET_MAX, breaker["tokens"] + (CONFIG.get("retry_budget_ratio") or 0))
+
+
+def get_retry_delay(attempt: int) -> float:
+    """第 attempt 次重试前的等待时间：上限递增的全抖动指数退避"""
+    base = CONFIG.get("retry_base_delay") or 0.5
+    cap = CONFIG.get("retry_max_delay") or 8
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def get_breaker_states() -> dict:
+    """
+    当前作品用到的接口的熔断器状态
+    
+    Returns:
+        {接口地址: {"state", "failures", "opens", "retry_tokens"}}
+    """
+    origins = {get_origin(CONFIG["api_base_url"])} if CONFIG.get("api_base_url") else set()
+    origins.update(get_origin(provider["url"]) for provider in get_ai_providers() if provider["url"])
+    with _breaker_lock:
+        return {
+            url: {
+                "state": breaker["state"],
+                "failures": breaker["failures"],
+                "opens": breaker["opens"],
+                "retry_tokens": round(breaker["tokens"], 2)
+            }
+            for url, breaker in _breakers.items()
+            if get_origin(url) in origins
+        }
+
+
+def get_error_message(response: requests.Response) -> str:
+    """从错误响应中提取错误信息"""
+    try:
         data = response.json()
+    except ValueError:
+        return f"HTTP错误: {response.status_code}"
+    error = data.get("error") if isinstance(data, dict) else None
+    if isinstance(error, dict) and error.get("message"):
+        return error["message"]
+    if isinstance(data, dict) and data.get("message"):
+        return data["message"]
+    return f"HTTP错误: {response.status_code}"
+
+
+def call_with_retry(url: str, send, service: str, max_retries: int = None, limiter: str = None) -> dict:
+    """
+    按统一的重试策略发出请求
+    
+    Args:
+        url: 接口地址（熔断器和重试预算按地址区分）
+        send: 发出一次请求的函数，返回 requests.Response 时检查状态码，
+              返回其他值时视为成功；抛出 requests 的超时或连接异常时重试
+        service: 错误信息中显示的服务名
+        max_retries: 最多尝试次数，默认 CONFIG["max_retries"]
+        limiter: 每次发出请求前需要等待的限流级别（如 "kitten"），None 表示不限流
+        
+    Returns:
+        成功: {"success": True, "response": send 的返回值}
+        失败: {"success": False, "error": 错误码, "message": 错误信息}
+    """
+    breaker = get_breaker(url)
+    attempts = max(int(max_retries or CONFIG.get("max_retries") or 1), 1)
+    failure = None
+    deposit_retry_budget(breaker)
+    
+    for attempt in range(attempts):
+        if attempt > 0:
+            if request_aborted():
+                return {"success": False, "error": "CANCELLED", "message": f"{service}请求已中断"}
+            if not take_retry_token(breaker):
+                failure["message"] += "（重试预算已用完）"
+                return failure
+            delay = get_retry_delay(attempt)
+            log("DEBUG", f"{failure['message']}，{delay:.1f}秒后重试 ({attempt}/{attempts - 1})")
+            stats["retries"] += 1
+            time.sleep(delay)
+        
+        if limiter is not None:
+            wait_rate_limit(limiter, get_origin(url))
+        
+        if not breaker_allow(breaker):
+            stats["circuit_rejections"] += 1
+            return {"success": False, "error": "CIRCUIT_OPEN", "message": f"{service}熔断中，暂停请求"}
+        
+        try:
+            result = send()
+        except Exception as e:
+            if isinstance(e, HedgeCancelled) or request_aborted():
+                # 请求被主动中断（如对冲请求落败），与服务端无关，不计入熔断
+                with _breaker_lock:
+                    breaker["probing"] = False
+                return {"success": False, "error": "CANCELLED", "message": f"{service}请求已中断"}
+            if isinstance(e, requests.exceptions.Timeout):
+                failure = {"success": False, "error": "TIMEOUT", "message": f"{service}请求超时"}
+            elif isinstance(e, requests.exceptions.ConnectionError):
+                failure = {"success": False, "error": "CONNECTION_ERROR", "message": f"无法连接到{service}"}
+            else:
+                # 非网络错误不计入熔断，只释放半开状态下的探测名额
+                with _breaker_lock:
+                    breaker["probing"] = False
+                return {"success": False, "error": "EXCEPTION", "message": str(e)}
+        else:
+            if isinstance(result, requests.Response) and result.status_code in RETRYABLE_STATUS:
+                failure = {
+                    "success": False,
+                    "error": f"HTTP_{result.status_code}",
+                    "message": get_error_message(result)
+                }
+                result.close()
+            else:
+                breaker_record(breaker, True)
+                return {"success": True, "response": result}
+        
+        breaker_record(breaker, False)
+        if breaker["state"] == "open":
+            # 本次失败触发了熔断，不再重试
+            return failure
+    
+    return failure
+
+
+# ==================== 限流 ====================
+# 令牌桶限流，分三个级别：
+#   - work: 每个作品每分钟请求AI的问题数（work_rate_limit），防止个别玩家刷屏耗尽AI额度
+#   - ai_key: 每个 AI Key 每分钟的请求数（ai_key_rate_limit），同一进程内使用相同 Key 的作品共享
+#   - kitten: 每秒发往 Kitten API 服务的请求数（kitten_rate_limit），同一进程内所有作品共享
+# 令牌不足时请求排队等待；问题级别的等待超过 rate_limit_wait 秒且配置了 busy_message 时改为答复繁忙提示
+# 共享的令牌桶以第一个创建它的作品的配置为准
+
+_rate_buckets = {}
+_rate_lock = threading.Lock()
+
+
+def get_rate_bucket(level: str, key: str):
+    """
+    获取令牌桶（不存在时按当前作品的配置创建）
+    
+    Returns:
+        令牌桶字典，该级别未开启限流时返回 None
+    """
+    limit = CONFIG.get(f"{level}_rate_limit") or 0
+    if limit <= 0:
+        return None
+    # kitten 级别按秒计，其余按分钟计
+    rate = limit if level == "kitten" else limit / 60
+    burst = max(CONFIG.get(f"{level}_rate_burst") or 1, 1)
+    
+    with _rate_lock:
+        bucket = _rate_buckets.get((level, key))
+        if bucket is None:
+            bucket = _rate_buckets[(level, key)] = {
+                "rate": rate,
+                "burst": burst,
+                "tokens": float(burst),
+                "updated": time.monotonic()
+            }
+        return bucket
+
+
+def reserve_token(bucket: dict, max_wait: float = None):
+    """
+    从令牌桶预订一个令牌，令牌不足时预订未来的令牌（先到先得）
+    
+    Args:
+        bucket: 令牌桶
+        max_wait: 最长等待时间（秒），None 表示不限
+        
+    Returns:
+        需要等待的秒数，超过 max_wait 时不预订并返回 None
+    """
+    with _rate_lock:
+        now = time.monotonic()
+        bucket["tokens"] = min(bucket["burst"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        wait = max(0.0, (1 - bucket["tokens"]) / bucket["rate"])
+        if max_wait is not None and wait > max_wait:
+            return None
+        bucket["tokens"] -= 1
+        return wait
+
+
+def wait_rate_limit(level: str, key: str, max_wait: float = None) -> bool:
+    """
+    等待限流令牌，并把等待次数和时间计入当前作品的统计
+    
+    Args:
+        level: 限流级别 (work/ai_key/kitten)
+        key: 令牌桶的键（作品ID、Key 摘要或服务地址）
+        max_wait: 最长等待时间（秒），None 表示一直等待
+        
+    Returns:
+        是否取得令牌（未开启限流时总是 True）
+    """
+    bucket = get_rate_bucket(level, key)
+    if bucket is None:
+        return True
+    
+    wait = reserve_token(bucket, max_wait)
+    if wait is None:
+        return False
+    if wait > 0:
+        stats["rate_limit"][level]["waits"] += 1
+        stats["rate_limit"][level]["wait_time"] += wait
+        if level != "kitten":
+            log("DEBUG", f"{RATE_LIMIT_LEVELS[level]}限流，等待 {wait:.1f}秒")
+        time.sleep(wait)
+    return True
+
+
+def get_rate_limit_wait():
+    """问题级别限流的最长等待时间：配置了繁忙提示时为 rate_limit_wait，否则一直排队"""
+    if CONFIG.get("busy_message"):
+        return CONFIG.get("rate_limit_wait") or 0
+    return None
+
+
+def normalize_api_url(url: str) -> str:
+    """
+    规范化 API URL，确保以 /api 结尾
+    
+    Args:
+        url: 原始 URL
+        
+    Returns:
+        规范化后的 URL
+    """
+    url = url.rstrip('/')
+    if not url.endswith('/api'):
+        url = url + '/api'
+    return url
+
+
+def connect_to_work(api_base_url: str, work_id: int) -> dict:
+    """
+    连接到编程猫作品
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        
+    Returns:
+        连接信息字典
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/connection/connect"
+    payload = {"workId": work_id}
+    
+    # 连接失败由调用方的重连逻辑处理，这里只经过熔断器，不重试
+    result = call_with_retry(url, lambda: http_post(url, json=payload, timeout=CONFIG["request_timeout"]), "API服务", max_retries=1, limiter="kitten")
+    if not result["success"]:
+        return result
+    
+    try:
+        data = result["response"].json()
         
         if data.get("success"):
             return {
@@ -414,248 +1838,2859 @@ def connect_to_work(api_base_url: str, work_id: int) -> dict:
                 "error": data.get("error", "UNKNOWN_ERROR"),
                 "message": data.get("message", "连接失败")
             }
+    except Exception as e:
+        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+
+
+def get_online_users(api_base_url: str, work_id: int) -> dict:
+    """
+    获取作品在线人数（不重试，失败时由调用方按未知处理）
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        
+    Returns:
+        包含在线人数的字典
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/online/{work_id}"
+    
+    result = call_with_retry(url, lambda: http_get(url, timeout=CONFIG["request_timeout"]), "API服务", max_retries=1, limiter="kitten")
+    if not result["success"]:
+        return result
+    
+    try:
+        data = result["response"].json()
+        
+        if data.get("success"):
+            return {
+                "success": True,
+                "online_users": data.get("data", {}).get("onlineUsers")
+            }
+        return {
+            "success": False,
+            "error": data.get("error", "UNKNOWN_ERROR"),
+            "message": data.get("message", "获取在线人数失败")
+        }
+    except Exception as e:
+        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+
+
+def get_watch_url(api_base_url: str, work_id: int, var_name: str) -> str:
+    """获取云变量变化订阅（SSE）地址"""
+    api_base_url = normalize_api_url(api_base_url)
+    return f"{api_base_url}/var/watch/{work_id}/{quote(str(var_name), safe='')}"
+
+
+def iter_sse_events(response):
+    """
+    解析 SSE 流
+    
+    Yields:
+        (事件名, 数据字符串)
+    """
+    event = "message"
+    data_lines = []
+    # iter_lines 会攒满 512 字节才返回，推送的单条事件可能被一直压着，这里逐行读取
+    while True:
+        raw_line = response.raw.readline()
+        if not raw_line:
+            break
+        line = raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+        if line == "":
+            if data_lines:
+                yield event, "\n".join(data_lines)
+            event = "message"
+            data_lines = []
+        elif line.startswith(":"):
+            continue
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+
+
+def watch_variable(work_id: int, watch_state: dict, on_value, var_name: str = None) -> str:
+    """
+    订阅云变量变化（阻塞，在线程中运行直到连接断开）
+    
+    Args:
+        work_id: 作品ID
+        watch_state: 订阅状态，connected 表示连接正常，response 为当前连接，abort 为连接的中断句柄
+        on_value: 收到值时的回调 on_value(value, var_type)
+        var_name: 变量名，默认 CONFIG["variable_name"]
+        
+    Returns:
+        断开原因
+    """
+    var_name = var_name or CONFIG["variable_name"]
+    url = get_watch_url(CONFIG["api_base_url"], work_id, var_name)
+    session = requests.Session()
+    adapter = AbortableHTTPAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    watch_state["abort"] = create_abort_handle()
+    token = _abort_handle.set(watch_state["abort"])
+    try:
+        # 服务端每 15 秒发送心跳，读超时用于发现已失效的连接
+        response = session.get(url, stream=True, timeout=(10, 45), headers={"Accept": "text/event-stream"})
+        if response.status_code != 200:
+            response.close()
+            return f"HTTP错误: {response.status_code}"
+        
+        watch_state["response"] = response
+        if watch_state.get("stopped"):
+            return "已停止"
+        watch_state["connected"] = True
+        log("SUCCESS", f"已订阅云变量 '{var_name}' 的变化推送")
+        
+        for event, data in iter_sse_events(response):
+            if watch_state.get("stopped"):
+                break
+            if event not in ("snapshot", "change"):
+                continue
+            try:
+                payload = json.loads(data)
+            except ValueError:
+                continue
+            on_value(payload.get("value"), payload.get("type", "public"))
+        return "服务端关闭了连接"
     except requests.exceptions.Timeout:
-        return {"success": False, "error": "TIMEOUT", "message": "请求超时"}
+        return "连接超时"
     except requests.exceptions.ConnectionError:
-        return {"success": False, "error": "CONNECTION_ERROR", "message": "无法连接到API服务"}
+        return "无法连接到API服务"
+    except Exception as e:
+        return str(e)
+    finally:
+        _abort_handle.reset(token)
+        watch_state["connected"] = False
+        watch_state["response"] = None
+        watch_state["abort"] = None
+        session.close()
+
+
+def stop_watch(watch_state: dict):
+    """
+    停止推送订阅：通过中断句柄关闭订阅连接的 socket，让阻塞在读取上的线程立即返回
+    （在其他线程中调用 response.close() 会等待读取线程持有的锁）；
+    没能关闭连接时，读取线程在读超时后看到 stopped 退出
+    """
+    watch_state["stopped"] = True
+    handle = watch_state.get("abort")
+    if handle is None:
+        return
+    if not abort_requests(handle) and watch_state.get("response") is not None:
+        log("WARNING", "无法直接关闭订阅连接，将在读超时后停止订阅")
+
+
+def get_variable(api_base_url: str, work_id: int, var_name: str) -> dict:
+    """
+    获取云变量的值（按统一重试策略重试）
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        var_name: 变量名
+        
+    Returns:
+        包含变量值的字典
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/var/get"
+    payload = {"workId": work_id, "name": var_name}
+    
+    result = call_with_retry(url, lambda: http_post(url, json=payload, timeout=CONFIG["request_timeout"]), "API服务", limiter="kitten")
+    if not result["success"]:
+        return result
+    
+    try:
+        data = result["response"].json()
+    except ValueError as e:
+        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    
+    if data.get("success"):
+        var_data = data.get("data", {})
+        return {
+            "success": True,
+            "value": var_data.get("value"),
+            "type": var_data.get("type"),
+            "name": var_data.get("name")
+        }
+    return {
+        "success": False,
+        "error": data.get("error", "UNKNOWN_ERROR"),
+        "message": data.get("message", "获取变量失败")
+    }
+
+
+def get_all_variables(api_base_url: str, work_id: int) -> dict:
+    """
+    一次获取作品的所有云变量（多路复用协议下用一个请求读取全部槽位）
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        
+    Returns:
+        成功时 variables 为 {变量名: {"value": 值, "type": public/private}}
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/var/{work_id}"
+    
+    result = call_with_retry(url, lambda: http_get(url, timeout=CONFIG["request_timeout"]), "API服务", limiter="kitten")
+    if not result["success"]:
+        return result
+    
+    try:
+        data = result["response"].json()
+    except ValueError as e:
+        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    
+    if not data.get("success"):
+        return {
+            "success": False,
+            "error": data.get("error", "UNKNOWN_ERROR"),
+            "message": data.get("message", "获取变量列表失败")
+        }
+    
+    variables = {}
+    for var_type, key in (("private", "privateVariables"), ("public", "publicVariables")):
+        for item in (data.get("data") or {}).get(key) or []:
+            variables[item.get("name")] = {"value": item.get("value"), "type": var_type}
+    return {"success": True, "variables": variables}
+
+
+def set_variable(api_base_url: str, work_id: int, var_name: str, value: str, var_type: str = "public") -> dict:
+    """
+    设置云变量的值（按统一重试策略重试）
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        var_name: 变量名
+        value: 要设置的值
+        var_type: 变量类型 (public/private)
+        
+    Returns:
+        操作结果字典
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/var/set"
+    payload = {
+        "workId": work_id,
+        "name": var_name,
+        "value": value,
+        "type": var_type
+    }
+    
+    result = call_with_retry(url, lambda: http_post(url, json=payload, timeout=CONFIG["request_timeout"]), "API服务", limiter="kitten")
+    if not result["success"]:
+        return result
+    
+    try:
+        data = result["response"].json()
+    except ValueError as e:
+        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    
+    if data.get("success"):
+        return {
+            "success": True,
+            "message": data.get("message", "设置成功")
+        }
+    return {
+        "success": False,
+        "error": data.get("error", "UNKNOWN_ERROR"),
+        "message": data.get("message", "设置变量失败")
+    }
+
+
+def parse_list_response(result: dict, action: str) -> dict:
+    """
+    解析云列表接口的响应
+    
+    Args:
+        result: call_with_retry 的返回值
+        action: 错误信息中显示的操作名
+        
+    Returns:
+        成功时 data 为响应中的 data 字段
+    """
+    if not result["success"]:
+        return result
+    
+    response = result["response"]
+    if response.status_code == 404:
+        response.close()
+        return {"success": False, "error": "NOT_SUPPORTED", "message": f"API服务不支持{action}接口"}
+    
+    try:
+        data = response.json()
+    except ValueError as e:
+        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    
+    if data.get("success"):
+        return {"success": True, "data": data.get("data") or {}}
+    return {
+        "success": False,
+        "error": data.get("error", "UNKNOWN_ERROR"),
+        "message": data.get("message", f"{action}失败")
+    }
+
+
+def get_list(api_base_url: str, work_id: int, name: str) -> dict:
+    """
+    获取云列表的全部项
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        name: 列表名
+        
+    Returns:
+        成功时 items 为列表项
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/list/get"
+    payload = {"workId": work_id, "name": name}
+    
+    result = call_with_retry(url, lambda: http_post(url, json=payload, timeout=CONFIG["request_timeout"]), "API服务", limiter="kitten")
+    result = parse_list_response(result, "获取列表")
+    if not result["success"]:
+        return result
+    return {"success": True, "items": list(result["data"].get("items") or [])}
+
+
+def drain_list(api_base_url: str, work_id: int, name: str, limit: int) -> dict:
+    """
+    从云列表头部取出并移除最多 limit 项（读取和移除在服务端一次完成，期间玩家追加的项不会丢失）
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        name: 列表名
+        limit: 最多取出的项数
+        
+    Returns:
+        成功时 items 为取出的项；服务端没有 drain 接口时 error 为 NOT_SUPPORTED
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/list/drain"
+    payload = {"workId": work_id, "name": name, "limit": limit}
+    
+    # 取出不是幂等操作，请求超时后重试可能再取走一批而丢失第一批，因此不重试
+    result = call_with_retry(url, lambda: http_post(url, json=payload, timeout=CONFIG["request_timeout"]), "API服务", max_retries=1, limiter="kitten")
+    result = parse_list_response(result, "取出列表项")
+    if not result["success"]:
+        return result
+    return {"success": True, "items": list(result["data"].get("items") or [])}
+
+
+def remove_list_item(api_base_url: str, work_id: int, name: str, index: int) -> dict:
+    """
+    移除云列表指定位置的项（不重试，原因同 drain_list）
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        name: 列表名
+        index: 位置（从 0 开始）
+        
+    Returns:
+        成功时 item 为被移除的项
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/list/remove"
+    payload = {"workId": work_id, "name": name, "index": index}
+    
+    result = call_with_retry(url, lambda: http_post(url, json=payload, timeout=CONFIG["request_timeout"]), "API服务", max_retries=1, limiter="kitten")
+    result = parse_list_response(result, "移除列表项")
+    if not result["success"]:
+        return result
+    return {"success": True, "item": result["data"].get("removedItem")}
+
+
+def set_list(api_base_url: str, work_id: int, name: str, items: list) -> dict:
+    """
+    用新数组完全替换云列表（按统一重试策略重试）
+    
+    Args:
+        api_base_url: API基础地址
+        work_id: 作品ID
+        name: 列表名
+        items: 新的列表项
+        
+    Returns:
+        操作结果字典
+    """
+    api_base_url = normalize_api_url(api_base_url)
+    url = f"{api_base_url}/list/setAll"
+    payload = {"workId": work_id, "name": name, "items": items}
+    
+    result = call_with_retry(url, lambda: http_post(url, json=payload, timeout=CONFIG["request_timeout"]), "API服务", limiter="kitten")
+    result = parse_list_response(result, "替换列表")
+    if not result["success"]:
+        return result
+    return {"success": True, "length": result["data"].get("newLength")}
+
+
+# 每条消息的格式开销（角色标记等）估算为固定 token 数
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# 截断答复时，在保留长度的后 40% 内寻找句末标点，在句子结尾处截断
+SENTENCE_ENDINGS = "。！？!?；;\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数：中日韩字符约 1 个 token，其余字符约 4 个字符 1 个 token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if unicodedata.east_asian_width(ch) in ("W", "F"))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_answer(answer: str, max_chars: int) -> tuple:
+    """
+    截断过长的答复，尽量在句子结尾处截断
+    
+    Returns:
+        (截断后的答复, 是否截断)
+    """
+    if not max_chars or len(answer) <= max_chars:
+        return answer, False
+    cut = answer[:max_chars]
+    end = max(cut.rfind(ch) for ch in SENTENCE_ENDINGS)
+    if end >= max_chars * 0.6:
+        return cut[:end + 1].rstrip(), True
+    return cut.rstrip() + "…", True
+
+
+def get_cached_tokens(usage: dict) -> int:
+    """从 usage 中取出命中服务商提示词缓存的 token 数（兼容 OpenAI、DeepSeek 和 Anthropic 的字段名）"""
+    details = usage.get("prompt_tokens_details") or {}
+    return int(details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens")
+               or usage.get("cache_read_input_tokens") or 0)
+
+
+def record_token_usage(result: dict, messages: list) -> dict:
+    """
+    记录一次AI请求的 token 用量，服务商未返回 usage 时按字数估算
+    
+    Args:
+        result: 成功的AI结果，可能带服务商返回的 usage
+        messages: 发送的消息列表
+        
+    Returns:
+        {"prompt": 提示词, "completion": 答复, "cached": 缓存命中, "estimated": 是否为估算值}
+    """
+    usage = result.pop("usage", None) or {}
+    prompt = usage.get("prompt_tokens")
+    completion = usage.get("completion_tokens")
+    tokens = {
+        "prompt": prompt if prompt is not None else sum(
+            estimate_tokens(message["content"]) + MESSAGE_TOKEN_OVERHEAD for message in messages),
+        "completion": completion if completion is not None else estimate_tokens(result.get("answer")),
+        "cached": get_cached_tokens(usage),
+        "estimated": prompt is None or completion is None
+    }
+    for key in ("prompt", "completion", "cached"):
+        stats["tokens"][key] += tokens[key]
+    stats["tokens"]["calls"] += 1
+    log("DEBUG", f"Token{'（估算）' if tokens['estimated'] else ''}: 提示词 {tokens['prompt']} "
+                 f"(缓存命中 {tokens['cached']}) / 答复 {tokens['completion']}")
+    return tokens
+
+
+def read_ai_stream(response: requests.Response, request_start: float, on_partial=None, max_chars: int = 0) -> dict:
+    """
+    读取流式（SSE）AI响应，边接收边拼接答复
+    
+    Args:
+        response: stream=True 的响应
+        request_start: 发出请求的时间，用于计算首字延迟
+        on_partial: 收到新内容时的回调 on_partial(已生成的答复)
+        max_chars: 答复达到该字数时停止接收并关闭连接（服务商随之停止生成），0 表示不限制
+        
+    Returns:
+        包含AI答复和首字延迟 (ttft) 的字典，带服务商在最后一个片段中返回的用量 (usage)，
+        提前停止时 truncated 为 True
+    """
+    parts = []
+    ttft = None
+    usage = None
+    truncated = False
+    model = CONFIG["ai_model"]
+    try:
+        for _, data in iter_sse_events(response):
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            model = chunk.get("model") or model
+            usage = chunk.get("usage") or usage
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            content = (choices[0].get("delta") or {}).get("content")
+            if not content:
+                continue
+            if ttft is None:
+                ttft = time.time() - request_start
+            parts.append(content)
+            if max_chars and sum(len(part) for part in parts) > max_chars:
+                answer, truncated = truncate_answer("".join(parts), max_chars)
+                parts = [answer]
+                if on_partial is not None:
+                    on_partial(answer)
+                break
+            if on_partial is not None:
+                on_partial("".join(parts))
+    except Exception as e:
+        # 被主动中断（对冲请求落败）时交给 call_with_retry 按取消处理
+        if isinstance(e, HedgeCancelled) or request_aborted():
+            raise
+        # 已经收到部分内容时不再重试，避免玩家看到的答复从头开始
+        if parts:
+            return {"success": False, "error": "STREAM_INTERRUPTED", "message": f"AI响应流中断: {e}"}
+        if isinstance(e, ReadTimeoutError):
+            raise requests.exceptions.Timeout(e)
+        raise requests.exceptions.ConnectionError(e)
+    finally:
+        response.close()
+    
+    if not parts:
+        return {"success": False, "error": "EMPTY_RESPONSE", "message": "AI返回空响应"}
+    return {"success": True, "answer": "".join(parts), "model": model, "ttft": ttft, "usage": usage, "truncated": truncated}
+
+
+# ==================== AI 服务商路由 ====================
+# 配置了多个服务商 (ai_providers) 时，按各服务商近期延迟和错误率的指数加权移动平均 (EWMA) 排序，
+# 每个问题先发给得分最好的健康服务商，失败时在同一个问题内依次切换到下一个
+# 得分 = 平均延迟 × (1 + 错误率 × PROVIDER_ERROR_PENALTY) / 权重，越小越好；失败按超时时间计入平均延迟
+# 还没有数据的服务商按全体服务商得分的中位数排序；超过 PROVIDER_PROBE_INTERVAL 秒没有被调用的服务商，
+# 得分逐渐向中位数回归，不再无条件排在最前，避免玩家的问题被发给已经失效的服务商等到超时
+# 路由状态按服务商名称在进程内共享（多作品模式下所有作品共用），调用次数按作品统计
+
+# EWMA 平滑系数：越大越看重最近的结果
+PROVIDER_EWMA_ALPHA = 0.3
+
+# 错误率对得分的放大倍数
+PROVIDER_ERROR_PENALTY = 4
+
+# 服务商多久没有被调用后得分开始向中位数回归（秒），之后每隔同样的时间与中位数的差距减半
+PROVIDER_PROBE_INTERVAL = 60
+
+_provider_health = {}
+_provider_lock = threading.Lock()
+
+
+def get_ai_providers() -> list:
+    """
+    获取当前作品配置的 AI 服务商列表（补全默认值）
+    未配置 ai_providers 时返回由 ai_api_url / ai_api_key / ai_model 组成的单个服务商
+    """
+    configured = CONFIG.get("ai_providers") or [{
+        "name": "default",
+        "url": CONFIG.get("ai_api_url"),
+        "key": CONFIG.get("ai_api_key"),
+        "model": CONFIG.get("ai_model")
+    }]
+    providers = []
+    for index, item in enumerate(configured):
+        providers.append({
+            "name": str(item.get("name") or get_origin(item.get("url") or "") or f"provider{index + 1}"),
+            "url": item.get("url") or "",
+            "key": item.get("key") or "",
+            "model": item.get("model") or CONFIG.get("ai_model"),
+            "weight": max(float(item.get("weight") or 1), 0.01),
+            "timeout": item.get("timeout") or CONFIG["request_timeout"]
+        })
+    return providers
+
+
+def get_provider_health(name: str) -> dict:
+    """获取服务商的路由状态（不存在时创建），调用方需持有 _provider_lock"""
+    health = _provider_health.get(name)
+    if health is None:
+        health = _provider_health[name] = {"latency": None, "error_rate": 0.0, "updated": 0.0}
+    return health
+
+
+def get_provider_stats(name: str) -> dict:
+    """获取当前作品对服务商的调用统计（不存在时创建）"""
+    provider_stats = stats["providers"].get(name)
+    if provider_stats is None:
+        provider_stats = stats["providers"][name] = {
+            "requests": 0,
+            "failures": 0,
+            "latency_total": 0.0,
+            "latency_count": 0
+        }
+    return provider_stats
+
+
+def rank_providers(providers: list) -> list:
+    """
+    按路由得分排序服务商，熔断中的服务商排在最后
+    
+    Returns:
+        排序后的服务商列表
+    """
+    now = time.monotonic()
+    reset_timeout = CONFIG.get("breaker_reset_timeout") or 30
+    
+    with _provider_lock:
+        healths = {provider["name"]: dict(get_provider_health(provider["name"])) for provider in providers}
+    scores = {}
+    for provider in providers:
+        health = healths[provider["name"]]
+        if health["latency"] is not None:
+            scores[provider["name"]] = (health["latency"] * (1 + health["error_rate"] * PROVIDER_ERROR_PENALTY)
+                                        / provider["weight"])
+    fresh = [score for name, score in scores.items() if now - healths[name]["updated"] <= PROVIDER_PROBE_INTERVAL]
+    neutral = statistics.median(fresh or list(scores.values()) or [0.0])
+    
+    def sort_key(item):
+        index, provider = item
+        breaker = get_breaker(provider["url"])
+        unavailable = breaker["state"] == "open" and now - breaker["opened_at"] < reset_timeout
+        score = scores.get(provider["name"])
+        idle = now - healths[provider["name"]]["updated"]
+        if score is None:
+            score = neutral
+        elif idle > PROVIDER_PROBE_INTERVAL:
+            score = neutral + (score - neutral) * 0.5 ** ((idle - PROVIDER_PROBE_INTERVAL) / PROVIDER_PROBE_INTERVAL)
+        return unavailable, score, index
+    
+    return [provider for _, provider in sorted(enumerate(providers), key=sort_key)]
+
+
+def record_provider_result(provider: dict, success: bool, seconds: float):
+    """记录一次服务商调用结果，更新 EWMA 和当前作品的调用统计"""
+    # 失败的调用对玩家来说和超时一样糟糕，按超时时间计入平均延迟
+    latency = seconds if success else max(seconds, provider["timeout"])
+    with _provider_lock:
+        health = get_provider_health(provider["name"])
+        health["error_rate"] += PROVIDER_EWMA_ALPHA * ((0.0 if success else 1.0) - health["error_rate"])
+        if health["latency"] is None:
+            health["latency"] = latency
+        else:
+            health["latency"] += PROVIDER_EWMA_ALPHA * (latency - health["latency"])
+        health["updated"] = time.monotonic()
+    
+    provider_stats = get_provider_stats(provider["name"])
+    provider_stats["requests"] += 1
+    if success:
+        provider_stats["latency_total"] += seconds
+        provider_stats["latency_count"] += 1
+    else:
+        provider_stats["failures"] += 1
+
+
+def get_provider_summary() -> dict:
+    """
+    当前作品各服务商的调用统计
+    
+    Returns:
+        {服务商名称: {"requests", "failures", "avg_latency_ms", "ewma_latency_ms", "error_rate"}}
+    """
+    summary = {}
+    for name, provider_stats in list(stats["providers"].items()):
+        with _provider_lock:
+            health = get_provider_health(name)
+            ewma_latency = health["latency"]
+            error_rate = health["error_rate"]
+        summary[name] = {
+            "requests": provider_stats["requests"],
+            "failures": provider_stats["failures"],
+            "avg_latency_ms": round(provider_stats["latency_total"] / provider_stats["latency_count"] * 1000, 1)
+            if provider_stats["latency_count"] else 0,
+            "ewma_latency_ms": round(ewma_latency * 1000, 1) if ewma_latency is not None else None,
+            "error_rate": round(error_rate, 3)
+        }
+    return summary
+
+
+def call_provider(provider: dict, question: str, on_partial=None, max_retries: int = None,
+                  max_wait: float = None, batch_size: int = 1) -> dict:
+    """
+    向单个 AI 服务商请求答复
+    
+    Args:
+        provider: 服务商配置
+        question: 用户问题
+        on_partial: 流式模式下收到新内容时的回调 on_partial(已生成的答复)
+        max_retries: 最多尝试次数，默认 CONFIG["max_retries"]
+        max_wait: AI Key 限流的最长等待时间（秒），None 表示一直等待
+        batch_size: 批量请求包含的问题数，max_tokens 按问题数放大，且不按 answer_max_chars 截断
+        
+    Returns:
+        包含AI答复和 token 用量 (tokens) 的字典（流式模式下带首字延迟 ttft），
+        答复过长被截断时 truncated 为 True
+    """
+    key_digest = hashlib.sha1(provider["key"].encode("utf-8")).hexdigest()[:12]
+    if not wait_rate_limit("ai_key", key_digest, max_wait):
+        return {"success": False, "error": "RATE_LIMITED", "message": f"AI Key 请求过于频繁 ({provider['name']})"}
+    
+    headers = {
+        "Authorization": f"Bearer {provider['key']}",
+        "Content-Type": "application/json"
+    }
+    
+    # 不变的系统提示词原样放在最前面，每次变化的内容只出现在最后的用户消息中，
+    # 请求前缀逐字节相同，服务商的提示词缓存（前缀缓存）才能命中
+    messages = [
+        {"role": "system", "content": load_system_prompt()},
+        {"role": "user", "content": question}
+    ]
+    payload = {
+        "model": provider["model"],
+        "messages": messages,
+        "temperature": CONFIG["ai_temperature"],
+        "max_tokens": int(CONFIG.get("ai_max_tokens") or 2000) * max(batch_size, 1)
+    }
+    max_chars = int(CONFIG.get("answer_max_chars") or 0) if batch_size <= 1 else 0
+    
+    stream = bool(CONFIG.get("stream_mode"))
+    if stream:
+        payload["stream"] = True
+        # 让服务商在最后一个片段中返回 token 用量
+        payload["stream_options"] = {"include_usage": True}
+    
+    url = provider["url"]
+    service = "AI API" if not CONFIG.get("ai_providers") else f"AI服务商[{provider['name']}]"
+    
+    def send():
+        request_start = time.time()
+        response = http_post(url, headers=headers, json=payload, timeout=provider["timeout"], stream=stream)
+        # 流式响应在这里读完，首字之前的中断仍按超时/连接错误重试
+        try:
+            if stream and response.status_code == 200:
+                return read_ai_stream(response, request_start, on_partial, max_chars)
+            return response
+        finally:
+            if stream:
+                release_sockets()
+    
+    result = call_with_retry(url, send, service, max_retries)
+    if not result["success"]:
+        return result
+    
+    response = result["response"]
+    if not isinstance(response, requests.Response):
+        if response["success"]:
+            response["tokens"] = record_token_usage(response, messages)
+            if response["truncated"]:
+                stats["truncated_answers"] += 1
+                log("DEBUG", f"答复超过 {max_chars} 字，已停止接收")
+        return response
+    
+    if response.status_code != 200:
+        return {
+            "success": False,
+            "error": f"HTTP_{response.status_code}",
+            "message": get_error_message(response)
+        }
+    
+    try:
+        data = response.json()
+    except ValueError as e:
+        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    choices = data.get("choices", [])
+    if choices:
+        answer = choices[0].get("message", {}).get("content", "")
+        answer, truncated = truncate_answer(answer, max_chars)
+        # finish_reason 为 length 表示达到 max_tokens 被服务商截断
+        if truncated or choices[0].get("finish_reason") == "length":
+            truncated = True
+            stats["truncated_answers"] += 1
+        result = {
+            "success": True,
+            "answer": answer,
+            "model": data.get("model", provider["model"]),
+            "usage": data.get("usage"),
+            "truncated": truncated
+        }
+        result["tokens"] = record_token_usage(result, messages)
+        return result
+    return {"success": False, "error": "EMPTY_RESPONSE", "message": "AI返回空响应"}
+
+
+def call_providers(providers: list, question: str, on_partial=None, cancelled: threading.Event = None,
+                   batch_size: int = 1) -> dict:
+    """
+    按顺序调用服务商，失败时切换到下一个
+    
+    Args:
+        providers: 排好序的服务商列表
+        question: 用户问题
+        on_partial: 流式模式下收到新内容时的回调 on_partial(已生成的答复)
+        cancelled: 对冲请求中已经落败时被设置，之后不再切换服务商
+        batch_size: 批量请求包含的问题数
+        
+    Returns:
+        包含AI答复和所用服务商 (provider) 的字典（流式模式下带首字延迟 ttft）
+    """
+    result = None
+    
+    for index, provider in enumerate(providers):
+        # 后面还有服务商可以切换时不在同一个服务商上重试
+        has_fallback = index < len(providers) - 1
+        start = time.monotonic()
+        # 还有其他服务商时不等待限流，直接切换
+        result = call_provider(provider, question, on_partial, max_retries=1 if has_fallback else None,
+                               max_wait=0 if has_fallback else get_rate_limit_wait(), batch_size=batch_size)
+        result["provider"] = provider["name"]
+        if result.get("error") == "CANCELLED":
+            # 对冲请求落败被中断只说明比另一方慢，按已耗费的时间计入延迟，不计为错误
+            record_provider_result(provider, True, time.monotonic() - start)
+        elif result.get("error") not in ("CIRCUIT_OPEN", "RATE_LIMITED"):
+            # 落败前已经真实失败（如 500、超时）的请求照常计为错误
+            record_provider_result(provider, result["success"], time.monotonic() - start)
+        if cancelled is not None and cancelled.is_set():
+            return {"success": False, "error": "CANCELLED", "message": "对冲请求已落败", "provider": provider["name"]}
+        
+        if result["success"]:
+            return result
+        if has_fallback:
+            stats["failovers"] += 1
+            log("WARNING", f"AI服务商 {provider['name']} 调用失败 ({result.get('message')})，"
+                           f"切换到 {providers[index + 1]['name']}")
+    
+    return result
+
+
+# ==================== 对冲请求 ====================
+# 开启 hedge_mode 后，AI 请求超过对冲延迟仍未返回时再发出一个相同的请求
+# （有多个服务商时发给排名第二的服务商），先返回的结果被采用，另一个被取消：
+#   - 流式模式以首字到达为准，落败的流在下一个片段到达时关闭
+#   - 非流式模式以完整答复为准，落败请求的连接被立即关闭（见“可中断的请求”一节）
+# 对冲延迟默认取最近 AI 耗时（流式模式为首字延迟）的 p90，样本不足时使用 HEDGE_FALLBACK_DELAY
+
+# 使用观测 p90 作为对冲延迟所需的最少样本数
+HEDGE_MIN_SAMPLES = 20
+
+# 样本不足时的对冲延迟（秒）
+HEDGE_FALLBACK_DELAY = 5
+
+# 对冲延迟下限（秒），避免延迟很低时几乎每个请求都被对冲
+HEDGE_MIN_DELAY = 0.5
+
+
+class HedgeCancelled(Exception):
+    """对冲请求中落败的一方在流式回调中抛出，用于关闭响应流"""
+
+
+def get_hedge_delay() -> float:
+    """获取对冲延迟（秒）：优先使用 hedge_delay 配置，否则使用观测到的 p90"""
+    if CONFIG.get("hedge_delay"):
+        return CONFIG["hedge_delay"]
+    histogram = stats["latency"]["ttft" if CONFIG.get("stream_mode") else "ai"]
+    if histogram["count"] < HEDGE_MIN_SAMPLES:
+        return HEDGE_FALLBACK_DELAY
+    return max(histogram_percentile(histogram, 90) / 1000, HEDGE_MIN_DELAY)
+
+
+def call_with_hedge(providers: list, question: str, on_partial=None, batch_size: int = 1) -> dict:
+    """
+    发出主请求，超过对冲延迟仍未返回时发出对冲请求，采用先返回的结果
+    
+    Args:
+        providers: 排好序的服务商列表
+        question: 用户问题
+        on_partial: 流式模式下收到新内容时的回调 on_partial(已生成的答复)
+        batch_size: 批量请求包含的问题数
+        
+    Returns:
+        包含AI答复的字典，发出过对冲请求时带 hedge 字段 (won/lost)
+    """
+    results = queue.Queue()
+    lock = threading.Lock()
+    attempts = {}
+    started = {}
+    state = {"leader": None}
+    
+    def cancel_others(winner: str):
+        """让落败的一方停止：不再切换服务商，并关闭其进行中的请求（调用方需持有 lock）"""
+        for other, (other_cancelled, other_handle) in attempts.items():
+            if other != winner:
+                other_cancelled.set()
+                abort_requests(other_handle)
+    
+    def start_attempt(name: str, attempt_providers: list):
+        cancelled = threading.Event()
+        handle = create_abort_handle()
+        attempts[name] = (cancelled, handle)
+        started[name] = time.time()
+        
+        def partial(text: str):
+            # 流式模式下第一个收到内容的请求胜出，另一个的连接被立即关闭
+            with lock:
+                if state["leader"] is None:
+                    state["leader"] = name
+                    cancel_others(name)
+                leading = state["leader"] == name
+            if not leading:
+                raise HedgeCancelled()
+            if on_partial is not None:
+                on_partial(text)
+        
+        def run():
+            _abort_handle.set(handle)
+            try:
+                result = call_providers(attempt_providers, question, partial, cancelled, batch_size)
+            except Exception as e:
+                result = {"success": False, "error": "EXCEPTION", "message": str(e)}
+            finally:
+                release_sockets()
+            results.put((name, result))
+        
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), name=f"ai-bridge-{name}", daemon=True).start()
+    
+    hedge_delay = get_hedge_delay()
+    start_attempt("primary", providers)
+    try:
+        name, result = results.get(timeout=hedge_delay)
+        return result
+    except queue.Empty:
+        pass
+    
+    with lock:
+        leader = state["leader"]
+        if leader is None:
+            # 有多个服务商时对冲请求从排名第二的开始
+            hedge_providers = providers[1:] + providers[:1] if len(providers) > 1 else providers
+            stats["hedges_sent"] += 1
+            log("DEBUG", f"AI请求超过 {hedge_delay:.1f}秒未返回，发出对冲请求 ({hedge_providers[0]['name']})")
+            start_attempt("hedge", hedge_providers)
+    
+    first_failure = None
+    for _ in range(len(attempts)):
+        name, result = results.get()
+        if result["success"]:
+            with lock:
+                # 非流式模式下先完成的请求胜出
+                if state["leader"] is None:
+                    state["leader"] = name
+                cancel_others(name)
+            if "hedge" in attempts:
+                result["hedge"] = "won" if name == "hedge" else "lost"
+                if name == "hedge":
+                    stats["hedges_won"] += 1
+                    # 首字延迟从主请求发出时算起
+                    if result.get("ttft") is not None:
+                        result["ttft"] += started["hedge"] - started["primary"]
+            return result
+        if result.get("error") != "CANCELLED" and first_failure is None:
+            first_failure = result
+    
+    return first_failure or result
+
+
+def call_ai_api(question: str, on_partial=None, batch_size: int = 1) -> dict:
+    """
+    调用AI API获取答复，配置了多个服务商时按路由得分选择，失败时切换到下一个
+    开启 hedge_mode 时超过对冲延迟未返回会再发出一个对冲请求
+    
+    Args:
+        question: 用户问题
+        on_partial: 流式模式下收到新内容时的回调 on_partial(已生成的答复)
+        batch_size: 批量请求包含的问题数
+        
+    Returns:
+        包含AI答复和所用服务商 (provider) 的字典（流式模式下带首字延迟 ttft）
+    """
+    providers = rank_providers(get_ai_providers())
+    if CONFIG.get("hedge_mode"):
+        return call_with_hedge(providers, question, on_partial, batch_size)
+    return call_providers(providers, question, on_partial, batch_size=batch_size)
+
+
+# ==================== 批量请求 ====================
+# 多个问题同时等待AI时，把 ai_batch_window 秒内最多 ai_batch_size 个问题合并为一次请求，
+# 系统提示词只发送一次；要求模型按编号输出 JSON，解析不出的问题回退为单独请求
+# 同一作品的问题才会合并（不同作品的提示词和服务商可能不同）
+BATCH_PROMPT_TEMPLATE = (
+    "下面是 {count} 位玩家分别提出的问题，它们互不相关，请按你的设定逐个独立回答。\n"
+    "只输出一个 JSON 对象，不要输出任何其他内容，格式为："
+    '{{"answers": [{{"id": 问题编号, "answer": "答复"}}]}}\n'
+    "问题：\n{questions}"
+)
+
+_batches = {}
+_batch_lock = threading.Lock()
+
+
+def build_batch_prompt(questions: list) -> str:
+    """生成批量请求的用户消息"""
+    items = [{"id": i, "question": question} for i, question in enumerate(questions, 1)]
+    return BATCH_PROMPT_TEMPLATE.format(count=len(questions), questions=json.dumps(items, ensure_ascii=False))
+
+
+def parse_batch_answers(text: str, count: int) -> list:
+    """
+    解析批量请求的答复
+    
+    Args:
+        text: 模型输出（允许带 Markdown 代码块或前后多余文字）
+        count: 问题数
+        
+    Returns:
+        长度为 count 的答复列表，缺失或无效的位置为 None
+    """
+    answers = [None] * count
+    start, end = (text or "").find("{"), (text or "").rfind("}")
+    if start < 0 or end < start:
+        return answers
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return answers
+    
+    items = data.get("answers") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return answers
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, answer = item.get("id"), item.get("answer")
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        if (isinstance(index, int) and 1 <= index <= count and answers[index - 1] is None
+                and isinstance(answer, str) and answer.strip()):
+            answers[index - 1] = answer.strip()
+    return answers
+
+
+def send_question_batch(questions: list) -> list:
+    """
+    把一批问题合并为一次AI请求
+    
+    Args:
+        questions: 问题列表
+        
+    Returns:
+        与 questions 一一对应的 call_ai_api 结果，合并成功的结果带批大小 batch；
+        批量答复中无法解析的问题为 None，由提问的线程各自单独请求（并行进行）
+    """
+    if len(questions) == 1:
+        return [call_ai_api(questions[0])]
+    
+    count = len(questions)
+    prompt = build_batch_prompt(questions)
+    log("INFO", f"合并 {count} 个问题为一次AI请求")
+    result = call_ai_api(prompt, batch_size=count)
+    stats["ai_batches"] += 1
+    stats["batched_questions"] += count
+    if not result["success"]:
+        # 请求本身失败（已经过重试和切换服务商），单独请求大概率同样失败，直接返回错误
+        return [dict(result) for _ in questions]
+    
+    answers = parse_batch_answers(result["answer"], count)
+    missing = [i for i, answer in enumerate(answers) if answer is None]
+    if missing:
+        log("WARNING", f"批量答复中有 {len(missing)}/{count} 个问题无法解析，改为单独请求")
+        stats["batch_fallbacks"] += len(missing)
+    
+    # 节省的提示词：单独请求时每个问题都要发送一次系统提示词，减去批量格式说明的额外开销；
+    # 大部分问题解析失败时批量请求反而多花了 token，不计为负数
+    overhead = estimate_tokens(prompt) - sum(estimate_tokens(question) for question in questions)
+    saved = (count - 1 - len(missing)) * estimate_tokens(load_system_prompt()) - overhead
+    stats["prompt_tokens_saved"] += max(saved, 0)
+    
+    results = []
+    for answer in answers:
+        if answer is None:
+            results.append(None)
+            continue
+        answer, truncated = truncate_answer(answer, int(CONFIG.get("answer_max_chars") or 0))
+        if truncated:
+            stats["truncated_answers"] += 1
+        results.append({"success": True, "answer": answer, "model": result.get("model"),
+                        "provider": result.get("provider"), "batch": count, "truncated": truncated})
+    return results
+
+
+def call_ai_api_batched(question: str) -> dict:
+    """
+    调用AI API，等待 ai_batch_window 秒内同一作品的其他问题一起合并为一次请求
+    第一个到达的问题负责收集和发出请求，凑满 ai_batch_size 个时立即发出
+    
+    Args:
+        question: 用户问题
+        
+    Returns:
+        该问题对应的 call_ai_api 结果
+    """
+    size = int(CONFIG.get("ai_batch_size") or 0)
+    key = get_work_id()
+    
+    with _batch_lock:
+        batch = _batches.get(key)
+        leader = batch is None
+        if leader:
+            batch = _batches[key] = {"questions": [], "full": threading.Event(), "done": threading.Event(), "results": None}
+        index = len(batch["questions"])
+        batch["questions"].append(question)
+        if len(batch["questions"]) >= size:
+            del _batches[key]
+            batch["full"].set()
+    
+    if not leader:
+        batch["done"].wait()
+        return batch["results"][index] or call_ai_api(question)
+    
+    batch["full"].wait(CONFIG.get("ai_batch_window") or 0)
+    with _batch_lock:
+        if _batches.get(key) is batch:
+            del _batches[key]
+    
+    results = None
+    try:
+        results = send_question_batch(batch["questions"])
+    finally:
+        if results is None:
+            results = [{"success": False, "error": "EXCEPTION", "message": "批量AI请求未完成"} for _ in batch["questions"]]
+        batch["results"] = results
+        batch["done"].set()
+    return results[0] or call_ai_api(question)
+
+
+# ==================== 答复缓存 ====================
+# 每个作品一个 SQLite 文件，存放在日志目录下，进程重启后仍然有效
+_cache_connections = {}
+_cache_lock = threading.Lock()
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题文本：全角转半角、小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!.~。？！～ ")
+
+
+def get_generation_signature() -> str:
+    """当前作品实际生成答复所用的模型和生成参数，模型或参数不同的答复不能互相复用"""
+    models = ",".join(sorted({str(provider["model"]) for provider in get_ai_providers()}))
+    return (f"{models}\n{CONFIG.get('ai_temperature')}\n{CONFIG.get('ai_max_tokens')}\n"
+            f"{CONFIG.get('answer_max_chars')}")
+
+
+def get_answer_cache_key(question: str) -> str:
+    """缓存键：规范化问题 + 各服务商的模型和生成参数 + 提示词哈希"""
+    prompt_hash = hashlib.sha1(load_system_prompt().encode("utf-8")).hexdigest()
+    raw = f"{normalize_question(question)}\n{get_generation_signature()}\n{prompt_hash}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_cache_connection() -> sqlite3.Connection:
+    """获取当前作品的缓存数据库连接"""
+    ensure_log_dir()
+    work_id = get_work_id()
+    name = f"answer_cache_{work_id}.db" if work_id else "answer_cache.db"
+    path = os.path.join(CONFIG["log_dir"], name)
+    
+    conn = _cache_connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                question TEXT,
+                answer TEXT,
+                created REAL,
+                last_used REAL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used)")
+        conn.commit()
+        _cache_connections[path] = conn
+    return conn
+
+
+def get_cached_answer(question: str):
+    """
+    查询答复缓存（过期条目会被删除）
+    
+    Returns:
+        命中时返回答复内容，否则返回 None
+    """
+    key = get_answer_cache_key(question)
+    now = time.time()
+    ttl = CONFIG.get("answer_cache_ttl") or 86400
+    
+    try:
+        with _cache_lock:
+            conn = get_cache_connection()
+            row = conn.execute("SELECT answer, created FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > ttl:
+                conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE answers SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            conn.commit()
+            return row[0]
+    except sqlite3.Error as e:
+        log("WARNING", f"读取答复缓存失败: {e}")
+        return None
+
+
+def put_cached_answer(question: str, answer: str):
+    """写入答复缓存，超过容量时淘汰最久未使用的条目"""
+    key = get_answer_cache_key(question)
+    now = time.time()
+    max_size = CONFIG.get("answer_cache_size") or 1000
+    
+    try:
+        with _cache_lock:
+            conn = get_cache_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, question, answer, created, last_used, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (key, question, answer, now, now)
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (max_size,)
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        log("WARNING", f"写入答复缓存失败: {e}")
+
+
+# ==================== FAQ 检索 ====================
+# 每个作品可选一个 FAQ 文件，启动时建立字符 n-gram TF-IDF 索引，问题与 FAQ 中某个问法的
+# 余弦相似度达到 faq_threshold 时直接用对应答复，不调用AI；文件变化后自动重建索引
+#
+# 文件格式：以 "Q:"/"问:" 开头的行是问法（同一答复可以有多个问法），以 "A:"/"答:" 开头的行是答复，
+# 答复可以跨多行，空行或下一个问法结束一条问答
+FAQ_QUESTION_PREFIXES = ("q:", "q：", "问:", "问：")
+FAQ_ANSWER_PREFIXES = ("a:", "a：", "答:", "答：")
+
+# 参与索引的字符 n-gram 长度
+FAQ_NGRAM_SIZES = (1, 2)
+
+_faq_cache = {}
+_faq_lock = threading.Lock()
+
+
+def get_faq_candidates() -> list:
+    """获取 FAQ 文件的候选路径（按优先级）"""
+    candidates = []
+    if CONFIG.get("faq_file"):
+        candidates.append(CONFIG["faq_file"])
+    
+    work_id = get_work_id()
+    if work_id:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        candidates.append(os.path.join(script_dir, "ai-bridge", f"faq_{work_id}.txt"))
+    
+    return candidates
+
+
+def parse_faq(content: str) -> list:
+    """
+    解析 FAQ 文件内容
+    
+    Returns:
+        [(问法列表, 答复)]，没有答复的问法会被忽略
+    """
+    entries = []
+    questions, answer_lines = [], None
+    
+    def finish():
+        if questions and answer_lines and "\n".join(answer_lines).strip():
+            entries.append((list(questions), "\n".join(answer_lines).strip()))
+    
+    for line in content.splitlines():
+        stripped = line.strip()
+        lower = stripped.lower()
+        if lower.startswith(FAQ_QUESTION_PREFIXES):
+            if answer_lines is not None:
+                finish()
+                questions, answer_lines = [], None
+            questions.append(stripped[2:].strip())
+        elif lower.startswith(FAQ_ANSWER_PREFIXES):
+            answer_lines = [stripped[2:].strip()]
+        elif not stripped:
+            finish()
+            questions, answer_lines = [], None
+        elif answer_lines is not None:
+            answer_lines.append(stripped)
+    finish()
+    return entries
+
+
+def get_faq_ngrams(text: str) -> dict:
+    """把问题规范化后切分为字符 n-gram 并计数（忽略空白和标点）"""
+    chars = "".join(ch for ch in normalize_question(text) if ch.isalnum())
+    grams = {}
+    for size in FAQ_NGRAM_SIZES:
+        for i in range(len(chars) - size + 1):
+            gram = chars[i:i + size]
+            grams[gram] = grams.get(gram, 0) + 1
+    return grams
+
+
+def build_faq_index(entries: list, previous: dict = None) -> dict:
+    """
+    建立 FAQ 索引
+    
+    Args:
+        entries: parse_faq 的结果
+        previous: 上一版索引，未变化的问法直接复用其 n-gram，只切分新增或修改的问法
+        
+    Returns:
+        {"answers": 答复列表, "doc_entries": 每个问法对应的答复序号, "postings": {n-gram: (问法序号, 权重)},
+         "idf": {n-gram: idf}, "unknown_idf": 未出现的 n-gram 的 idf, "grams": {问法: n-gram 计数}}
+    """
+    cached_grams = previous["grams"] if previous else {}
+    grams_by_question = {}
+    docs = []
+    for entry_index, (questions, _) in enumerate(entries):
+        for question in questions:
+            grams = cached_grams.get(question)
+            if grams is None:
+                grams = get_faq_ngrams(question)
+            grams_by_question[question] = grams
+            if grams:
+                docs.append((entry_index, grams))
+    
+    doc_count = len(docs)
+    df = {}
+    for _, grams in docs:
+        for gram in grams:
+            df[gram] = df.get(gram, 0) + 1
+    idf = {gram: math.log((1 + doc_count) / (1 + count)) + 1 for gram, count in df.items()}
+    
+    postings = {}
+    for doc_index, (_, grams) in enumerate(docs):
+        weights = {gram: (1 + math.log(tf)) * idf[gram] for gram, tf in grams.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        for gram, weight in weights.items():
+            postings.setdefault(gram, ([], []))
+            postings[gram][0].append(doc_index)
+            postings[gram][1].append(weight / norm)
+    if np is not None:
+        postings = {gram: (np.array(ids, dtype=np.int32), np.array(ws, dtype=np.float32))
+                    for gram, (ids, ws) in postings.items()}
+    
+    return {
+        "answers": [answer for _, answer in entries],
+        "doc_entries": [entry_index for entry_index, _ in docs],
+        "postings": postings,
+        "idf": idf,
+        "unknown_idf": math.log(1 + doc_count) + 1,
+        "grams": grams_by_question
+    }
+
+
+def match_faq(index: dict, question: str) -> tuple:
+    """
+    在 FAQ 索引中查找与问题最相似的问法
+    
+    Returns:
+        (答复, 相似度)，相似度未达到 faq_threshold 时答复为 None
+    """
+    grams = get_faq_ngrams(question)
+    doc_count = len(index["doc_entries"])
+    if not grams or not doc_count:
+        return None, 0.0
+    
+    # 索引中没有的 n-gram 也计入问题向量的长度，问题里多出的内容会拉低相似度
+    weights = {gram: (1 + math.log(tf)) * index["idf"].get(gram, index["unknown_idf"]) for gram, tf in grams.items()}
+    norm = math.sqrt(sum(w * w for w in weights.values()))
+    
+    if np is not None:
+        scores = np.zeros(doc_count, dtype=np.float32)
+        for gram, weight in weights.items():
+            posting = index["postings"].get(gram)
+            if posting is not None:
+                scores[posting[0]] += weight * posting[1]
+        best = int(scores.argmax())
+        score = float(scores[best]) / norm
+    else:
+        scores = {}
+        for gram, weight in weights.items():
+            posting = index["postings"].get(gram)
+            if posting is not None:
+                for doc_index, doc_weight in zip(*posting):
+                    scores[doc_index] = scores.get(doc_index, 0.0) + weight * doc_weight
+        if not scores:
+            return None, 0.0
+        best = max(scores, key=scores.get)
+        score = scores[best] / norm
+    
+    score = min(score, 1.0)
+    if score < float(CONFIG.get("faq_threshold") or 0.75):
+        return None, score
+    return index["answers"][index["doc_entries"][best]], score
+
+
+def load_faq_index():
+    """
+    加载当前作品的 FAQ 索引（带缓存）
+    与提示词一样每隔 prompt_check_interval 秒检查一次文件签名，变化后重建索引
+    
+    Returns:
+        FAQ 索引，没有 FAQ 文件时返回 None
+    """
+    candidates = get_faq_candidates()
+    if not candidates:
+        return None
+    key = (CONFIG.get("faq_file", ""), get_work_id())
+    now = time.monotonic()
+    check_interval = CONFIG.get("prompt_check_interval") or 5
+    
+    entry = _faq_cache.get(key)
+    if entry and now - entry["checked"] < check_interval:
+        return entry["index"]
+    
+    with _faq_lock:
+        entry = _faq_cache.get(key)
+        if entry and now - entry["checked"] < check_interval:
+            return entry["index"]
+        
+        path = next((path for path in candidates if os.path.exists(path)), None)
+        signature = (path, get_file_signature(path)) if path else None
+        if entry and entry["signature"] == signature:
+            entry["checked"] = now
+            return entry["index"]
+        
+        index = None
+        if path:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entries = parse_faq(f.read())
+                build_start = time.monotonic()
+                index = build_faq_index(entries, entry["index"] if entry else None)
+                log("INFO", f"{'FAQ 已更新' if entry else 'FAQ 已加载'}: {len(entries)} 条问答 / "
+                            f"{len(index['doc_entries'])} 个问法 ({(time.monotonic() - build_start) * 1000:.1f}ms)")
+            except Exception as e:
+                log("WARNING", f"读取 FAQ 文件失败: {e}")
+                index = entry["index"] if entry else None
+        
+        _faq_cache[key] = {"index": index, "signature": signature, "checked": now}
+        return index
+
+
+# ==================== 合并相同问题 ====================
+# 同一进程内（包括多个作品之间）相同的问题已经在请求AI时，后来者不再发出新请求，
+# 等待进行中的请求并共享结果；流式模式下部分答复也会同时写回到等待者的云变量
+# 问题按规范化文本、提示词和所用服务商/模型判断是否相同
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_single_flight_key(question: str) -> str:
+    """合并键：答复缓存键（含模型和生成参数）+ 服务商地址和模型"""
+    providers = "|".join(f"{provider['url']}#{provider['model']}" for provider in get_ai_providers())
+    raw = f"{get_answer_cache_key(question)}\n{providers}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def call_ai_api_shared(question: str, on_partial=None) -> dict:
+    """
+    调用AI API，相同问题已有请求在进行中时等待并共享其结果
+    
+    Args:
+        question: 用户问题
+        on_partial: 流式模式下收到新内容时的回调 on_partial(已生成的答复)
+        
+    Returns:
+        call_ai_api 的结果，共享其他请求的结果时带 coalesced=True
+    """
+    key = get_single_flight_key(question)
+    
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = {"done": threading.Event(), "result": None, "listeners": []}
+        elif on_partial is not None:
+            # 部分答复回调在发起请求的线程中调用，需要在等待者自己的作品上下文中执行
+            flight["listeners"].append((contextvars.copy_context(), on_partial))
+    
+    if not leader:
+        stats["coalesced"] += 1
+        log("INFO", "相同的问题正在请求AI，等待共享结果")
+        flight["done"].wait()
+        result = dict(flight["result"], coalesced=True)
+        # 首字延迟、对冲结果和 token 用量属于发起请求的一方
+        result.pop("ttft", None)
+        result.pop("hedge", None)
+        result.pop("tokens", None)
+        return result
+    
+    def shared_partial(text: str):
+        if on_partial is not None:
+            on_partial(text)
+        with _inflight_lock:
+            listeners = list(flight["listeners"])
+        for context, listener in listeners:
+            try:
+                context.run(listener, text)
+            except Exception as e:
+                log("WARNING", f"写回合并问题的部分答复失败: {e}")
+    
+    result = {"success": False, "error": "EXCEPTION", "message": "AI请求未完成"}
+    try:
+        if on_partial is None and int(CONFIG.get("ai_batch_size") or 0) > 1:
+            # 不需要写回部分答复的问题可以与其他问题合并为一次请求
+            result = call_ai_api_batched(question)
+        else:
+            result = call_ai_api(question, shared_partial)
+    except Exception as e:
+        result = {"success": False, "error": "EXCEPTION", "message": str(e)}
+        raise
+    finally:
+        with _inflight_lock:
+            flight["result"] = result
+            del _inflight[key]
+        flight["done"].set()
+    return result
+
+
+def parse_question(value: str) -> tuple:
+    """
+    解析云变量值，提取问题
+    
+    Args:
+        value: 云变量的值
+        
+    Returns:
+        (是否为问题, 问题内容)
+    """
+    prefix = CONFIG["question_prefix"]
+    
+    if not value or not isinstance(value, str):
+        return False, None
+    
+    if not value.startswith(prefix):
+        return False, None
+    
+    question = value[len(prefix):].strip()
+    return True, question
+
+
+# 多路复用协议中的请求ID：字母、数字、下划线或短横线，最长 32 个字符
+SLOT_REQUEST_ID_PATTERN = re.compile(r"^([A-Za-z0-9_-]{1,32})\|")
+
+
+def get_slot_names() -> list:
+    """
+    需要读取的问题变量名
+    
+    Returns:
+        多路复用协议下为 [{variable_name}1, ..., {variable_name}N]，否则为 [variable_name]
+    """
+    count = int(CONFIG.get("slot_count") or 0)
+    if count <= 0:
+        return [CONFIG["variable_name"]]
+    return [f"{CONFIG['variable_name']}{i}" for i in range(1, count + 1)]
+
+
+def get_question_worker_count(config) -> int:
+    """
+    作品的问题处理任务数，线程池按它分配线程
+    
+    Args:
+        config: 作品配置
+        
+    Returns:
+        question_workers，多路复用协议下至少为槽位数，队列模式下至少为每批问题数
+    """
+    count = max(int(config.get("question_workers") or 1), 1)
+    if config.get("queue_list"):
+        count = max(count, int(config.get("queue_batch_size") or 10))
+    elif config.get("slot_count"):
+        count = max(count, int(config["slot_count"]))
+    return count
+
+
+def get_work_thread_count(config) -> int:
+    """
+    作品占用的线程池线程数：一个轮询线程、每个问题处理任务一个线程，队列模式下另加答复写回线程
+    
+    Args:
+        config: 作品配置
+        
+    Returns:
+        线程数（推送订阅在独立线程中运行，不计入）
+    """
+    return 1 + get_question_worker_count(config) + (1 if config.get("queue_list") else 0)
+
+
+def split_request_id(question: str) -> tuple:
+    """
+    拆出多路复用协议或队列模式问题中的请求ID（请求ID|问题）
+    
+    Returns:
+        (请求ID, 问题)，未开启多路复用和队列模式或问题中没有请求ID时请求ID为 None
+    """
+    if not CONFIG.get("slot_count") and not CONFIG.get("queue_list"):
+        return None, question
+    match = SLOT_REQUEST_ID_PATTERN.match(question)
+    if not match:
+        return None, question
+    return match.group(1), question[match.end():].strip()
+
+
+def format_answer(answer: str, request_id: str = None) -> str:
+    """生成写回云变量或答复列表的答复，带请求ID时玩家据此认领自己的答复"""
+    if request_id:
+        return f"{CONFIG['answer_prefix']}{request_id}|{answer}"
+    return f"{CONFIG['answer_prefix']}{answer}"
+
+
+def validate_config() -> bool:
+    """
+    验证配置是否完整
+    
+    Returns:
+        配置是否有效
+    """
+    required_fields = ["api_base_url", "variable_name"]
+    if not CONFIG.get("ai_providers"):
+        required_fields += ["ai_api_url", "ai_api_key", "ai_model"]
+    missing = []
+    
+    for field in required_fields:
+        if not CONFIG.get(field):
+            missing.append(field)
+    
+    for provider in get_ai_providers() if CONFIG.get("ai_providers") else []:
+        for field in ("url", "key", "model"):
+            if not provider[field]:
+                missing.append(f"ai_providers[{provider['name']}].{field}")
+    
+    if missing:
+        log("ERROR", f"缺少必要配置项: {', '.join(missing)}")
+        return False
+    
+    return True
+
+
+def parse_work_ids(text: str) -> list:
+    """
+    解析作品ID列表（逗号或空白分隔）
+    
+    Args:
+        text: 如 "123456,654321"
+        
+    Returns:
+        去重后的作品ID列表
+    """
+    work_ids = []
+    for part in re.split(r"[,\s]+", text.strip()):
+        if not part:
+            continue
+        if not part.isdigit() or int(part) <= 0:
+            raise ValueError(f"无效的作品ID: {part}")
+        if int(part) not in work_ids:
+            work_ids.append(int(part))
+    return work_ids
+
+
+def discover_work_configs(works_dir: str) -> dict:
+    """
+    扫描目录中的作品配置文件 config_<作品ID>.py
+    
+    Args:
+        works_dir: 配置目录
+        
+    Returns:
+        {作品ID: 配置文件路径}
+    """
+    work_configs = {}
+    if not os.path.isdir(works_dir):
+        return work_configs
+    
+    for filename in sorted(os.listdir(works_dir)):
+        match = re.fullmatch(r"config_(\d+)\.py", filename)
+        if match:
+            work_configs[int(match.group(1))] = os.path.join(works_dir, filename)
+    return work_configs
+
+
+def apply_cli_overrides(args, target: dict):
+    """命令行参数覆盖配置"""
+    if args.api_url:
+        target["api_base_url"] = args.api_url
+    if args.ai_url:
+        target["ai_api_url"] = args.ai_url
+    if args.ai_key:
+        target["ai_api_key"] = args.ai_key
+    if args.ai_model:
+        target["ai_model"] = args.ai_model
+    if args.var_name:
+        target["variable_name"] = args.var_name
+    if args.question_prefix:
+        target["question_prefix"] = args.question_prefix
+    if args.answer_prefix:
+        target["answer_prefix"] = args.answer_prefix
+    if args.log_dir:
+        target["log_dir"] = args.log_dir
+    if args.prompt_file:
+        target["system_prompt_file"] = args.prompt_file
+
+
+def build_multi_works(args) -> list:
+    """
+    根据 --works / --works-dir 构建多作品上下文
+    每个作品的配置: 默认配置 <- 公共配置文件(-c) <- 作品配置文件 <- 命令行参数
+    
+    Returns:
+        作品上下文列表
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    works_dir = args.works_dir or os.path.join(script_dir, "ai-bridge")
+    work_configs = discover_work_configs(works_dir)
+    
+    if args.works:
+        work_ids = parse_work_ids(args.works)
+    else:
+        work_ids = list(work_configs.keys())
+    
+    works = []
+    for work_id in work_ids:
+        config = DEFAULT_CONFIG.copy()
+        if args.config:
+            load_config_from_file(args.config, config)
+        config_path = work_configs.get(work_id)
+        if config_path and not load_config_from_file(config_path, config):
+            log("WARNING", f"无法加载作品 {work_id} 的配置文件: {config_path}")
+        apply_cli_overrides(args, config)
+        works.append(create_work(work_id, config))
+    return works
+
+
+def record_ttft(ttft: float):
+    """记录流式响应的首字延迟"""
+    ttft_stats = stats["ttft"]
+    ttft = round(ttft, 3)
+    ttft_stats["last"] = ttft
+    ttft_stats["min"] = ttft if ttft_stats["min"] is None else min(ttft_stats["min"], ttft)
+    ttft_stats["max"] = ttft if ttft_stats["max"] is None else max(ttft_stats["max"], ttft)
+    ttft_stats["total"] += ttft
+    ttft_stats["count"] += 1
+
+
+def busy_answer(record: dict, reason: str) -> dict:
+    """被限流时以 busy_message 作为答复（计入失败答复，收到问题 = 成功答复 + 失败答复）"""
+    answer = CONFIG["busy_message"]
+    log("WARNING", f"{reason}，答复繁忙提示: {answer}")
+    stats["busy_answers"] += 1
+    stats["failed_answers"] += 1
+    record.update(answer=answer, source="busy", success=False, error="RATE_LIMITED")
+    return {"answer": answer, "source": "busy", "record": record}
+
+
+def generate_answer(question: str, on_partial=None) -> dict:
+    """
+    生成答复：优先使用答复缓存和 FAQ，否则调用AI API，失败时返回错误提示作为答复
+    
+    Args:
+        question: 问题内容
+        on_partial: 流式模式下的部分答复回调
+        
+    Returns:
+        {"answer": 答复内容, "source": 来源 (ai/cache/faq/busy), "record": 调用记录（写回后由调用方补全并写入）}
+    """
+    stats["total_questions"] += 1
+    
+    record = {"question": question, "success": True, "durations": {}}
+    
+    if CONFIG.get("answer_cache"):
+        lookup_start = time.monotonic()
+        cached_answer = get_cached_answer(question)
+        record["durations"]["cache"] = time.monotonic() - lookup_start
+        if cached_answer is not None:
+            log("SUCCESS", f"命中答复缓存: {cached_answer}")
+            stats["successful_answers"] += 1
+            stats["cache_hits"] += 1
+            record.update(answer=cached_answer, source="cache")
+            return {"answer": cached_answer, "source": "cache", "record": record}
+    
+    faq_index = load_faq_index()
+    if faq_index is not None:
+        lookup_start = time.monotonic()
+        faq_answer, score = match_faq(faq_index, question)
+        record["durations"]["faq"] = time.monotonic() - lookup_start
+        record_latency("faq", record["durations"]["faq"])
+        record["faq_score"] = round(score, 3)
+        faq_stats = stats["faq"]
+        faq_stats["lookups"] += 1
+        faq_stats["score_total"] += score
+        if faq_answer is not None:
+            log("SUCCESS", f"命中 FAQ (相似度 {score:.2f}): {faq_answer}")
+            faq_stats["hits"] += 1
+            faq_stats["hit_score_total"] += score
+            stats["successful_answers"] += 1
+            record.update(answer=faq_answer, source="faq")
+            return {"answer": faq_answer, "source": "faq", "record": record}
+        log("DEBUG", f"FAQ 最接近的问题相似度 {score:.2f}，未达到阈值 {CONFIG['faq_threshold']}")
+    
+    limit_start = time.monotonic()
+    allowed = wait_rate_limit("work", str(get_work_id()), get_rate_limit_wait())
+    record["durations"]["rate_limit"] = time.monotonic() - limit_start
+    if not allowed:
+        return busy_answer(record, "作品提问过于频繁")
+    
+    log("INFO", "正在调用AI API...")
+    ai_start = time.monotonic()
+    ai_result = call_ai_api_shared(question, on_partial)
+    record["durations"]["ai"] = time.monotonic() - ai_start
+    record["durations"]["ttft"] = ai_result.get("ttft")
+    record_latency("ai", record["durations"]["ai"])
+    record_latency("ttft", ai_result.get("ttft"))
+    record["source"] = "ai"
+    
+    if ai_result.get("error") == "RATE_LIMITED" and CONFIG.get("busy_message"):
+        return busy_answer(record, ai_result.get("message"))
+    
+    if not ai_result["success"]:
+        error_msg = ai_result.get("message", "未知错误")
+        log("ERROR", f"AI API调用失败: {error_msg}")
+        answer = f"[AI调用失败: {error_msg}]"
+        stats["failed_answers"] += 1
+        record.update(success=False, error=ai_result.get("error"), provider=ai_result.get("provider"))
+    else:
+        answer = ai_result["answer"]
+        if ai_result.get("ttft") is not None:
+            record_ttft(ai_result["ttft"])
+            log("DEBUG", f"首字延迟: {ai_result['ttft']:.2f}秒")
+        log("SUCCESS", f"AI答复: {answer}")
+        stats["successful_answers"] += 1
+        record["model"] = ai_result.get("model")
+        record["provider"] = ai_result.get("provider")
+        record["hedge"] = ai_result.get("hedge")
+        record["coalesced"] = ai_result.get("coalesced", False)
+        record["batch"] = ai_result.get("batch")
+        record["tokens"] = ai_result.get("tokens")
+        record["truncated"] = ai_result.get("truncated", False)
+        if CONFIG.get("answer_cache") and answer:
+            put_cached_answer(question, answer)
+    
+    record["answer"] = answer
+    return {"answer": answer, "source": "ai", "record": record}
+
+
+def finish_call_record(record: dict, write_start: float, written: bool):
+    """
+    答复写回后记录写回耗时，补全调用记录并写入调用记录文件
+    
+    Args:
+        record: 调用记录，为 None 时只记录写回耗时
+        write_start: 开始写回的时间 (time.monotonic)
+        written: 是否写回成功
+    """
+    record_latency("write", time.monotonic() - write_start)
+    if record is None:
+        return
+    record["durations"]["write"] = time.monotonic() - write_start
+    record["written"] = written
+    if "started" in record:
+        record["durations"]["total"] = time.monotonic() - record.pop("started")
+        record_latency("total", record["durations"]["total"])
+    write_call_record(record)
+
+
+def write_answer(work_id: int, answer: str, var_type: str, record: dict = None, var_name: str = None,
+                 request_id: str = None):
+    """
+    将答复写回云变量
+    
+    Args:
+        work_id: 作品ID
+        answer: 答复内容
+        var_type: 变量类型 (public/private)
+        record: 调用记录，写回后补全写回耗时并写入调用记录文件
+        var_name: 写回的变量名，默认 CONFIG["variable_name"]
+        request_id: 多路复用协议的请求ID
+    """
+    var_name = var_name or CONFIG["variable_name"]
+    response_value = format_answer(answer, request_id)
+    
+    log("INFO", f"正在设置变量{'' if var_name == CONFIG['variable_name'] else f' {var_name} '}值为: "
+                f"{response_value[:50]}{'...' if len(response_value) > 50 else ''}")
+    
+    write_start = time.monotonic()
+    set_result = set_variable(CONFIG["api_base_url"], work_id, var_name, response_value, var_type)
+    finish_call_record(record, write_start, set_result["success"])
+    
+    if set_result["success"]:
+        log("SUCCESS", "变量设置成功")
+    else:
+        log("ERROR", f"变量设置失败: {set_result.get('message', '未知错误')}")
+        stats["total_errors"] += 1
+    
+    log("INFO", "回复完成")
+    print()
+    
+    save_stats()
+
+
+def create_partial_writer(work_id: int, raw_value: str, var_type: str, var_name: str = None,
+                          request_id: str = None):
+    """
+    创建流式答复的部分写回回调：首段内容立即写回，之后按 stream_flush_interval 节流
+    写回前检查变量，玩家已写入新问题时停止部分写回，避免覆盖新问题
+    
+    Args:
+        work_id: 作品ID
+        raw_value: 正在回答的问题原始值
+        var_type: 变量类型
+        var_name: 写回的变量名，默认 CONFIG["variable_name"]
+        request_id: 多路复用协议的请求ID
+        
+    Returns:
+        on_partial(已生成的答复) 回调
+    """
+    var_name = var_name or CONFIG["variable_name"]
+    interval = CONFIG.get("stream_flush_interval") or 0
+    state = {"last_flush": None, "stopped": False}
+    
+    def on_partial(answer: str):
+        now = time.monotonic()
+        if state["stopped"] or (state["last_flush"] is not None and now - state["last_flush"] < interval):
+            return
+        state["last_flush"] = now
+        
+        var_result = get_variable(CONFIG["api_base_url"], work_id, var_name)
+        if var_result["success"]:
+            current_value = var_result.get("value")
+            is_new_question, _ = parse_question(str(current_value) if current_value else "")
+            if is_new_question and current_value != raw_value:
+                state["stopped"] = True
+                log("INFO", "云变量中已有新问题，停止写回部分答复")
+                return
+        
+        set_result = set_variable(CONFIG["api_base_url"], work_id, var_name, format_answer(answer, request_id), var_type)
+        if set_result["success"]:
+            stats["partial_flushes"] += 1
+            log("DEBUG", f"写回部分答复 ({len(answer)}字)")
+    
+    return on_partial
+
+
+def create_inbox(queue_size: int) -> dict:
+    """
+    创建问题收件箱
+    
+    Returns:
+        {"queue": 问题队列, "pending": 排队或处理中的 (变量名, 原始值),
+         "last_answered": 各变量最近写回答复的原始值及时间, "wakeup": 唤醒轮询的事件}
+    """
+    return {
+        "queue": asyncio.Queue(maxsize=max(queue_size, 1)),
+        "pending": set(),
+        "last_answered": {},
+        "wakeup": asyncio.Event()
+    }
+
+
+def enqueue_question(inbox: dict, raw_value: str, question: str, var_type: str, read_started: float, source: str,
+                     var_name: str = None) -> bool:
+    """
+    将读取到的问题加入队列（排队中、处理中或旧值会被忽略）
+    
+    Args:
+        inbox: 问题收件箱
+        raw_value: 云变量原始值
+        question: 解析出的问题
+        var_type: 变量类型
+        read_started: 读取变量开始的时间 (time.monotonic)
+        source: 日志中显示的来源
+        var_name: 问题所在的变量名，默认 CONFIG["variable_name"]
+        
+    Returns:
+        是否新加入队列
+    """
+    queue = inbox["queue"]
+    var_name = var_name or CONFIG["variable_name"]
+    last_answered = inbox["last_answered"].get(var_name)
+    
+    if (var_name, raw_value) in inbox["pending"]:
+        return False
+    if last_answered and raw_value == last_answered["value"] and read_started < last_answered["time"]:
+        # 读取发生在答复写回之前，是已处理问题的旧值
+        return False
+    request_id, question = split_request_id(question)
+    if not question:
+        return False
+    if queue.full():
+        log("WARNING", f"问题队列已满 ({queue.qsize()})，下次轮询再读取该问题")
+        return False
+    
+    inbox["pending"].add((var_name, raw_value))
+    queue.put_nowait({
+        "raw_value": raw_value,
+        "question": question,
+        "var_type": var_type,
+        "queued_at": time.monotonic(),
+        "var_name": var_name,
+        "request_id": request_id
+    })
+    record_question_arrival()
+    slot = f" [{var_name}]" if CONFIG.get("slot_count") else ""
+    log("INFO", f"{source}{slot} 检测到新问题，加入处理队列 (待处理: {queue.qsize()})")
+    log("INFO", f"原始值: {raw_value}")
+    log("INFO", f"提取问题: {question}")
+    return True
+
+
+def get_answer_list_name() -> str:
+    """队列模式下写回答复的云列表名，默认为 {queue_list}答复"""
+    return CONFIG.get("answer_list") or f"{CONFIG['queue_list']}答复"
+
+
+def create_outbox(items: list) -> dict:
+    """
+    创建队列模式的答复发件箱
+    
+    Args:
+        items: 答复列表的现有内容
+        
+    Returns:
+        {"items": 答复列表内容（程序是该列表唯一的写入方，本地保存一份）,
+         "pending": 等待写回的 (答复, Future), "outstanding": 排队或处理中的列表问题数,
+         "wakeup": 唤醒发件任务的事件, "drain_supported": 服务端是否支持 drain 接口}
+    """
+    return {
+        "items": list(items),
+        "pending": [],
+        "outstanding": 0,
+        "wakeup": asyncio.Event(),
+        "drain_supported": True
+    }
+
+
+def drain_questions(work_id: int, outbox: dict, limit: int) -> dict:
+    """
+    一次取出提问列表头部最多 limit 项
+    服务端不支持 drain 接口时回退为读取列表后逐项移除头部（每项多一个请求）
+    
+    Returns:
+        成功时 items 为取出的项
+    """
+    name = CONFIG["queue_list"]
+    if outbox["drain_supported"]:
+        result = drain_list(CONFIG["api_base_url"], work_id, name, limit)
+        if result.get("error") != "NOT_SUPPORTED":
+            return result
+        outbox["drain_supported"] = False
+        log("WARNING", "API服务不支持 /list/drain，改为读取后逐项移除（升级服务端可减少请求次数）")
+    
+    list_result = get_list(CONFIG["api_base_url"], work_id, name)
+    if not list_result["success"]:
+        return list_result
+    
+    # 程序是唯一从头部移除的一方，玩家只在尾部追加，逐项移除头部不会误删新问题
+    items = []
+    for item in list_result["items"][:limit]:
+        remove_result = remove_list_item(CONFIG["api_base_url"], work_id, name, 0)
+        if not remove_result["success"]:
+            log("ERROR", f"移除提问列表项失败: {remove_result.get('message', '未知错误')}")
+            break
+        items.append(item)
+    return {"success": True, "items": items}
+
+
+def enqueue_list_questions(inbox: dict, outbox: dict, items: list, source: str) -> int:
+    """
+    将从提问列表取出的问题加入队列
+    取出的项已从列表移除，每一项都是一个独立的问题，不按原始值去重
+    
+    Returns:
+        加入队列的问题数
+    """
+    queue = inbox["queue"]
+    count = 0
+    for raw_value in items:
+        is_new_question, question = parse_question(str(raw_value) if raw_value else "")
+        if not is_new_question:
+            log("DEBUG", f"{source} 忽略提问列表中的非问题项: {raw_value}")
+            continue
+        request_id, question = split_request_id(question)
+        if not question:
+            continue
+        
+        queued_at = time.monotonic()
+        inbox["pending"].add((CONFIG["queue_list"], raw_value, queued_at))
+        outbox["outstanding"] += 1
+        queue.put_nowait({
+            "raw_value": raw_value,
+            "question": question,
+            "var_type": "public",
+            "queued_at": queued_at,
+            "var_name": CONFIG["queue_list"],
+            "request_id": request_id,
+            "from_list": True
+        })
+        count += 1
+        log("INFO", f"{source} 提问列表问题: {question}{f' (请求ID: {request_id})' if request_id else ''}")
+    
+    if count:
+        stats["list_questions"] += count
+        record_question_arrival()
+        log("INFO", f"{source} 从提问列表取出 {count} 个问题，加入处理队列 (待处理: {queue.qsize()})")
+    return count
+
+
+async def publish_list_answer(outbox: dict, value: str) -> bool:
+    """
+    把答复交给发件任务，等待与同一批的其他答复一起写回答复列表
+    
+    Returns:
+        是否写回成功
+    """
+    future = asyncio.get_running_loop().create_future()
+    outbox["pending"].append((value, future))
+    outbox["wakeup"].set()
+    return await future
+
+
+async def answer_list_publisher(work_id: int, outbox: dict):
+    """
+    答复发件任务：同一批问题的答复合并为一次 setAll 写回答复列表
+    本批问题全部答完时立即写回，否则最多再等 queue_flush_delay 秒收集后续答复
+    
+    Args:
+        work_id: 作品ID
+        outbox: 答复发件箱
+    """
+    name = get_answer_list_name()
+    while True:
+        await outbox["wakeup"].wait()
+        outbox["wakeup"].clear()
+        deadline = time.monotonic() + (CONFIG.get("queue_flush_delay") or 0)
+        while len(outbox["pending"]) < outbox["outstanding"] and time.monotonic() < deadline:
+            await wait_for_wakeup(outbox["wakeup"], deadline - time.monotonic())
+        
+        batch, outbox["pending"] = outbox["pending"], []
+        if not batch:
+            continue
+        
+        # 只保留最近 answer_list_size 条答复；写回失败时也保留在本地，下次写回时一并补上
+        size = max(int(CONFIG.get("answer_list_size") or 50), len(batch))
+        outbox["items"] = (outbox["items"] + [value for value, _ in batch])[-size:]
+        
+        log("INFO", f"正在写回答复列表 '{name}' ({len(batch)} 条答复)")
+        write_result = await asyncio.to_thread(set_list, CONFIG["api_base_url"], work_id, name, outbox["items"])
+        if write_result["success"]:
+            stats["list_writes"] += 1
+            log("SUCCESS", f"答复列表写回成功 ({len(batch)} 条答复)")
+        else:
+            log("ERROR", f"答复列表写回失败: {write_result.get('message', '未知错误')}")
+            stats["total_errors"] += 1
+        
+        for _, future in batch:
+            if not future.done():
+                future.set_result(write_result["success"])
+
+
+async def wait_for_wakeup(event: asyncio.Event, timeout: float):
+    """等待下一次轮询：超时或被提前唤醒（如刚写回答复）"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    event.clear()
+
+
+async def question_worker(work_id: int, inbox: dict, outbox: dict = None):
+    """
+    问题处理工作任务：从队列取出问题，在线程池中调用AI并写回答复
+    
+    Args:
+        work_id: 作品ID
+        inbox: 问题收件箱
+        outbox: 队列模式的答复发件箱，提问列表中的问题通过它批量写回
+    """
+    queue = inbox["queue"]
+    while True:
+        item = await queue.get()
+        raw_value = item["raw_value"]
+        var_name = item["var_name"]
+        from_list = item.get("from_list", False)
+        try:
+            started = time.monotonic()
+            on_partial = None
+            if CONFIG.get("stream_mode") and CONFIG.get("stream_flush_interval") and not from_list:
+                on_partial = create_partial_writer(work_id, raw_value, item["var_type"], var_name, item["request_id"])
+            result = await asyncio.to_thread(generate_answer, item["question"], on_partial)
+            record = result["record"]
+            record["durations"]["queue"] = started - item["queued_at"]
+            record["started"] = item["queued_at"]
+            if from_list:
+                record.update(list=var_name, request_id=item["request_id"])
+                write_start = time.monotonic()
+                written = await publish_list_answer(outbox, format_answer(result["answer"], item["request_id"]))
+                await asyncio.to_thread(finish_call_record, record, write_start, written)
+                if stats_checkpoint_due():
+                    await asyncio.to_thread(save_stats)
+                continue
+            if CONFIG.get("slot_count"):
+                record.update(slot=var_name, request_id=item["request_id"])
+            
+            # 写回前再读一次变量，AI思考期间写入的新问题先入队，避免被答复覆盖而丢失
+            # 缓存命中几乎没有耗时，直接写回
+            if result["source"] == "ai":
+                read_started = time.monotonic()
+                var_result = await asyncio.to_thread(get_variable, CONFIG["api_base_url"], work_id, var_name)
+                record["durations"]["recheck"] = time.monotonic() - read_started
+                if var_result["success"]:
+                    current_value = var_result.get("value")
+                    is_new_question, new_question = parse_question(str(current_value) if current_value else "")
+                    if is_new_question and current_value != raw_value:
+                        enqueue_question(inbox, current_value, new_question, var_result.get("type", "public"), read_started,
+                                         "[写回前检查]", var_name)
+            
+            await asyncio.to_thread(write_answer, work_id, result["answer"], item["var_type"], record, var_name,
+                                    item["request_id"])
+        except Exception as e:
+            log("ERROR", f"处理问题时发生错误: {str(e)}")
+            stats["total_errors"] += 1
+        finally:
+            if from_list:
+                outbox["outstanding"] -= 1
+                inbox["pending"].discard((var_name, raw_value, item["queued_at"]))
+            else:
+                inbox["last_answered"][var_name] = {"value": raw_value, "time": time.monotonic()}
+                inbox["pending"].discard((var_name, raw_value))
+            queue.task_done()
+            if not from_list:
+                inbox["wakeup"].set()
+
+
+async def check_online_sleep(work_id: int, has_pending: bool) -> bool:
+    """
+    按 online_check_interval 检查在线人数，判断本轮是否休眠
+    休眠中每轮都检查，以便有人加入时尽快恢复；有待处理问题时不休眠
+    
+    Returns:
+        本轮是否跳过云变量轮询
+    """
+    check_interval = CONFIG.get("online_check_interval") or 0
+    if check_interval <= 0:
+        return False
+    
+    scheduler = get_scheduler()
+    if scheduler["asleep"] or time.monotonic() - scheduler["last_online_check"] >= check_interval:
+        scheduler["last_online_check"] = time.monotonic()
+        stats["online_checks"] += 1
+        online_result = await asyncio.to_thread(get_online_users, CONFIG["api_base_url"], work_id)
+        if online_result["success"]:
+            record_online_users(online_result.get("online_users"))
+            # 休眠期间在线检查代替轮询，用于健康检查
+            (_current_work.get() or {})["last_poll_ok"] = time.time()
+        elif scheduler["asleep"]:
+            # 无法确认在线人数时恢复正常轮询，避免漏掉问题
+            record_online_users(1)
+    
+    return scheduler["asleep"] and not has_pending
+
+
+def handle_watch_value(inbox: dict, value, var_type: str, received_at: float, var_name: str = None):
+    """处理推送的云变量值（在事件循环中执行）"""
+    stats["watch_events"] += 1
+    is_new_question, question = parse_question(str(value) if value else "")
+    if is_new_question:
+        enqueue_question(inbox, value, question, var_type, received_at, "[推送]", var_name)
+
+
+async def run_in_thread(func, *args):
+    """
+    在独立的守护线程中运行长时间阻塞的函数（带当前作品上下文），不占用默认线程池
+    
+    Returns:
+        func 的返回值
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    context = contextvars.copy_context()
+    
+    def resolve(result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def run():
+        try:
+            result, error = context.run(func, *args), None
+        except Exception as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(resolve, result, error)
+        except RuntimeError:
+            # 事件循环已经关闭（程序退出中）
+            pass
+    
+    threading.Thread(target=run, name=f"ai-bridge-{getattr(func, '__name__', 'thread')}", daemon=True).start()
+    return await future
+
+
+async def watch_loop(work_id: int, inbox: dict, watch_state: dict, var_name: str = None):
+    """
+    推送订阅任务：连接断开后按指数退避重连，断开期间由轮询兜底
+    
+    Args:
+        work_id: 作品ID
+        inbox: 问题收件箱
+        watch_state: 订阅状态
+        var_name: 订阅的变量名，默认 CONFIG["variable_name"]
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    
+    def on_value(value, var_type):
+        loop.call_soon_threadsafe(handle_watch_value, inbox, value, var_type, time.monotonic(), var_name, context=context)
+    
+    retry_delay = 1
+    try:
+        while True:
+            started = time.monotonic()
+            # 订阅连接会长时间阻塞，放在独立线程中，不占用问题处理和轮询的线程池
+            reason = await run_in_thread(watch_variable, work_id, watch_state, on_value, var_name)
+            log("WARNING", f"推送连接断开: {reason}，回退到轮询，{retry_delay}秒后重连")
+            inbox["wakeup"].set()
+            stats["watch_reconnects"] += 1
+            
+            # 连接保持了较长时间说明服务正常，重置退避
+            if time.monotonic() - started > 60:
+                retry_delay = 1
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 30)
+    finally:
+        stop_watch(watch_state)
+
+
+async def run_work(work: dict) -> bool:
+    """
+    单个作品的轮询主循环，在独立的 asyncio 任务中运行
+    阻塞的网络请求放到线程池执行，不影响其他作品的轮询
+    
+    Args:
+        work: 作品上下文
+        
+    Returns:
+        False 表示连接失败或发生意外错误需要重启，收到退出信号正常退出返回 True
+    """
+    _current_work.set(work)
+    work_id = work["work_id"]
+    
+    await asyncio.to_thread(warm_up_connections, [CONFIG["api_base_url"]] + [p["url"] for p in get_ai_providers()])
+    await asyncio.to_thread(load_poll_history)
+    if stats["start_time"] is None:
+        await asyncio.to_thread(load_stats)
+    await asyncio.to_thread(load_faq_index)
+    
+    log("INFO", f"正在连接作品 {work_id}...")
+    
+    connect_result = await asyncio.to_thread(connect_to_work, CONFIG["api_base_url"], work_id)
+    if not connect_result["success"]:
+        log("ERROR", f"连接失败: {connect_result.get('message', '未知错误')}")
+        return False
+    
+    conn_data = connect_result.get("data", {})
+    online_users = conn_data.get("onlineUsers", "未知")
+    log("SUCCESS", f"连接成功！在线人数: {online_users}")
+    print()
+    get_scheduler()["last_online_check"] = time.monotonic()
+    record_online_users(online_users)
+    
+    if stats["start_time"] is None:
+        stats["start_time"] = datetime.now()
+    stats["end_time"] = None
+    stats["online_periods"].append([datetime.now(), None])
+    
+    write_log(f"程序启动 - 作品ID: {work_id}", "SYSTEM")
+    write_log(f"连接成功 - 在线人数: {online_users}", "SYSTEM")
+    
+    slot_names = get_slot_names()
+    queue_mode = bool(CONFIG.get("queue_list"))
+    if queue_mode:
+        log("INFO", f"开始轮询提问列表 '{CONFIG['queue_list']}'，答复写回列表 '{get_answer_list_name()}'（队列模式）...")
+    elif CONFIG.get("slot_count"):
+        log("INFO", f"开始轮询 {len(slot_names)} 个槽位变量 '{slot_names[0]}' ~ '{slot_names[-1]}'（多路复用协议）...")
+    else:
+        log("INFO", f"开始轮询云变量 '{CONFIG['variable_name']}'...")
+    log("INFO", f"轮询间隔: 自适应 {CONFIG['poll_interval_min']}~{CONFIG['poll_interval_max']}秒（收到问题后加快，空闲时逐渐放慢）")
+    if not MULTI_WORK:
+        log("INFO", "按 Ctrl+C 退出程序")
+    log("INFO", f"日志文件: {get_log_file_path()}")
+    log("INFO", f"统计文件: {get_stats_file_path()}")
+    print()
+    
+    poll_count = stats["total_polls"]
+    last_stats_print = datetime.now()
+    consecutive_errors = 0
+    max_consecutive_errors = 3
+    reconnect_fail_count = 0
+    max_reconnect_fails = 3
+    
+    # 轮询日志抽样：值不变时每 poll_log_interval 秒最多记录一次
+    last_logged_value = None
+    last_poll_log = 0.0
+    skipped_poll_logs = 0
+    
+    # 问题在后台工作任务中处理，轮询不会因为等待AI答复而停止
+    # 多路复用协议下每个槽位至少有一个工作任务，各槽位的问题并行处理
+    # 队列模式下一次取出的一批问题并行处理
+    batch_size = max(int(CONFIG.get("queue_batch_size") or 10), 1) if queue_mode else 1
+    inbox = create_inbox(max(int(CONFIG.get("question_queue_size") or 20), len(slot_names), batch_size))
+    work["inbox"] = inbox
+    worker_count = get_question_worker_count(CONFIG)
+    
+    outbox = None
+    if queue_mode:
+        answer_list = get_answer_list_name()
+        list_result = await asyncio.to_thread(get_list, CONFIG["api_base_url"], work_id, answer_list)
+        if not list_result["success"]:
+            log("WARNING", f"读取答复列表 '{answer_list}' 失败: {list_result.get('message', '未知错误')}，"
+                           f"请确认作品中已创建该云列表")
+        outbox = create_outbox(list_result.get("items") or [])
+        work["outbox"] = outbox
+    
+    workers = [
+        asyncio.create_task(question_worker(work_id, inbox, outbox))
+        for _ in range(worker_count)
+    ]
+    if queue_mode:
+        workers.append(asyncio.create_task(answer_list_publisher(work_id, outbox)))
+    
+    # 推送模式：订阅变化，问题即时入队；连接正常时轮询只作为兜底（多路复用协议下每个槽位一个订阅）
+    # 云列表没有推送接口，队列模式下只轮询
+    watch_states = [] if queue_mode else [{"connected": False, "response": None, "abort": None, "stopped": False}
+                                          for _ in slot_names]
+    work["watch_states"] = watch_states
+    if CONFIG.get("watch_mode") and queue_mode:
+        log("WARNING", "队列模式不支持推送订阅，使用轮询")
+    if CONFIG.get("watch_mode"):
+        for var_name, watch_state in zip(slot_names, watch_states):
+            workers.append(asyncio.create_task(watch_loop(work_id, inbox, watch_state, var_name)))
+    missing_slots = set()
+    exit_ok = True
+    
+    try:
+        while True:
+            if (datetime.now() - last_stats_print).total_seconds() >= 300:
+                print_stats()
+                last_stats_print = datetime.now()
+            
+            # 按 stats_save_interval / stats_save_every 写入统计检查点，未到时机时不占用线程池
+            if stats_checkpoint_due():
+                await asyncio.to_thread(save_stats)
+            
+            # 无人在线时只检查在线人数，不轮询云变量
+            if await check_online_sleep(work_id, bool(inbox["pending"])):
+                stats["sleep_ticks"] += 1
+                await wait_for_wakeup(inbox["wakeup"], CONFIG.get("sleep_poll_interval") or 15)
+                continue
+            
+            poll_count += 1
+            stats["total_polls"] = poll_count
+            
+            poll_started = time.monotonic()
+            if queue_mode:
+                # 一个请求取出一批问题，只取队列还放得下的数量，取出的问题不会因队列已满而丢失
+                limit = min(batch_size, inbox["queue"].maxsize - inbox["queue"].qsize())
+                if limit <= 0:
+                    log("DEBUG", f"问题队列已满 ({inbox['queue'].qsize()})，本轮不取出提问列表")
+                    await wait_for_wakeup(inbox["wakeup"], get_poll_interval())
+                    continue
+                var_result = await asyncio.to_thread(drain_questions, work_id, outbox, limit)
+            elif CONFIG.get("slot_count"):
+                # 一个请求读取全部槽位
+                var_result = await asyncio.to_thread(get_all_variables, CONFIG["api_base_url"], work_id)
+            else:
+                var_result = await asyncio.to_thread(get_variable, CONFIG["api_base_url"], work_id, CONFIG["variable_name"])
+            record_latency("poll", time.monotonic() - poll_started)
+            if var_result["success"]:
+                work["last_poll_ok"] = time.time()
+            
+            if not var_result["success"]:
+                consecutive_errors += 1
+                log("ERROR", f"获取变量失败: {var_result.get('message', '未知错误')} (连续失败: {consecutive_errors}/{max_consecutive_errors})")
+                stats["total_errors"] += 1
+                
+                if consecutive_errors >= max_consecutive_errors:
+                    log("WARNING", "连续失败次数过多，尝试重新连接作品...")
+                    stats["reconnects"] += 1
+                    reconnect_result = await asyncio.to_thread(connect_to_work, CONFIG["api_base_url"], work_id)
+                    if reconnect_result["success"]:
+                        conn_data = reconnect_result.get("data", {})
+                        online_users = conn_data.get("onlineUsers", "未知")
+                        log("SUCCESS", f"重新连接成功！在线人数: {online_users}")
+                        write_log(f"自动重连成功 - 在线人数: {online_users}", "SYSTEM")
+                        record_online_users(online_users)
+                        consecutive_errors = 0
+                        reconnect_fail_count = 0
+                    else:
+                        reconnect_fail_count += 1
+                        log("ERROR", f"重新连接失败: {reconnect_result.get('message', '未知错误')} (重连失败: {reconnect_fail_count}/{max_reconnect_fails})")
+                        write_log(f"自动重连失败: {reconnect_result.get('message', '未知错误')}", "SYSTEM")
+                        
+                        if reconnect_fail_count >= max_reconnect_fails:
+                            if MULTI_WORK:
+                                log("ERROR", f"连续重连失败{max_reconnect_fails}次，{WORK_RESTART_DELAY}秒后重启该作品...")
+                                write_log(f"连续重连失败{max_reconnect_fails}次，等待重启该作品", "SYSTEM")
+                            else:
+                                log("ERROR", f"连续重连失败{max_reconnect_fails}次，程序将退出并由PM2自动重启...")
+                                write_log(f"连续重连失败{max_reconnect_fails}次，程序退出等待PM2重启", "SYSTEM")
+                            return False
+                
+                await asyncio.sleep(get_poll_interval())
+                continue
+            
+            consecutive_errors = 0
+            reconnect_fail_count = 0
+            
+            if queue_mode:
+                items = var_result["items"]
+                if items:
+                    stats["list_drains"] += 1
+                    enqueue_list_questions(inbox, outbox, items, f"[轮询#{poll_count}]")
+                    if len(items) >= limit:
+                        # 本次取满了一批，列表中可能还有问题，不等待直接再取
+                        inbox["wakeup"].set()
+                current_value = f"提问列表取出 {len(items)} 项"
+                polled = []
+            elif CONFIG.get("slot_count"):
+                variables = var_result["variables"]
+                for var_name in slot_names:
+                    if var_name not in variables and var_name not in missing_slots:
+                        missing_slots.add(var_name)
+                        log("WARNING", f"作品中没有槽位变量 '{var_name}'，请在作品中创建该云变量")
+                polled = [
+                    (var_name, variables[var_name]["value"], variables[var_name]["type"])
+                    for var_name in slot_names if var_name in variables
+                ]
+                current_value = " / ".join(f"{var_name}={value}" for var_name, value, _ in polled) or None
+            else:
+                current_value = var_result.get("value")
+                polled = [(CONFIG["variable_name"], current_value, var_result.get("type", "public"))]
+            
+            if current_value is not None:
+                poll_log_interval = CONFIG.get("poll_log_interval") or 0
+                if current_value != last_logged_value or time.monotonic() - last_poll_log >= poll_log_interval:
+                    skipped = f" (期间省略 {skipped_poll_logs} 次轮询日志)" if skipped_poll_logs else ""
+                    log("DEBUG", f"[轮询#{poll_count}] 当前值: {current_value}{skipped}")
+                    last_logged_value = current_value
+                    last_poll_log = time.monotonic()
+                    skipped_poll_logs = 0
+                else:
+                    skipped_poll_logs += 1
+            
+            for var_name, value, var_type in polled:
+                is_new_question, question = parse_question(str(value) if value else "")
+                if is_new_question:
+                    enqueue_question(inbox, value, question, var_type, poll_started, f"[轮询#{poll_count}]", var_name)
+            
+            if watch_states and all(watch_state["connected"] for watch_state in watch_states):
+                await wait_for_wakeup(inbox["wakeup"], CONFIG.get("watch_poll_interval") or 30)
+            else:
+                await wait_for_wakeup(inbox["wakeup"], get_poll_interval())
+            
+    except asyncio.CancelledError:
+        print()
+        log("INFO", "收到退出信号，正在退出...")
     except Exception as e:
-        return {"success": False, "error": "EXCEPTION", "message": str(e)}
+        log("ERROR", f"发生未预期的错误: {str(e)}")
+        stats["total_errors"] += 1
+        # 只有收到退出信号才算正常退出，意外错误返回 False，由守护任务重启作品
+        exit_ok = False
+    finally:
+        for worker in workers:
+            worker.cancel()
+        if inbox["pending"]:
+            log("WARNING", f"退出时仍有 {len(inbox['pending'])} 个问题未处理完")
+        
+        stats["end_time"] = datetime.now()
+        if stats["online_periods"] and stats["online_periods"][-1][1] is None:
+            stats["online_periods"][-1][1] = datetime.now()
+        
+        save_stats(force=True)
+        print_stats()
+        
+        write_log(f"程序终止 - 运行时长: {format_uptime(calculate_uptime())}", "SYSTEM")
+    
+    return exit_ok
 
 
-def get_variable(api_base_url: str, work_id: int, var_name: str) -> dict:
+async def supervise_work(work: dict):
     """
-    获取云变量的值（带重试机制）
+    多作品模式下守护单个作品：异常停止后等待一段时间重新启动，不影响其他作品
     
     Args:
-        api_base_url: API基础地址
-        work_id: 作品ID
-        var_name: 变量名
-        
-    Returns:
-        包含变量值的字典
+        work: 作品上下文
     """
-    api_base_url = normalize_api_url(api_base_url)
-    url = f"{api_base_url}/var/get"
-    payload = {"workId": work_id, "name": var_name}
+    _current_work.set(work)
     
-    for attempt in range(CONFIG["max_retries"]):
-        try:
-            response = requests.post(url, json=payload, timeout=CONFIG["request_timeout"])
-            data = response.json()
-            
-            if data.get("success"):
-                var_data = data.get("data", {})
-                return {
-                    "success": True,
-                    "value": var_data.get("value"),
-                    "type": var_data.get("type"),
-                    "name": var_data.get("name")
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": data.get("error", "UNKNOWN_ERROR"),
-                    "message": data.get("message", "获取变量失败")
-                }
-        except requests.exceptions.Timeout:
-            if attempt < CONFIG["max_retries"] - 1:
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "TIMEOUT", "message": "请求超时"}
-        except requests.exceptions.ConnectionError:
-            if attempt < CONFIG["max_retries"] - 1:
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "CONNECTION_ERROR", "message": "无法连接到API服务"}
-        except Exception as e:
-            if attempt < CONFIG["max_retries"] - 1:
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    if not validate_config():
+        log("ERROR", "配置不完整，跳过该作品")
+        return
     
-    return {"success": False, "error": "MAX_RETRIES", "message": "超过最大重试次数"}
+    while True:
+        if await run_work(work):
+            return
+        log("WARNING", f"{WORK_RESTART_DELAY}秒后重新启动该作品...")
+        await asyncio.sleep(WORK_RESTART_DELAY)
 
 
-def set_variable(api_base_url: str, work_id: int, var_name: str, value: str, var_type: str = "public") -> dict:
+# ==================== 监控接口 ====================
+# 可选的 HTTP 监听：/metrics 输出 Prometheus 文本格式指标，/healthz 报告距上次成功轮询的时间
+# 多作品模式下一个进程只监听一个端口，指标以 work 标签区分作品
+
+def escape_label_value(value) -> str:
+    """按 Prometheus 文本格式转义标签值中的反斜杠、双引号和换行（服务商名称、地址来自用户配置）"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_metric_labels(labels: dict) -> str:
+    """格式化指标标签"""
+    return "{" + ",".join(f'{key}="{escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_metrics(works: list) -> str:
     """
-    设置云变量的值（带重试机制）
+    生成 Prometheus 文本格式的指标
     
     Args:
-        api_base_url: API基础地址
-        work_id: 作品ID
-        var_name: 变量名
-        value: 要设置的值
-        var_type: 变量类型 (public/private)
+        works: 作品上下文列表
         
     Returns:
-        操作结果字典
+        指标文本
     """
-    api_base_url = normalize_api_url(api_base_url)
-    url = f"{api_base_url}/var/set"
-    payload = {
-        "workId": work_id,
-        "name": var_name,
-        "value": value,
-        "type": var_type
-    }
+    lines = []
     
-    for attempt in range(CONFIG["max_retries"]):
-        try:
-            response = requests.post(url, json=payload, timeout=CONFIG["request_timeout"])
-            data = response.json()
-            
-            if data.get("success"):
-                return {
-                    "success": True,
-                    "message": data.get("message", "设置成功")
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": data.get("error", "UNKNOWN_ERROR"),
-                    "message": data.get("message", "设置变量失败")
-                }
-        except requests.exceptions.Timeout:
-            if attempt < CONFIG["max_retries"] - 1:
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "TIMEOUT", "message": "请求超时"}
-        except requests.exceptions.ConnectionError:
-            if attempt < CONFIG["max_retries"] - 1:
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "CONNECTION_ERROR", "message": "无法连接到API服务"}
-        except Exception as e:
-            if attempt < CONFIG["max_retries"] - 1:
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    def metric(name: str, metric_type: str, help_text: str, samples: list):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{format_metric_labels(labels)} {value}")
     
-    return {"success": False, "error": "MAX_RETRIES", "message": "超过最大重试次数"}
-
-
-def call_ai_api(question: str) -> dict:
-    """
-    调用AI API获取答复
+    def per_work(getter) -> list:
+        return [({"work": work["work_id"]}, getter(work)) for work in works]
     
-    Args:
-        question: 用户问题
-        
-    Returns:
-        包含AI答复的字典
-    """
-    system_prompt = load_system_prompt()
+    metric("ai_bridge_polls_total", "counter", "云变量轮询次数", per_work(lambda w: w["stats"]["total_polls"]))
+    metric("ai_bridge_questions_total", "counter", "收到的问题数", per_work(lambda w: w["stats"]["total_questions"]))
+    metric("ai_bridge_answers_total", "counter", "答复数（按结果）", [
+        ({"work": work["work_id"], "result": result}, work["stats"][key])
+        for work in works
+        for result, key in (("success", "successful_answers"), ("failed", "failed_answers"))
+    ])
+    metric("ai_bridge_errors_total", "counter", "错误次数", per_work(lambda w: w["stats"]["total_errors"]))
+    metric("ai_bridge_reconnects_total", "counter", "重新连接作品的次数", per_work(lambda w: w["stats"]["reconnects"]))
+    metric("ai_bridge_cache_hits_total", "counter", "答复缓存命中次数", per_work(lambda w: w["stats"]["cache_hits"]))
+    metric("ai_bridge_watch_events_total", "counter", "收到的变化推送事件数", per_work(lambda w: w["stats"]["watch_events"]))
+    metric("ai_bridge_retries_total", "counter", "请求重试次数", per_work(lambda w: w["stats"]["retries"]))
+    metric("ai_bridge_circuit_rejections_total", "counter", "熔断期间直接失败的请求数",
+           per_work(lambda w: w["stats"]["circuit_rejections"]))
     
-    headers = {
-        "Authorization": f"Bearer {CONFIG['ai_api_key']}",
-        "Content-Type": "application/json"
-    }
+    metric("ai_bridge_queue_depth", "gauge", "排队或处理中的问题数",
+           per_work(lambda w: len(w["inbox"]["pending"]) if w.get("inbox") else 0))
+    metric("ai_bridge_poll_interval_seconds", "gauge", "当前轮询间隔",
+           per_work(lambda w: w["stats"]["poll_interval"]["current"]))
+    metric("ai_bridge_online_users", "gauge", "作品在线人数",
+           per_work(lambda w: w["scheduler"]["online_users"] if isinstance(w["scheduler"]["online_users"], int) else 0))
+    metric("ai_bridge_asleep", "gauge", "是否因无人在线而休眠", per_work(lambda w: int(w["scheduler"]["asleep"])))
+    metric("ai_bridge_last_poll_age_seconds", "gauge", "距上次成功轮询的秒数",
+           per_work(lambda w: round(time.time() - w["last_poll_ok"], 3) if w.get("last_poll_ok") else -1))
     
-    payload = {
-        "model": CONFIG["ai_model"],
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": question}
-        ],
-        "temperature": 0.7,
-        "max_tokens": 2000
-    }
+    metric("ai_bridge_provider_requests_total", "counter", "各AI服务商的调用次数（按结果）", [
+        ({"work": work["work_id"], "provider": name, "result": result}, value)
+        for work in works
+        # 工作线程可能同时登记新的服务商，先复制再遍历
+        for name, provider_stats in list(work["stats"]["providers"].items())
+        for result, value in (("success", provider_stats["requests"] - provider_stats["failures"]),
+                              ("failed", provider_stats["failures"]))
+    ])
+    metric("ai_bridge_failovers_total", "counter", "AI服务商切换次数", per_work(lambda w: w["stats"]["failovers"]))
+    metric("ai_bridge_coalesced_total", "counter", "与进行中的相同问题合并、未单独请求AI的次数",
+           per_work(lambda w: w["stats"]["coalesced"]))
+    metric("ai_bridge_rate_limit_waits_total", "counter", "限流等待次数", [
+        ({"work": work["work_id"], "level": level}, item["waits"])
+        for work in works
+        for level, item in work["stats"]["rate_limit"].items()
+    ])
+    metric("ai_bridge_rate_limit_wait_seconds_total", "counter", "限流等待总时间", [
+        ({"work": work["work_id"], "level": level}, round(item["wait_time"], 3))
+        for work in works
+        for level, item in work["stats"]["rate_limit"].items()
+    ])
+    metric("ai_bridge_busy_answers_total", "counter", "因限流答复繁忙提示的次数（已计入失败答复）", per_work(lambda w: w["stats"]["busy_answers"]))
+    metric("ai_bridge_list_drains_total", "counter", "队列模式从提问列表取出问题的批次数", per_work(lambda w: w["stats"]["list_drains"]))
+    metric("ai_bridge_list_questions_total", "counter", "队列模式从提问列表取出的问题数", per_work(lambda w: w["stats"]["list_questions"]))
+    metric("ai_bridge_list_writes_total", "counter", "队列模式写回答复列表的次数", per_work(lambda w: w["stats"]["list_writes"]))
+    metric("ai_bridge_tokens_total", "counter", "AI请求的 token 数（服务商未返回用量时为估算值）", [
+        ({"work": work["work_id"], "kind": kind}, work["stats"]["tokens"][kind])
+        for work in works
+        for kind in ("prompt", "completion", "cached")
+    ])
+    metric("ai_bridge_truncated_answers_total", "counter", "因过长被截断的答复数", per_work(lambda w: w["stats"]["truncated_answers"]))
+    metric("ai_bridge_faq_lookups_total", "counter", "FAQ 检索次数", per_work(lambda w: w["stats"]["faq"]["lookups"]))
+    metric("ai_bridge_faq_hits_total", "counter", "FAQ 命中、未调用AI的次数", per_work(lambda w: w["stats"]["faq"]["hits"]))
+    metric("ai_bridge_faq_score_sum", "counter", "每次 FAQ 检索最高相似度之和（除以检索次数为平均相似度）",
+           per_work(lambda w: round(w["stats"]["faq"]["score_total"], 3)))
+    metric("ai_bridge_ai_batches_total", "counter", "合并多个问题的批量AI请求次数", per_work(lambda w: w["stats"]["ai_batches"]))
+    metric("ai_bridge_batched_questions_total", "counter", "通过批量AI请求处理的问题数", per_work(lambda w: w["stats"]["batched_questions"]))
+    metric("ai_bridge_batch_fallbacks_total", "counter", "批量答复无法解析、回退为单独请求的问题数",
+           per_work(lambda w: w["stats"]["batch_fallbacks"]))
+    metric("ai_bridge_prompt_tokens_saved_total", "counter", "批量请求估算节省的提示词 token 数",
+           per_work(lambda w: w["stats"]["prompt_tokens_saved"]))
+    metric("ai_bridge_hedges_total", "counter", "对冲请求次数（按结果）", [
+        ({"work": work["work_id"], "result": result}, value)
+        for work in works
+        for result, value in (("won", work["stats"]["hedges_won"]),
+                              ("lost", work["stats"]["hedges_sent"] - work["stats"]["hedges_won"]))
+    ])
+    with _provider_lock:
+        provider_samples = [(name, health["latency"], health["error_rate"]) for name, health in _provider_health.items()]
+    metric("ai_bridge_provider_latency_ewma_seconds", "gauge", "AI服务商近期平均延迟 (EWMA)",
+           [({"provider": name}, round(latency, 6)) for name, latency, _ in provider_samples if latency is not None])
+    metric("ai_bridge_provider_error_rate", "gauge", "AI服务商近期错误率 (EWMA)",
+           [({"provider": name}, round(error_rate, 6)) for name, _, error_rate in provider_samples])
     
-    for attempt in range(CONFIG["max_retries"]):
-        try:
-            response = requests.post(
-                CONFIG["ai_api_url"],
-                headers=headers,
-                json=payload,
-                timeout=CONFIG["request_timeout"]
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                choices = data.get("choices", [])
-                if choices:
-                    answer = choices[0].get("message", {}).get("content", "")
-                    return {
-                        "success": True,
-                        "answer": answer,
-                        "model": data.get("model", CONFIG["ai_model"])
-                    }
-                else:
-                    return {"success": False, "error": "EMPTY_RESPONSE", "message": "AI返回空响应"}
-            else:
-                error_data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
-                return {
-                    "success": False,
-                    "error": f"HTTP_{response.status_code}",
-                    "message": error_data.get("error", {}).get("message", f"HTTP错误: {response.status_code}")
-                }
-                
-        except requests.exceptions.Timeout:
-            if attempt < CONFIG["max_retries"] - 1:
-                log("WARNING", f"AI API请求超时，重试中... ({attempt + 1}/{CONFIG['max_retries']})")
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "TIMEOUT", "message": "AI API请求超时"}
-            
-        except requests.exceptions.ConnectionError:
-            if attempt < CONFIG["max_retries"] - 1:
-                log("WARNING", f"无法连接AI API，重试中... ({attempt + 1}/{CONFIG['max_retries']})")
-                time.sleep(2)
-                continue
-            return {"success": False, "error": "CONNECTION_ERROR", "message": "无法连接到AI API"}
-            
-        except Exception as e:
-            return {"success": False, "error": "EXCEPTION", "message": str(e)}
+    with _breaker_lock:
+        breaker_samples = [({"endpoint": url}, {"closed": 0, "half_open": 1, "open": 2}[breaker["state"]])
+                           for url, breaker in _breakers.items()]
+    metric("ai_bridge_circuit_state", "gauge", "接口熔断器状态 (0 正常 / 1 半开 / 2 熔断)", breaker_samples)
+    
+    name = "ai_bridge_latency_seconds"
+    lines.append(f"# HELP {name} 各阶段延迟")
+    lines.append(f"# TYPE {name} histogram")
+    for work in works:
+        for stage, histogram in work["stats"]["latency"].items():
+            labels = {"work": work["work_id"], "stage": stage}
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS_MS, histogram["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_metric_labels({**labels, 'le': f'{bound / 1000:g}'})} {cumulative}")
+            lines.append(f"{name}_bucket{format_metric_labels({**labels, 'le': '+Inf'})} {histogram['count']}")
+            lines.append(f"{name}_sum{format_metric_labels(labels)} {histogram['sum'] / 1000:.6f}")
+            lines.append(f"{name}_count{format_metric_labels(labels)} {histogram['count']}")
     
-    return {"success": False, "error": "MAX_RETRIES", "message": "超过最大重试次数"}
+    return "\n".join(lines) + "\n"
 
 
-def parse_question(value: str) -> tuple:
+def get_health(works: list) -> tuple:
     """
-    解析云变量值，提取问题
+    健康检查：每个作品距上次成功轮询（休眠时为在线检查）不超过 health_max_poll_age 秒
     
-    Args:
-        value: 云变量的值
-        
     Returns:
-        (是否为问题, 问题内容)
+        (是否健康, 详情字典)
     """
-    prefix = CONFIG["question_prefix"]
-    
-    if not value or not isinstance(value, str):
-        return False, None
+    now = time.time()
+    healthy = True
+    details = {}
+    for work in works:
+        max_age = work["config"].get("health_max_poll_age") or 120
+        last_ok = work.get("last_poll_ok")
+        age = round(now - last_ok, 3) if last_ok else None
+        ok = age is not None and age <= max_age
+        healthy = healthy and ok
+        details[str(work["work_id"])] = {
+            "ok": ok,
+            "seconds_since_last_poll": age,
+            "asleep": work["scheduler"]["asleep"],
+            "pending_questions": len(work["inbox"]["pending"]) if work.get("inbox") else 0
+        }
+    return healthy, {"status": "ok" if healthy else "unhealthy", "works": details}
+
+
+def start_metrics_server(works: list, host: str, port: int) -> ThreadingHTTPServer:
+    """
+    在后台线程启动监控 HTTP 服务
     
-    if not value.startswith(prefix):
-        return False, None
+    Returns:
+        服务实例，启动失败时返回 None
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+        
+        def send_body(self, status: int, content_type: str, body: str):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                self.send_body(200, "text/plain; version=0.0.4; charset=utf-8", render_metrics(works))
+            elif path == "/healthz":
+                healthy, details = get_health(works)
+                self.send_body(200 if healthy else 503, "application/json; charset=utf-8",
+                               json.dumps(details, ensure_ascii=False))
+            else:
+                self.send_body(404, "text/plain; charset=utf-8", "not found\n")
     
-    question = value[len(prefix):].strip()
-    return True, question
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        log("ERROR", f"监控接口启动失败 ({host}:{port}): {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ai-bridge-metrics", daemon=True).start()
+    log("SUCCESS", f"监控接口已启动: http://{host}:{port}/metrics  http://{host}:{port}/healthz")
+    return server
 
 
-def validate_config() -> bool:
+async def run_supervisor(works: list) -> bool:
     """
-    验证配置是否完整
+    在同一个事件循环中驱动所有作品，每个作品独立的轮询节奏、配置和统计
     
+    Args:
+        works: 作品上下文列表
+        
     Returns:
-        配置是否有效
+        单作品模式下返回该作品是否正常退出；多作品模式下所有作品停止后返回 True
     """
-    required_fields = ["api_base_url", "ai_api_url", "ai_api_key", "ai_model", "variable_name"]
-    missing = []
-    
-    for field in required_fields:
-        if not CONFIG.get(field):
-            missing.append(field)
+    loop = asyncio.get_running_loop()
+    # 每个作品: 一个轮询线程 + 与问题处理任务数相同的线程（多路复用协议下至少每个槽位一个，
+    # 队列模式下至少每批问题一个，另加答复写回线程）；推送订阅在独立线程中运行，不占用线程池
+    max_workers = sum(get_work_thread_count(work["config"]) for work in works)
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=max(4, max_workers + 2),
+        thread_name_prefix="ai-bridge"
+    ))
     
-    if missing:
-        log("ERROR", f"缺少必要配置项: {', '.join(missing)}")
-        return False
+    metrics_server = None
+    metrics_config = next((work["config"] for work in works if work["config"].get("metrics_port")), None)
+    if metrics_config is not None:
+        metrics_server = start_metrics_server(works, metrics_config.get("metrics_host") or "127.0.0.1", int(metrics_config["metrics_port"]))
     
-    return True
+    keepalive_task = asyncio.create_task(keepalive_loop())
+    try:
+        if not MULTI_WORK:
+            return await run_work(works[0])
+        
+        await asyncio.gather(*(supervise_work(work) for work in works))
+        return True
+    finally:
+        keepalive_task.cancel()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
 
 
 def main():
     """主函数"""
-    global CONFIG, WORK_ID
+    global WORK_ID, MULTI_WORK
     
     parser = argparse.ArgumentParser(
         description='Kitten Cloud API - AI 桥接程序',
@@ -666,6 +4701,8 @@ def main():
   %(prog)s -w 123456 -u http://localhost:9178/api       # 指定API地址
   %(prog)s -w 123456 -c ./ai-bridge/config_123456.py    # 使用配置文件
   %(prog)s -w 123456 --ai-url https://api.xxx.com/v1/chat/completions --ai-key sk-xxx --ai-model gpt-4
+  %(prog)s --works 123456,654321                        # 单进程服务多个作品（读取 ai-bridge/config_<作品ID>.py）
+  %(prog)s --works-dir ./ai-bridge                      # 服务目录下所有作品配置
         """
     )
     
@@ -674,6 +4711,10 @@ def main():
     parser.add_argument('-u', '--api-url', type=str, help='API服务地址（如: http://localhost:9178/api）')
     parser.add_argument('-c', '--config', type=str, help='配置文件路径（如: ./ai-bridge/config_123456.py）')
     
+    # 多作品参数
+    parser.add_argument('--works', type=str, help='多作品模式：作品ID列表，逗号分隔（如: 123456,654321）')
+    parser.add_argument('--works-dir', type=str, help='多作品模式：作品配置目录，服务其中所有 config_<作品ID>.py')
+    
     # AI API 参数
     parser.add_argument('--ai-url', type=str, help='AI API地址（如: https://api.openai.com/v1/chat/completions）')
     parser.add_argument('--ai-key', type=str, help='AI API Key')
@@ -694,6 +4735,37 @@ def main():
     
     print_banner()
     
+    # 多作品模式：每个作品独立配置，全部在一个事件循环中运行
+    if args.works or args.works_dir:
+        try:
+            works = build_multi_works(args)
+        except ValueError as e:
+            log("ERROR", str(e))
+            sys.exit(1)
+        
+        if not works:
+            log("ERROR", "未找到任何作品，请使用 --works 指定作品ID或检查 --works-dir 目录")
+            sys.exit(1)
+        
+        MULTI_WORK = True
+        log("INFO", f"多作品模式，共 {len(works)} 个作品: {', '.join(str(w['work_id']) for w in works)}")
+        
+        if args.show_config:
+            for work in works:
+                _current_work.set(work)
+                print_config()
+            sys.exit(0)
+        
+        try:
+            asyncio.run(run_supervisor(works))
+        except KeyboardInterrupt:
+            pass
+        
+        log("INFO", "程序已退出")
+        print()
+        print("=" * 60)
+        return
+    
     # 1. 先加载配置文件（如果指定）
     if args.config:
         if load_config_from_file(args.config):
@@ -702,24 +4774,7 @@ def main():
             log("WARNING", f"无法加载配置文件: {args.config}")
     
     # 2. 命令行参数覆盖配置文件
-    if args.api_url:
-        CONFIG["api_base_url"] = args.api_url
-    if args.ai_url:
-        CONFIG["ai_api_url"] = args.ai_url
-    if args.ai_key:
-        CONFIG["ai_api_key"] = args.ai_key
-    if args.ai_model:
-        CONFIG["ai_model"] = args.ai_model
-    if args.var_name:
-        CONFIG["variable_name"] = args.var_name
-    if args.question_prefix:
-        CONFIG["question_prefix"] = args.question_prefix
-    if args.answer_prefix:
-        CONFIG["answer_prefix"] = args.answer_prefix
-    if args.log_dir:
-        CONFIG["log_dir"] = args.log_dir
-    if args.prompt_file:
-        CONFIG["system_prompt_file"] = args.prompt_file
+    apply_cli_overrides(args, CONFIG)
     
     # 3. 显示配置模式
     if args.show_config:
@@ -795,155 +4850,20 @@ def main():
     print_config()
     print()
     
-    # 8. 连接作品
-    log("INFO", f"正在连接作品 {work_id}...")
-    
-    connect_result = connect_to_work(CONFIG["api_base_url"], work_id)
-    if not connect_result["success"]:
-        log("ERROR", f"连接失败: {connect_result.get('message', '未知错误')}")
-        sys.exit(1)
-    
-    conn_data = connect_result.get("data", {})
-    online_users = conn_data.get("onlineUsers", "未知")
-    log("SUCCESS", f"连接成功！在线人数: {online_users}")
-    print()
-    
-    stats["start_time"] = datetime.now()
-    stats["online_periods"].append([datetime.now(), None])
+    # 8. 连接作品并开始轮询
+    work = create_work(work_id, CONFIG.copy())
     
-    write_log(f"程序启动 - 作品ID: {work_id}", "SYSTEM")
-    write_log(f"连接成功 - 在线人数: {online_users}", "SYSTEM")
+    try:
+        success = asyncio.run(run_supervisor([work]))
+    except KeyboardInterrupt:
+        success = True
     
-    log("INFO", f"开始轮询云变量 '{CONFIG['variable_name']}'...")
-    log("INFO", "轮询间隔: 白天3秒 / 晚上5秒 / 凌晨10秒")
-    log("INFO", "按 Ctrl+C 退出程序")
-    log("INFO", f"日志文件: {get_log_file_path()}")
-    log("INFO", f"统计文件: {get_stats_file_path()}")
+    log("INFO", "程序已退出")
     print()
+    print("=" * 60)
     
-    poll_count = 0
-    last_stats_print = datetime.now()
-    consecutive_errors = 0
-    max_consecutive_errors = 3
-    reconnect_fail_count = 0
-    max_reconnect_fails = 3
-    
-    try:
-        while True:
-            poll_count += 1
-            stats["total_polls"] = poll_count
-            
-            var_result = get_variable(CONFIG["api_base_url"], work_id, CONFIG["variable_name"])
-            
-            if not var_result["success"]:
-                consecutive_errors += 1
-                log("ERROR", f"获取变量失败: {var_result.get('message', '未知错误')} (连续失败: {consecutive_errors}/{max_consecutive_errors})")
-                stats["total_errors"] += 1
-                
-                if consecutive_errors >= max_consecutive_errors:
-                    log("WARNING", "连续失败次数过多，尝试重新连接作品...")
-                    reconnect_result = connect_to_work(CONFIG["api_base_url"], work_id)
-                    if reconnect_result["success"]:
-                        conn_data = reconnect_result.get("data", {})
-                        online_users = conn_data.get("onlineUsers", "未知")
-                        log("SUCCESS", f"重新连接成功！在线人数: {online_users}")
-                        write_log(f"自动重连成功 - 在线人数: {online_users}", "SYSTEM")
-                        consecutive_errors = 0
-                        reconnect_fail_count = 0
-                    else:
-                        reconnect_fail_count += 1
-                        log("ERROR", f"重新连接失败: {reconnect_result.get('message', '未知错误')} (重连失败: {reconnect_fail_count}/{max_reconnect_fails})")
-                        write_log(f"自动重连失败: {reconnect_result.get('message', '未知错误')}", "SYSTEM")
-                        
-                        if reconnect_fail_count >= max_reconnect_fails:
-                            log("ERROR", f"连续重连失败{max_reconnect_fails}次，程序将退出并由PM2自动重启...")
-                            write_log(f"连续重连失败{max_reconnect_fails}次，程序退出等待PM2重启", "SYSTEM")
-                            save_stats()
-                            sys.exit(1)
-                
-                time.sleep(get_poll_interval())
-                continue
-            
-            consecutive_errors = 0
-            reconnect_fail_count = 0
-            
-            current_value = var_result.get("value")
-            var_type = var_result.get("type", "public")
-            
-            if current_value is not None:
-                log("DEBUG", f"[轮询#{poll_count}] 当前值: {current_value}")
-            
-            is_new_question, question = parse_question(str(current_value) if current_value else "")
-            
-            if not is_new_question:
-                if (datetime.now() - last_stats_print).total_seconds() >= 300:
-                    print_stats()
-                    save_stats()
-                    last_stats_print = datetime.now()
-                time.sleep(get_poll_interval())
-                continue
-            
-            log("INFO", f"[轮询#{poll_count}] 检测到新问题，停止轮询计时，开始处理...")
-            log("INFO", f"原始值: {current_value}")
-            log("INFO", f"提取问题: {question}")
-            
-            stats["total_questions"] += 1
-            
-            call_start_time = time.time()
-            
-            log("INFO", "正在调用AI API...")
-            ai_result = call_ai_api(question)
-            
-            call_duration = time.time() - call_start_time
-            
-            if not ai_result["success"]:
-                error_msg = ai_result.get("message", "未知错误")
-                log("ERROR", f"AI API调用失败: {error_msg}")
-                answer = f"[AI调用失败: {error_msg}]"
-                stats["failed_answers"] += 1
-                write_call_record(question, answer, False, call_duration)
-            else:
-                answer = ai_result["answer"]
-                log("SUCCESS", f"AI答复: {answer}")
-                stats["successful_answers"] += 1
-                write_call_record(question, answer, True, call_duration)
-            
-            response_value = f"{CONFIG['answer_prefix']}{answer}"
-            
-            log("INFO", f"正在设置变量值为: {response_value[:50]}{'...' if len(response_value) > 50 else ''}")
-            
-            set_result = set_variable(CONFIG["api_base_url"], work_id, CONFIG["variable_name"], response_value, var_type)
-            
-            if set_result["success"]:
-                log("SUCCESS", "变量设置成功")
-            else:
-                log("ERROR", f"变量设置失败: {set_result.get('message', '未知错误')}")
-                stats["total_errors"] += 1
-            
-            log("INFO", "回复完成，立即重新开始轮询...")
-            print()
-            
-            save_stats()
-            
-    except KeyboardInterrupt:
-        print()
-        log("INFO", "收到退出信号，正在退出...")
-    except Exception as e:
-        log("ERROR", f"发生未预期的错误: {str(e)}")
-        stats["total_errors"] += 1
-    finally:
-        stats["end_time"] = datetime.now()
-        if stats["online_periods"] and stats["online_periods"][-1][1] is None:
-            stats["online_periods"][-1][1] = datetime.now()
-        
-        save_stats()
-        print_stats()
-        
-        write_log(f"程序终止 - 运行时长: {format_uptime(calculate_uptime())}", "SYSTEM")
-        
-        log("INFO", "程序已退出")
-        print()
-        print("=" * 60)
+    if not success:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -441,4 +441,42 @@ router.post('/setAll', async (req: Request, res: Response): Promise<void> => {
   }
 })
 
+router.post('/drain', async (req: Request, res: Response): Promise<void> => {
+  try {
+    const { workId, name, limit } = req.body
+    
+    if (!validateWorkId(workId)) {
+      return sendInvalidParamError(res, 'workId')
+    }
+    
+    if (!validateRequiredString(name)) {
+      return sendInvalidParamError(res, 'name')
+    }
+    
+    if (validateRequiredValue(limit) && !validateNonNegativeNumber(limit)) {
+      return sendInvalidParamError(res, 'limit')
+    }
+    
+    const list = await getList(workId, name)
+    const count = validateRequiredValue(limit) ? Math.min(Math.floor(limit), list.length) : list.length
+    const items: unknown[] = []
+    
+    for (let i = 0; i < count && list.length > 0; i++) {
+      items.push(list.get(0))
+      await list.remove(0)
+    }
+    
+    res.json({
+      success: true,
+      data: {
+        items,
+        newLength: list.length
+      },
+      message: '取出成功'
+    })
+  } catch (error) {
+    sendInternalError(res, error, '取出失败')
+  }
+})
+
 export default router
@@ -1,10 +1,87 @@
 import { Router, Request, Response } from 'express'
 import { ConnectionManager } from '../core/connection-manager'
-import { KittenCloudVariable } from 'kitten-cloud-function'
+import { KittenCloudVariable, KittenCloudVariableChangeMessageObject } from 'kitten-cloud-function'
 import { isValidWorkId, isValidString, hasValue } from '../utils/validation'
 
 const router = Router()
 
+const WATCH_HEARTBEAT_INTERVAL = 15000
+
+router.get('/watch/:workId/:name', async (req: Request, res: Response): Promise<void> => {
+  try {
+    const workId = parseInt(req.params.workId, 10)
+    const name = req.params.name
+    
+    if (!isValidWorkId(workId)) {
+      res.status(400).json({
+        success: false,
+        error: 'INVALID_PARAMS',
+        message: 'workId 参数无效，必须为正整数'
+      })
+      return
+    }
+    
+    const connection = await ConnectionManager.ensureConnection(workId)
+    
+    let variable: KittenCloudVariable
+    let type = 'unknown'
+    
+    try {
+      variable = await connection.publicVariable.get(name)
+      type = 'public'
+    } catch {
+      try {
+        variable = await connection.privateVariable.get(name)
+        type = 'private'
+      } catch {
+        res.status(404).json({
+          success: false,
+          error: 'VARIABLE_NOT_FOUND',
+          message: `变量 ${name} 不存在`
+        })
+        return
+      }
+    }
+    
+    res.writeHead(200, {
+      'Content-Type': 'text/event-stream; charset=utf-8',
+      'Cache-Control': 'no-cache',
+      'Connection': 'keep-alive',
+      'X-Accel-Buffering': 'no'
+    })
+    
+    const send = (event: string, value: unknown): void => {
+      res.write(`event: ${event}\ndata: ${JSON.stringify({ name, value, type })}\n\n`)
+    }
+    
+    send('snapshot', variable.get())
+    
+    const onChanged = (message: KittenCloudVariableChangeMessageObject): void => {
+      send('change', message.newValue)
+    }
+    variable.changed.connect(onChanged)
+    
+    const heartbeat = setInterval((): void => {
+      res.write(': ping\n\n')
+    }, WATCH_HEARTBEAT_INTERVAL)
+    
+    req.on('close', (): void => {
+      clearInterval(heartbeat)
+      variable.changed.disconnect(onChanged)
+    })
+  } catch (error) {
+    if (res.headersSent) {
+      res.end()
+      return
+    }
+    res.status(500).json({
+      success: false,
+      error: 'INTERNAL_ERROR',
+      message: error instanceof Error ? error.message : '订阅变量失败'
+    })
+  }
+})
+
 router.get('/:workId/:name', async (req: Request, res: Response): Promise<void> => {
   try {
     const workId = parseInt(req.params.workId, 10)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""测试公共设置：导入桥接程序和 benchmarks 中的替身服务"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import pytest
+
+import kitten_ai_bridge as bridge
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state():
+    """清空进程内共享的路由、熔断、限流和统计检查点状态，测试之间互不影响"""
+    yield
+    for registry in (bridge._provider_health, bridge._breakers, bridge._rate_buckets, bridge._inflight, bridge._batches,
+                     bridge._stats_checkpoints):
+        registry.clear()
+
+
+@pytest.fixture
+def use_work(tmp_path):
+    """
+    在当前线程进入一个作品上下文，返回作品字典
+
+    用法: work = use_work({"ai_model": "m1"})
+    """
+    tokens = []
+
+    def enter(config: dict = None, work_id: int = 100001) -> dict:
+        work_config = dict(bridge.DEFAULT_CONFIG)
+        work_config.update({"log_dir": str(tmp_path), "log_level": "ERROR"})
+        work_config.update(config or {})
+        work = bridge.create_work(work_id, work_config)
+        tokens.append(bridge._current_work.set(work))
+        return work
+
+    yield enter
+    for token in reversed(tokens):
+        bridge._current_work.reset(token)
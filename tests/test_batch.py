@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""批量请求测试"""
+
+import time
+import contextvars
+import threading
+
+import pytest
+
+import kitten_ai_bridge as bridge
+from stub_openai import StubOpenAI, make_answer
+
+AI_LATENCY = 0.5
+
+
+@pytest.fixture
+def ai():
+    stub = StubOpenAI(latency=AI_LATENCY, seed=1).start()
+    yield stub
+    stub.stop()
+
+
+def ask_together(questions: list) -> list:
+    """每个问题一个线程，同时调用 call_ai_api_batched，抛出的异常作为该问题的结果"""
+    results = [None] * len(questions)
+
+    def ask(index):
+        try:
+            results[index] = bridge.call_ai_api_batched(questions[index])
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=contextvars.copy_context().run, args=(ask, i)) for i in range(len(questions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_unparsed_batch_answers_fall_back_in_parallel(ai, tmp_path, monkeypatch):
+    config = dict(bridge.DEFAULT_CONFIG)
+    config.update({"ai_api_url": ai.url, "ai_api_key": "test", "log_dir": str(tmp_path), "log_level": "ERROR",
+                   "ai_batch_size": 4, "ai_batch_window": 0.2})
+    token = bridge._current_work.set(bridge.create_work(100001, config))
+    # 模拟模型没有按格式返回：只有第一个问题能从批量答复中解析出来
+    parse = bridge.parse_batch_answers
+    monkeypatch.setattr(bridge, "parse_batch_answers",
+                        lambda text, count: parse(text, count)[:1] + [None] * (count - 1))
+    try:
+        questions = [f"批量问题{i}" for i in range(4)]
+        started = time.monotonic()
+        results = ask_together(questions)
+        elapsed = time.monotonic() - started
+    finally:
+        bridge._current_work.reset(token)
+
+    assert [result["answer"] for result in results] == [make_answer(question) for question in questions]
+    assert ai.counters["requests"] == 4
+    # 一次批量请求 + 一轮并行的单独请求；串行补答时需要 4 倍AI延迟
+    assert elapsed < 0.2 + AI_LATENCY * 3
+
+
+def test_saved_prompt_tokens_never_negative(ai, tmp_path, monkeypatch, use_work):
+    work = use_work({"ai_api_url": ai.url, "ai_api_key": "test", "ai_batch_size": 4, "ai_batch_window": 0.2})
+    # 整批都无法解析时批量请求没有节省任何 token
+    monkeypatch.setattr(bridge, "parse_batch_answers", lambda text, count: [None] * count)
+    results = bridge.send_question_batch([f"批量问题{i}" for i in range(4)])
+    assert results == [None] * 4
+    assert work["stats"]["prompt_tokens_saved"] == 0
+
+
+def test_unfinished_batch_results_are_separate(ai, use_work, monkeypatch):
+    use_work({"ai_batch_size": 3, "ai_batch_window": 1})
+
+    def broken_batch(questions):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(bridge, "send_question_batch", broken_batch)
+    results = [result for result in ask_together([f"批量问题{i}" for i in range(3)]) if isinstance(result, dict)]
+    # 发出请求的线程抛出异常，等待的线程各自拿到失败结果，互不共享同一个字典
+    assert len(results) == 2
+    assert all(result["error"] == "EXCEPTION" for result in results)
+    assert results[0] is not results[1]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""答复缓存键和合并键测试"""
+
+import pytest
+
+import kitten_ai_bridge as bridge
+
+
+def keys(**config):
+    """在指定配置的作品上下文中计算缓存键和合并键"""
+    work_config = dict(bridge.DEFAULT_CONFIG)
+    work_config.update({"ai_api_url": "http://ai.test/v1/chat/completions", "ai_model": "m1"})
+    work_config.update(config)
+    token = bridge._current_work.set(bridge.create_work(100001, work_config))
+    try:
+        return bridge.get_answer_cache_key("你好"), bridge.get_single_flight_key("你好")
+    finally:
+        bridge._current_work.reset(token)
+
+
+@pytest.mark.parametrize("config", [
+    {"ai_temperature": 0},
+    {"ai_max_tokens": 100},
+    {"answer_max_chars": 50},
+    {"ai_providers": [{"url": "http://ai.test/v1/chat/completions", "model": "m2"}]},
+])
+def test_generation_settings_change_keys(config):
+    cache_key, flight_key = keys()
+    other_cache_key, other_flight_key = keys(**config)
+    assert other_cache_key != cache_key
+    assert other_flight_key != flight_key
+
+
+def test_same_settings_share_keys():
+    assert keys() == keys()
+    # 服务商未指定模型时使用 ai_model，实际模型相同则缓存键相同
+    assert keys()[0] == keys(ai_providers=[{"url": "http://ai.test/v1/chat/completions"}])[0]
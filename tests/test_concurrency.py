@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+并发测试：在进程内运行桥接程序，连接本地替身服务，检查多名玩家的问题是否并行答复
+"""
+
+import time
+import asyncio
+
+import pytest
+
+import kitten_ai_bridge as bridge
+from stub_kitten_api import StubKittenApi
+from stub_openai import StubOpenAI, make_answer
+
+WORK_ID = 100001
+AI_LATENCY = 1.0
+
+
+@pytest.fixture
+def stubs():
+    kitten = StubKittenApi(heartbeat=1).start()
+    ai = StubOpenAI(latency=AI_LATENCY, seed=1).start()
+    yield kitten, ai
+    kitten.stop()
+    ai.stop()
+
+
+def make_work(kitten, ai, tmp_path, config: dict) -> dict:
+    """创建连接替身服务的作品上下文"""
+    work_config = dict(bridge.DEFAULT_CONFIG)
+    work_config.update({
+        "api_base_url": kitten.base_url,
+        "ai_api_url": ai.url,
+        "ai_api_key": "test",
+        "log_dir": str(tmp_path),
+        "log_level": "ERROR",
+        "poll_interval_min": 0.2,
+        "poll_interval_max": 0.2,
+        "online_check_interval": 0
+    })
+    work_config.update(config)
+    return bridge.create_work(WORK_ID, work_config)
+
+
+def run_bridge(kitten, ai, tmp_path, config: dict, players):
+    """
+    在进程内运行一个作品，连接成功后在独立线程中执行 players(kitten)，返回其结果
+    """
+    work = make_work(kitten, ai, tmp_path, config)
+
+    def act():
+        deadline = time.monotonic() + 10
+        while kitten.counters["connect"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # 等待首轮轮询和推送订阅建立
+        time.sleep(0.5)
+        return players(kitten)
+
+    async def main():
+        task = asyncio.create_task(bridge.run_supervisor([work]))
+        try:
+            return await bridge.run_in_thread(act)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    return asyncio.run(main())
+
+
+def ask_slots(kitten, count: int, timeout: float = 10) -> float:
+    """所有槽位同时提问，返回全部答复完成的耗时（超时返回 None）"""
+    started = time.monotonic()
+    for slot in range(1, count + 1):
+        kitten.set_variable(WORK_ID, f"API{slot}", f"QWQ~~~r{slot}|问题{slot}")
+    for slot in range(1, count + 1):
+        expected = f"OKOKOK~~~r{slot}|{make_answer(f'问题{slot}')}"
+        if kitten.wait_for_variable(WORK_ID, f"API{slot}", lambda v: v == expected,
+                                    timeout - (time.monotonic() - started)) is None:
+            return None
+    return time.monotonic() - started
+
+
+@pytest.mark.parametrize("watch_mode", [False, True])
+def test_slots_are_answered_in_parallel(stubs, tmp_path, watch_mode):
+    kitten, ai = stubs
+    elapsed = run_bridge(kitten, ai, tmp_path, {"slot_count": 8, "watch_mode": watch_mode},
+                         lambda k: ask_slots(k, 8))
+    assert elapsed is not None, "槽位问题未在超时前答复"
+    # 8 个问题并行处理时总耗时接近一次AI调用，串行或线程不足时会成倍增加
+    assert elapsed < AI_LATENCY * 2.5
+    if watch_mode:
+        assert kitten.counters["watch"] >= 8
+
+
+def ask_queue(kitten, count: int, timeout: float = 10) -> float:
+    """一次向提问列表追加 count 个问题，返回答复列表写齐的耗时（超时返回 None）"""
+    expected = {f"OKOKOK~~~q{i}|{make_answer(f'队列问题{i}')}" for i in range(count)}
+    started = time.monotonic()
+    for i in range(count):
+        kitten.push_list_item(WORK_ID, "提问", f"QWQ~~~q{i}|队列问题{i}")
+    if kitten.wait_for_list(WORK_ID, "提问答复", lambda items: expected <= set(items), timeout) is None:
+        return None
+    return time.monotonic() - started
+
+
+def test_queue_batch_is_answered_in_parallel(stubs, tmp_path):
+    kitten, ai = stubs
+    elapsed = run_bridge(kitten, ai, tmp_path, {"queue_list": "提问", "queue_batch_size": 10},
+                         lambda k: ask_queue(k, 10))
+    assert elapsed is not None, "队列问题未在超时前答复"
+    # 一批 10 个问题应同时调用AI，而不是受线程池大小限制分几轮完成
+    assert elapsed < AI_LATENCY * 2.5
+
+
+def test_unexpected_error_is_not_a_clean_exit(stubs, tmp_path, monkeypatch):
+    kitten, ai = stubs
+
+    def broken_get_variable(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(bridge, "get_variable", broken_get_variable)
+    work = make_work(kitten, ai, tmp_path, {})
+    # 意外错误返回 False，守护任务据此重启作品，单作品模式以非零状态退出
+    assert asyncio.run(asyncio.wait_for(bridge.run_supervisor([work]), 10)) is False
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""配置文件加载测试"""
+
+import kitten_ai_bridge as bridge
+
+
+def write_config(tmp_path, name: str, text: str) -> str:
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_explicit_zero_values_are_loaded(tmp_path):
+    path = write_config(tmp_path, "config.py",
+                        'CONFIG = {"online_check_interval": 0, "ai_temperature": 0, "watch_mode": False}\n')
+    config = dict(bridge.DEFAULT_CONFIG, watch_mode=True)
+    assert bridge.load_config_from_file(path, config)
+    assert config["online_check_interval"] == 0
+    assert config["ai_temperature"] == 0
+    assert config["watch_mode"] is False
+
+
+def test_unset_values_keep_shared_config(tmp_path):
+    shared = write_config(tmp_path, "shared.py", 'CONFIG = {"ai_api_key": "sk-shared", "ai_model": "m1"}\n')
+    work = write_config(tmp_path, "config_1.py", 'CONFIG = {"ai_api_key": "", "ai_model": None}\n')
+    config = dict(bridge.DEFAULT_CONFIG)
+    assert bridge.load_config_from_file(shared, config)
+    assert bridge.load_config_from_file(work, config)
+    assert config["ai_api_key"] == "sk-shared"
+    assert config["ai_model"] == "m1"
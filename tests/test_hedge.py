@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""对冲请求测试：胜出方、hedge 字段、首字延迟修正和落败方的处理"""
+
+import time
+import threading
+
+import pytest
+
+import kitten_ai_bridge as bridge
+from stub_openai import StubOpenAI, make_answer
+
+HEDGE_DELAY = 0.3
+
+
+@pytest.fixture
+def slow():
+    """每个请求都卡住的服务商"""
+    stub = StubOpenAI(latency=0.05, ttft=0.05, stall_rate=1.0, stall_time=5, seed=1).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def fast():
+    stub = StubOpenAI(latency=0.05, ttft=0.05, token_interval=0.01, seed=1).start()
+    yield stub
+    stub.stop()
+
+
+def hedge_config(slow, fast, **config) -> dict:
+    config.update({
+        "hedge_mode": True,
+        "hedge_delay": HEDGE_DELAY,
+        "ai_providers": [{"name": "slow", "url": slow.url, "key": "slow"},
+                         {"name": "fast", "url": fast.url, "key": "fast"}]
+    })
+    return config
+
+
+def wait_for_threads(prefix: str, timeout: float) -> bool:
+    """等待名称以 prefix 开头的线程全部结束"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not any(thread.name.startswith(prefix) for thread in threading.enumerate()):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.parametrize("stream_mode", [False, True])
+def test_hedge_wins_over_stalled_provider(use_work, slow, fast, stream_mode):
+    work = use_work(hedge_config(slow, fast, stream_mode=stream_mode))
+    started = time.monotonic()
+    result = bridge.call_ai_api("你好")
+    elapsed = time.monotonic() - started
+
+    assert result["success"]
+    assert result["answer"] == make_answer("你好")
+    assert result["provider"] == "fast"
+    assert result["hedge"] == "won"
+    assert elapsed < 2
+    assert work["stats"]["hedges_sent"] == 1
+    assert work["stats"]["hedges_won"] == 1
+    if stream_mode:
+        # 首字延迟从主请求发出时算起，包含等待对冲的时间
+        assert result["ttft"] >= HEDGE_DELAY
+    # 落败方的连接被关闭，线程随即结束，而不是等到服务商超时
+    assert wait_for_threads("ai-bridge-primary", 2)
+    # 落败不计为错误
+    summary = bridge.get_provider_summary()
+    assert summary["slow"]["failures"] == 0
+    assert bridge.get_breaker(slow.url)["state"] == "closed"
+
+
+def test_primary_wins_before_hedge_delay(use_work, slow, fast):
+    work = use_work(hedge_config(slow, fast))
+    # fast 排在前面时主请求在对冲延迟之前返回，不发出对冲请求
+    work["config"]["ai_providers"].reverse()
+    result = bridge.call_ai_api("你好")
+    assert result["success"] and result["provider"] == "fast"
+    assert "hedge" not in result
+    assert work["stats"]["hedges_sent"] == 0
+
+
+def test_cancelled_loser_that_failed_is_recorded_as_error(use_work):
+    broken = StubOpenAI(latency=0.05, ttft=0.05, error_rate=1.0, seed=1).start()
+    try:
+        use_work({"ai_providers": [{"name": "broken", "url": broken.url, "key": "test"}], "max_retries": 1})
+        cancelled = threading.Event()
+        cancelled.set()
+        result = bridge.call_providers(bridge.get_ai_providers(), "你好", cancelled=cancelled)
+    finally:
+        broken.stop()
+
+    assert result["error"] == "CANCELLED"
+    # 对冲中落败但实际已经失败的请求照常计入错误率
+    summary = bridge.get_provider_summary()
+    assert summary["broken"]["failures"] == 1
+    assert summary["broken"]["error_rate"] > 0
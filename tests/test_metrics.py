@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""监控指标测试"""
+
+import re
+
+import kitten_ai_bridge as bridge
+
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\\n]|\\[\\"n])*",?)*\})? \S+$')
+
+
+def test_label_values_are_escaped(use_work):
+    name = 'a"b\\c\nd'
+    work = use_work({"ai_providers": [{"name": name, "url": "http://ai.test/v1/chat/completions", "key": "k"}]})
+    bridge.record_provider_result(bridge.get_ai_providers()[0], True, 0.5)
+
+    text = bridge.render_metrics([work])
+
+    assert 'provider="a\\"b\\\\c\\nd"' in text
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            assert SAMPLE_LINE.match(line), line
+
+
+def test_format_metric_labels():
+    assert bridge.format_metric_labels({"work": 1, "url": 'x"\\'}) == '{work="1",url="x\\"\\\\"}'
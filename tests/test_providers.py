@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""AI 服务商路由测试：排序、切换和按服务商统计"""
+
+import time
+
+import pytest
+
+import kitten_ai_bridge as bridge
+from stub_openai import StubOpenAI, make_answer
+
+
+def provider(name: str, url: str = None, weight: float = 1) -> dict:
+    return {"name": name, "url": url or f"http://{name}.test/v1/chat/completions", "key": "test",
+            "model": "m1", "weight": weight}
+
+
+def set_health(name: str, latency: float, error_rate: float = 0.0, age: float = 0.0):
+    bridge._provider_health[name] = {"latency": latency, "error_rate": error_rate, "updated": time.monotonic() - age}
+
+
+def ranked_names(providers: list) -> list:
+    return [item["name"] for item in bridge.rank_providers(providers)]
+
+
+@pytest.fixture
+def providers(use_work):
+    items = [provider("a"), provider("b"), provider("c")]
+    use_work({"ai_providers": items})
+    return bridge.get_ai_providers()
+
+
+def test_faster_provider_is_ranked_first(providers):
+    set_health("a", 2.0)
+    set_health("b", 0.5)
+    set_health("c", 1.0)
+    assert ranked_names(providers) == ["b", "c", "a"]
+
+
+def test_errors_and_weight_affect_rank(providers):
+    set_health("a", 0.5, error_rate=0.5)
+    set_health("b", 1.0)
+    set_health("c", 1.0)
+    providers[2]["weight"] = 4
+    assert ranked_names(providers) == ["c", "b", "a"]
+
+
+def test_stale_failing_provider_is_not_ranked_first(providers):
+    # a 一直失败（平均延迟被拉到超时时间），很久没有被调用也不能排到健康的服务商前面
+    set_health("a", 30.0, error_rate=1.0, age=bridge.PROVIDER_PROBE_INTERVAL * 2)
+    set_health("b", 0.5)
+    set_health("c", 1.0)
+    ranked = ranked_names(providers)
+    assert ranked[0] == "b"
+    assert ranked.index("a") > 0
+
+
+def test_stale_score_decays_toward_median(providers):
+    set_health("b", 0.5)
+    set_health("c", 1.0)
+    set_health("a", 30.0, error_rate=1.0, age=bridge.PROVIDER_PROBE_INTERVAL * 20)
+    # 足够久之后 a 回到中位数附近，排在较慢的 c 之前，可以重新被尝试
+    assert ranked_names(providers) == ["b", "a", "c"]
+
+
+def test_providers_without_data_keep_config_order(providers):
+    assert ranked_names(providers) == ["a", "b", "c"]
+
+
+def test_open_breaker_is_ranked_last(providers):
+    set_health("a", 0.1)
+    breaker = bridge.get_breaker(providers[0]["url"])
+    breaker["state"] = "open"
+    breaker["opened_at"] = time.monotonic()
+    assert ranked_names(providers)[-1] == "a"
+
+
+def test_failover_records_per_provider_stats(use_work):
+    broken = StubOpenAI(latency=0.05, ttft=0.05, error_rate=1.0, seed=1).start()
+    healthy = StubOpenAI(latency=0.05, seed=1).start()
+    try:
+        work = use_work({"ai_providers": [{"name": "broken", "url": broken.url, "key": "test"},
+                                          {"name": "healthy", "url": healthy.url, "key": "test"}]})
+        result = bridge.call_ai_api("你好")
+    finally:
+        broken.stop()
+        healthy.stop()
+
+    assert result["success"]
+    assert result["answer"] == make_answer("你好")
+    assert result["provider"] == "healthy"
+    assert work["stats"]["failovers"] == 1
+    # 有其他服务商可以切换时不在失败的服务商上重试
+    assert broken.counters["requests"] == 1
+    summary = bridge.get_provider_summary()
+    assert summary["broken"]["requests"] == 1 and summary["broken"]["failures"] == 1
+    assert summary["healthy"]["requests"] == 1 and summary["healthy"]["failures"] == 0
+    assert summary["healthy"]["avg_latency_ms"] > 0
+    # 失败后 broken 排到 healthy 之后
+    assert [item["name"] for item in bridge.rank_providers(bridge.get_ai_providers())] == ["healthy", "broken"]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""限流测试：令牌桶、最长等待和繁忙提示"""
+
+import time
+
+import pytest
+
+import kitten_ai_bridge as bridge
+
+
+def make_bucket(rate: float, burst: int) -> dict:
+    return {"rate": rate, "burst": burst, "tokens": float(burst), "updated": time.monotonic()}
+
+
+def test_bucket_allows_burst_then_reserves_future_tokens():
+    bucket = make_bucket(rate=10, burst=2)
+    assert bridge.reserve_token(bucket) == 0
+    assert bridge.reserve_token(bucket) == 0
+    # 令牌用完后按速率预订未来的令牌，先到先得
+    assert bridge.reserve_token(bucket) == pytest.approx(0.1, abs=0.02)
+    assert bridge.reserve_token(bucket) == pytest.approx(0.2, abs=0.02)
+
+
+def test_bucket_refills_up_to_burst():
+    bucket = make_bucket(rate=10, burst=2)
+    bucket["tokens"] = 0
+    bucket["updated"] = time.monotonic() - 10
+    assert bridge.reserve_token(bucket) == 0
+    assert bucket["tokens"] == pytest.approx(1, abs=0.01)
+
+
+def test_reserve_token_respects_max_wait():
+    bucket = make_bucket(rate=1, burst=1)
+    assert bridge.reserve_token(bucket, max_wait=0) == 0
+    # 需要等待约 1 秒，超过 max_wait 时不预订
+    assert bridge.reserve_token(bucket, max_wait=0.5) is None
+    assert bucket["tokens"] == pytest.approx(0, abs=0.01)
+    assert bridge.reserve_token(bucket, max_wait=2) == pytest.approx(1, abs=0.05)
+
+
+def test_wait_rate_limit_waits_and_records_stats(use_work):
+    work = use_work({"work_rate_limit": 600, "work_rate_burst": 1})
+    assert bridge.wait_rate_limit("work", "1")
+    started = time.monotonic()
+    assert bridge.wait_rate_limit("work", "1")
+    assert time.monotonic() - started == pytest.approx(0.1, abs=0.05)
+    assert work["stats"]["rate_limit"]["work"]["waits"] == 1
+    # 超过最长等待时间时不取得令牌
+    assert not bridge.wait_rate_limit("work", "1", max_wait=0)
+
+
+def test_wait_rate_limit_disabled(use_work):
+    use_work({"work_rate_limit": 0})
+    assert bridge.get_rate_bucket("work", "1") is None
+    assert all(bridge.wait_rate_limit("work", "1", max_wait=0) for _ in range(100))
+
+
+def test_busy_message_answers_when_rate_limited(use_work):
+    work = use_work({"work_rate_limit": 1, "work_rate_burst": 1, "busy_message": "太忙了",
+                     "rate_limit_wait": 0, "ai_api_url": "http://127.0.0.1:9/v1/chat/completions"})
+    # 先用掉唯一的令牌
+    assert bridge.wait_rate_limit("work", str(work["work_id"]))
+    result = bridge.generate_answer("你好")
+
+    assert result["answer"] == "太忙了"
+    assert result["source"] == "busy"
+    assert result["record"]["error"] == "RATE_LIMITED"
+    stats = work["stats"]
+    assert stats["busy_answers"] == 1
+    # 繁忙答复计入失败答复，收到问题 = 成功答复 + 失败答复
+    assert stats["total_questions"] == stats["successful_answers"] + stats["failed_answers"] == 1
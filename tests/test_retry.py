@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""统一重试策略测试：退避、重试预算和熔断器"""
+
+import time
+
+import pytest
+import requests
+
+import kitten_ai_bridge as bridge
+
+URL = "http://api.test/var/get"
+
+
+@pytest.fixture
+def work(use_work):
+    return use_work({"retry_base_delay": 0.001, "retry_max_delay": 0.002, "max_retries": 3,
+                     "breaker_failure_threshold": 5, "breaker_reset_timeout": 30})
+
+
+def failing_send(calls: list, error=requests.exceptions.ConnectionError):
+    def send():
+        calls.append(time.monotonic())
+        raise error("down")
+    return send
+
+
+def make_response(status: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = b'{"error": {"message": "busy"}}'
+    return response
+
+
+@pytest.mark.parametrize("base, cap", [(0.5, 8), (1, 3)])
+def test_backoff_is_bounded(use_work, base, cap):
+    use_work({"retry_base_delay": base, "retry_max_delay": cap})
+    for attempt in range(1, 12):
+        delays = [bridge.get_retry_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= min(cap, base * 2 ** attempt) for delay in delays)
+    # 全抖动：等待时间分散在上限以内，而不是固定值
+    assert len({round(bridge.get_retry_delay(5), 6) for _ in range(20)}) > 1
+
+
+def test_retries_until_success(work):
+    results = iter([requests.exceptions.Timeout("slow"), make_response(503), "ok"])
+
+    def send():
+        item = next(results)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    result = bridge.call_with_retry(URL, send, "API服务")
+    assert result == {"success": True, "response": "ok"}
+    assert work["stats"]["retries"] == 2
+    assert bridge.get_breaker(URL)["state"] == "closed"
+
+
+def test_non_retryable_status_is_returned(work):
+    calls = []
+
+    def send():
+        calls.append(1)
+        return make_response(404)
+
+    result = bridge.call_with_retry(URL, send, "API服务")
+    # 非可重试状态码交给调用方处理，不重试
+    assert result["success"] and result["response"].status_code == 404
+    assert len(calls) == 1
+
+
+def test_retry_budget_exhaustion_stops_retries(work):
+    work["config"]["retry_budget_ratio"] = 0
+    breaker = bridge.get_breaker(URL)
+    breaker["tokens"] = 1
+    calls = []
+
+    first = bridge.call_with_retry(URL, failing_send(calls), "API服务", max_retries=3)
+    # 只剩一个重试令牌：第一次请求 + 一次重试
+    assert len(calls) == 2
+    assert first["error"] == "CONNECTION_ERROR"
+    assert "重试预算已用完" in first["message"]
+
+    # 预算耗尽后新请求不再重试
+    calls.clear()
+    second = bridge.call_with_retry(URL, failing_send(calls), "API服务", max_retries=3)
+    assert len(calls) == 1
+    assert "重试预算已用完" in second["message"]
+
+
+def test_retry_budget_refills_per_request(work):
+    work["config"]["retry_budget_ratio"] = 0.5
+    breaker = bridge.get_breaker(URL)
+    breaker["tokens"] = 0
+    for _ in range(4):
+        bridge.call_with_retry(URL, lambda: "ok", "API服务")
+    assert breaker["tokens"] == pytest.approx(2)
+    for _ in range(100):
+        bridge.call_with_retry(URL, lambda: "ok", "API服务")
+    assert breaker["tokens"] == bridge.RETRY_BUDGET_MAX
+
+
+def test_breaker_opens_then_half_opens_then_closes(work):
+    work["config"]["breaker_failure_threshold"] = 2
+    calls = []
+    result = bridge.call_with_retry(URL, failing_send(calls), "API服务", max_retries=5)
+    breaker = bridge.get_breaker(URL)
+    # 连续失败达到阈值后打开，本次不再继续重试
+    assert len(calls) == 2
+    assert breaker["state"] == "open"
+    assert breaker["opens"] == 1
+    assert result["error"] == "CONNECTION_ERROR"
+
+    # 打开期间直接失败，不发出请求
+    calls.clear()
+    result = bridge.call_with_retry(URL, failing_send(calls), "API服务")
+    assert result["error"] == "CIRCUIT_OPEN"
+    assert calls == []
+    assert work["stats"]["circuit_rejections"] == 1
+
+    # 超过 breaker_reset_timeout 后半开，只放行一个探测请求
+    breaker["opened_at"] -= 31
+    assert bridge.breaker_allow(breaker)
+    assert breaker["state"] == "half_open"
+    assert not bridge.breaker_allow(breaker)
+    bridge.breaker_record(breaker, True)
+    assert breaker["state"] == "closed"
+    assert breaker["failures"] == 0
+
+    assert bridge.call_with_retry(URL, lambda: "ok", "API服务")["success"]
+
+
+def test_failed_probe_reopens_breaker(work):
+    work["config"]["breaker_failure_threshold"] = 2
+    breaker = bridge.get_breaker(URL)
+    bridge.call_with_retry(URL, failing_send([]), "API服务", max_retries=2)
+    assert breaker["state"] == "open"
+
+    breaker["opened_at"] -= 31
+    calls = []
+    result = bridge.call_with_retry(URL, failing_send(calls), "API服务", max_retries=3)
+    # 探测失败立即重新打开，不再重试
+    assert len(calls) == 1
+    assert result["error"] == "CONNECTION_ERROR"
+    assert breaker["state"] == "open"
+    assert breaker["opens"] == 2
+    assert time.monotonic() - breaker["opened_at"] < 1
+
+
+def test_unexpected_exception_releases_probe(work):
+    breaker = bridge.get_breaker(URL)
+    breaker.update(state="open", opened_at=time.monotonic() - 31)
+
+    def broken():
+        raise ValueError("bad payload")
+
+    result = bridge.call_with_retry(URL, broken, "API服务")
+    # 非网络错误不计入熔断，只释放探测名额，下一个请求可以继续探测
+    assert result["error"] == "EXCEPTION"
+    assert breaker["state"] == "half_open"
+    assert bridge.breaker_allow(breaker)
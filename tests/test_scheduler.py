@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""轮询调度测试"""
+
+import pytest
+
+import kitten_ai_bridge as bridge
+
+
+@pytest.fixture
+def work():
+    config = dict(bridge.DEFAULT_CONFIG)
+    config.update({"poll_interval_min": 1, "poll_interval_max": 10, "poll_backoff": 1.5})
+    work = bridge.create_work(100001, config)
+    token = bridge._current_work.set(work)
+    yield work
+    bridge._current_work.reset(token)
+
+
+def test_poll_interval_backs_off_to_max(work):
+    intervals = [bridge.get_poll_interval() for _ in range(10)]
+    assert intervals[0] == 1
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == 10
+
+
+def test_poll_interval_after_long_idle(work):
+    work["scheduler"]["idle_polls"] = 5000
+    assert bridge.get_poll_interval() == 10
+    # 到达上限后空闲计数不再增长
+    for _ in range(3000):
+        bridge.get_poll_interval()
+    assert work["scheduler"]["idle_polls"] <= 5000
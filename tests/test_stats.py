@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""统计检查点测试：原子保存和当日重启后恢复"""
+
+import json
+import os
+from datetime import datetime, timedelta
+
+import kitten_ai_bridge as bridge
+
+
+def fill_stats(work: dict):
+    """模拟运行一段时间后的统计数据"""
+    stats = work["stats"]
+    stats["start_time"] = datetime.now() - timedelta(minutes=30)
+    stats["online_periods"] = [[stats["start_time"], None]]
+    stats["total_polls"] = 120
+    stats["total_questions"] = 10
+    stats["successful_answers"] = 8
+    stats["failed_answers"] = 2
+    stats["retries"] = 3
+    stats["busy_answers"] = 1
+    stats["tokens"]["prompt"] = 500
+    stats["rate_limit"]["work"]["waits"] = 2
+    stats["rate_limit"]["work"]["wait_time"] = 1.5
+    for seconds in (0.2, 0.4, 0.8, 1.6, 3.2):
+        bridge.record_latency("ai", seconds)
+        bridge.record_latency("total", seconds + 0.1)
+    provider = {"name": "main", "timeout": 30}
+    bridge.record_provider_result(provider, True, 0.5)
+    bridge.record_provider_result(provider, False, 1.0)
+
+
+def snapshot(stats) -> dict:
+    return {
+        "counters": {key: stats[key] for key in ("total_polls", "total_questions", "successful_answers",
+                                                 "failed_answers", "retries", "busy_answers")},
+        "tokens": dict(stats["tokens"]),
+        "rate_limit": {level: dict(item) for level, item in stats["rate_limit"].items()},
+        "latency": {stage: (histogram["count"], list(histogram["counts"]))
+                    for stage, histogram in stats["latency"].items()},
+        "providers": {name: (item["requests"], item["failures"]) for name, item in stats["providers"].items()}
+    }
+
+
+def test_checkpoint_is_written_atomically(use_work, tmp_path):
+    work = use_work()
+    fill_stats(work)
+    assert bridge.save_stats(force=True)
+    path = bridge.get_stats_file_path()
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["successful_answers"] == 8
+    assert data["date"] == datetime.now().strftime("%Y-%m-%d")
+    # 没有残留的临时文件
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_checkpoint_respects_budget(use_work):
+    work = use_work({"stats_save_interval": 60, "stats_save_every": 5})
+    assert bridge.stats_checkpoint_due()
+    assert bridge.save_stats()
+    # 未到保存时机时只做内存中的比较，不写文件
+    assert not bridge.stats_checkpoint_due()
+    assert not bridge.save_stats()
+    work["stats"]["successful_answers"] += 5
+    assert bridge.stats_checkpoint_due()
+    assert bridge.save_stats()
+
+
+def test_same_day_restart_restores_stats(use_work):
+    first = use_work()
+    fill_stats(first)
+    bridge.save_stats(force=True)
+    expected = snapshot(first["stats"])
+
+    # 进程重启：重新创建统计后从检查点恢复
+    second = use_work()
+    assert bridge.load_stats()
+    restored = snapshot(second["stats"])
+    assert restored == expected
+    assert second["stats"]["online_periods"][0][0] == first["stats"]["online_periods"][0][0].replace(microsecond=0)
+
+    # 恢复后再保存、再恢复，计数不会重复累加
+    bridge.save_stats(force=True)
+    third = use_work()
+    assert bridge.load_stats()
+    assert snapshot(third["stats"]) == expected
+
+
+def test_stats_from_another_day_are_ignored(use_work):
+    work = use_work()
+    fill_stats(work)
+    bridge.save_stats(force=True)
+    path = bridge.get_stats_file_path()
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    data["date"] = "2000-01-01"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    use_work()
+    assert not bridge.load_stats()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""推送订阅测试：停止订阅时立即断开连接"""
+
+import time
+import threading
+
+import pytest
+
+import kitten_ai_bridge as bridge
+from stub_kitten_api import StubKittenApi
+
+WORK_ID = 100001
+
+
+@pytest.fixture
+def kitten():
+    stub = StubKittenApi(heartbeat=15).start()
+    yield stub
+    stub.stop()
+
+
+def start_watch(use_work, kitten):
+    use_work({"api_base_url": kitten.base_url, "log_level": "WARNING"})
+    watch_state = {"connected": False, "response": None, "abort": None, "stopped": False}
+    values = []
+    outcome = {}
+
+    def run():
+        outcome["reason"] = bridge.watch_variable(WORK_ID, watch_state, lambda value, var_type: values.append(value))
+
+    context = bridge.contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(run,), daemon=True)
+    thread.start()
+    return watch_state, values, outcome, thread
+
+
+def wait_until(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_stop_watch_closes_connection_immediately(use_work, kitten, capsys):
+    watch_state, values, outcome, thread = start_watch(use_work, kitten)
+    assert wait_until(lambda: watch_state["connected"], 5)
+
+    kitten.set_variable(WORK_ID, "API", "QWQ~~~你好")
+    assert wait_until(lambda: "QWQ~~~你好" in values, 5)
+
+    started = time.monotonic()
+    bridge.stop_watch(watch_state)
+    thread.join(5)
+    # 心跳间隔 15 秒、读超时 45 秒，不等到超时就返回
+    assert not thread.is_alive()
+    assert time.monotonic() - started < 1
+    assert not watch_state["connected"]
+    assert watch_state["abort"] is None
+    assert "无法直接关闭订阅连接" not in capsys.readouterr().out
+
+
+def test_stop_before_connect(use_work, kitten):
+    use_work({"api_base_url": kitten.base_url})
+    watch_state = {"connected": False, "response": None, "abort": None, "stopped": False}
+    bridge.stop_watch(watch_state)
+    # 已停止的订阅连接成功后立即返回
+    assert bridge.watch_variable(WORK_ID, watch_state, lambda value, var_type: None) == "已停止"
+
+
+def test_stop_watch_logs_when_connection_cannot_be_closed(use_work, capsys):
+    use_work({"log_level": "WARNING"})
+    handle = bridge.create_abort_handle()
+    watch_state = {"connected": True, "response": object(), "abort": handle, "stopped": False}
+    bridge.stop_watch(watch_state)
+    assert watch_state["stopped"]
+    assert handle["aborted"]
+    assert "无法直接关闭订阅连接" in capsys.readouterr().out